@@ -0,0 +1,47 @@
+"""
+Benchmark constructing a FairWorkflow from a graph that holds a lot of unrelated triples. The time
+and memory of FairWorkflow.from_rdf should depend on the size of the workflow, not on the size of
+the graph, since the graph is not copied.
+
+Run with: python benchmarks/bench_from_rdf.py
+"""
+import timeit
+import tracemalloc
+import warnings
+
+import rdflib
+
+from fairworkflows import FairWorkflow
+from fairworkflows.config import TESTS_RESOURCES
+
+WORKFLOW_URI = 'http://www.example.org/workflow1'
+
+
+def generate_graph(n_noise):
+    """The test workflow, together with n_noise unrelated triples."""
+    rdf = rdflib.ConjunctiveGraph()
+    rdf.parse(str(TESTS_RESOURCES / 'test_workflow.trig'), format='trig')
+    noise = rdflib.Namespace('http://www.example.org/noise#')
+    for i in range(n_noise):
+        rdf.add((noise[f'subject{i}'], noise.predicate, rdflib.Literal(i)))
+    return rdf
+
+
+def main():
+    # The steps of the test workflow are not fetched, which warns on every construction
+    warnings.simplefilter('ignore')
+    for n_noise in [0, 5000, 50000]:
+        rdf = generate_graph(n_noise)
+        t_from_rdf = min(timeit.repeat(
+            lambda: FairWorkflow.from_rdf(rdf, WORKFLOW_URI, fetch_references=False),
+            number=1, repeat=5))
+        tracemalloc.start()
+        FairWorkflow.from_rdf(rdf, WORKFLOW_URI, fetch_references=False)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{len(rdf):6d} triples: from_rdf {t_from_rdf * 1000:7.1f} ms, '
+              f'peak memory {peak_memory / 1024:7.1f} kB')
+
+
+if __name__ == '__main__':
+    main()
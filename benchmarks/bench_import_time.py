@@ -0,0 +1,83 @@
+"""
+Benchmark the time it takes to import fairworkflows, and a module that defines many FAIR steps
+and workflows, in a new python process, and list the slow dependencies that were imported along
+the way. The workflows are only built on first use, which is timed separately.
+
+Run with: python benchmarks/bench_import_time.py
+"""
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# Dependencies that are slow to import, fairworkflows imports them when they are used
+LAZY_MODULES = ['pyshacl', 'nanopub', 'networkx', 'graphviz', 'jinja2', 'rdflib.tools.rdf2dot']
+
+N_WORKFLOWS = 50
+
+STEPS = """
+from fairworkflows import is_fairstep, is_fairworkflow
+
+@is_fairstep(label='Addition')
+def add(a: float, b: float) -> float:
+    return a + b
+
+@is_fairstep(label='Multiplication')
+def mul(a: float, b: float) -> float:
+    return a * b
+"""
+
+WORKFLOW = """
+@is_fairworkflow(label='Workflow {i}')
+def workflow{i}(in1, in2):
+    t1 = add(in1, in2)
+    t2 = add(in2, in2)
+    return mul(t1, t2)
+"""
+
+
+def write_workflows_module(directory: Path, n_workflows: int) -> str:
+    """Write a module defining n_workflows workflows, returns the name of the module."""
+    name = f'workflows{n_workflows}'
+    source = STEPS + ''.join(WORKFLOW.format(i=i) for i in range(n_workflows))
+    (directory / f'{name}.py').write_text(source)
+    return name
+
+
+def time_new_process(code, repeat=5):
+    """The minimum time it takes to run code in a new python process, in seconds."""
+    return min(timeit.repeat(lambda: subprocess.run([sys.executable, '-c', code], check=True),
+                             number=1, repeat=repeat))
+
+
+def get_imported_lazy_modules(code):
+    code += f'\nimport sys\nprint(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return output.strip() or 'none'
+
+
+def main():
+    with TemporaryDirectory() as directory:
+        setup = f'import sys\nsys.path.insert(0, {directory!r})\n'
+        cases = [('import fairworkflows', 'import fairworkflows')]
+        for n_workflows in [1, N_WORKFLOWS]:
+            module = write_workflows_module(Path(directory), n_workflows)
+            cases.append((f'import {n_workflows} workflows', f'{setup}import {module}'))
+        cases.append((f'build {N_WORKFLOWS} workflows',
+                      f'{setup}import {module}\nfrom fairworkflows import FairWorkflow\n'
+                      + ''.join(f'FairWorkflow.from_function({module}.workflow{i})\n'
+                                for i in range(N_WORKFLOWS))))
+
+        t_python = time_new_process('pass')
+        for name, code in cases:
+            t_code = time_new_process(code)
+            print(f'{name:20s}: {(t_code - t_python) * 1000:7.1f} ms '
+                  f'(imported slow dependencies: {get_imported_lazy_modules(code)})')
+    t_lazy = time_new_process('\n'.join(f'import {module}' for module in LAZY_MODULES))
+    print(f'{"slow dependencies":20s}: {(t_lazy - t_python) * 1000:7.1f} ms to import them all')
+
+
+if __name__ == '__main__':
+    main()
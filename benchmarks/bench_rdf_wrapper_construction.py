@@ -0,0 +1,60 @@
+"""
+Benchmark creating RdfWrapper objects, as happens once per step execution for its StepRetroProv,
+comparing new_graph with binding the namespaces through Graph.bind as was done before.
+
+Run with: python benchmarks/bench_rdf_wrapper_construction.py
+"""
+import timeit
+
+import rdflib
+
+from fairworkflows import FairStep, FairVariable, LinguisticSystem
+from fairworkflows.linguistic_system import LINGSYS_PYTHON
+from fairworkflows.prov import StepRetroProv
+from fairworkflows.rdf_wrapper import NAMESPACE_BINDINGS, RdfWrapper, new_graph
+
+N_OBJECTS = 10000
+
+
+def bound_graph():
+    rdf = rdflib.Graph()
+    for prefix, namespace in NAMESPACE_BINDINGS:
+        rdf.bind(prefix, namespace)
+    return rdf
+
+
+def merge_language(rdf, ref, language: LinguisticSystem):
+    rdf += language.generate_rdf(ref)
+
+
+def add_language(rdf, ref, language: LinguisticSystem):
+    rdf.addN(triple + (rdf,) for triple in language.triples(ref))
+
+
+def time_per_object(func, number=N_OBJECTS):
+    """The minimum time func takes, in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    ref = rdflib.BNode('LinguisticSystem')
+    for name, t_before, t_after in [
+            ('graph with namespaces', time_per_object(bound_graph), time_per_object(new_graph)),
+            ('set language',
+             time_per_object(lambda: merge_language(rdflib.Graph(), ref, LINGSYS_PYTHON)),
+             time_per_object(lambda: add_language(rdflib.Graph(), ref, LINGSYS_PYTHON)))]:
+        print(f'{name:25s}: before {t_before:8.1f} us, after {t_after:8.1f} us, '
+              f'speedup {t_before / t_after:5.1f}x')
+
+    step = FairStep(label='step', inputs=[FairVariable(name='a', computational_type='int')],
+                    outputs=[FairVariable(name='out1', computational_type='int')])
+    for name, func in [('RdfWrapper', lambda: RdfWrapper(uri=None)),
+                       ('RdfWrapper with language',
+                        lambda: RdfWrapper(uri=None, language=LINGSYS_PYTHON)),
+                       ('StepRetroProv', lambda: StepRetroProv(step=step, step_args={'a': 1},
+                                                               output=2))]:
+        print(f'{name:25s}: {time_per_object(func, number=N_OBJECTS // 10):8.1f} us per object')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark extracting the triples relevant to a step or workflow from a large RDF graph, comparing
+the breadth-first traversal in get_reachable_triples with the SPARQL property path query that was
+used before.
+
+Run with: python benchmarks/bench_relevant_triples.py
+"""
+import timeit
+
+import rdflib
+
+from fairworkflows.rdf_wrapper import get_reachable_triples
+
+SPARQL_QUERY = """
+CONSTRUCT { ?s ?p ?o }
+WHERE {
+    ?s ?p ?o .
+    ?root (<>|!<>)* ?s .
+}
+"""
+
+
+def generate_graph(n_nodes):
+    """A tree of n_nodes reachable from the root, and as many unreachable nodes."""
+    ex = rdflib.Namespace('http://www.example.org/')
+    rdf = rdflib.Graph()
+    for i in range(1, n_nodes):
+        rdf.add((ex[f'node{i // 3}'], ex.hasChild, ex[f'node{i}']))
+        rdf.add((ex[f'node{i}'], rdflib.RDFS.label, rdflib.Literal(f'Node {i}')))
+        rdf.add((ex[f'other{i // 3}'], ex.hasChild, ex[f'other{i}']))
+    return rdf, ex.node0
+
+
+def sparql_reachable_triples(rdf, root):
+    g = rdflib.Graph()
+    for triple in rdf.query(SPARQL_QUERY, initBindings={'root': root}):
+        g.add(triple)
+    return g
+
+
+def main():
+    for n_nodes in [100, 1000, 3000]:
+        rdf, root = generate_graph(n_nodes)
+        assert set(get_reachable_triples(rdf, root)) == set(sparql_reachable_triples(rdf, root))
+        t_traversal = min(timeit.repeat(lambda: get_reachable_triples(rdf, root),
+                                        number=1, repeat=3))
+        t_sparql = min(timeit.repeat(lambda: sparql_reachable_triples(rdf, root),
+                                     number=1, repeat=3))
+        print(f'{len(rdf):6d} triples: traversal {t_traversal * 1000:9.1f} ms, '
+              f'sparql {t_sparql * 1000:9.1f} ms, speedup {t_sparql / t_traversal:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
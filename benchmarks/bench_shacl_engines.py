@@ -0,0 +1,54 @@
+"""
+Benchmark validating workflows of increasing size against the PLEX shacl shapes, comparing the
+native validator with pyshacl (with rdfs inference).
+
+Run with: python benchmarks/bench_shacl_engines.py
+"""
+import timeit
+
+import rdflib
+from rdflib import RDF, RDFS, DCTERMS
+
+from fairworkflows import namespaces
+from fairworkflows.rdf_wrapper import get_plex_validator, plex_shacl_validate
+
+
+def generate_workflow_rdf(n_steps):
+    """A plan with a chain of n_steps steps, each with an input and output variable."""
+    ex = rdflib.Namespace('http://www.example.org/')
+    rdf = rdflib.Graph()
+    rdf.add((ex.plan, RDF.type, namespaces.PPLAN.Plan))
+    rdf.add((ex.plan, RDFS.label, rdflib.Literal('Plan')))
+    for i in range(n_steps):
+        step = ex[f'step{i}']
+        rdf.add((step, RDF.type, namespaces.PPLAN.Step))
+        rdf.add((step, RDF.type, namespaces.BPMN.ScriptTask))
+        rdf.add((step, RDFS.label, rdflib.Literal(f'Step {i}')))
+        rdf.add((step, DCTERMS.description, rdflib.Literal(f'Step number {i}')))
+        rdf.add((step, namespaces.PPLAN.isStepOfPlan, ex.plan))
+        for predicate, variable in [(namespaces.PPLAN.hasInputVar, ex[f'var{i}']),
+                                    (namespaces.PPLAN.hasOutputVar, ex[f'var{i + 1}'])]:
+            rdf.add((step, predicate, variable))
+            rdf.add((variable, RDF.type, namespaces.PPLAN.Variable))
+            rdf.add((variable, RDFS.label, rdflib.Literal(f'var{i}')))
+        if i > 0:
+            rdf.add((ex[f'step{i - 1}'], namespaces.DUL.precedes, step))
+    return rdf
+
+
+def main():
+    get_plex_validator()  # Compile the shapes once, like pyshacl's shapes graph is cached
+    for n_steps in [1, 10, 100, 500]:
+        rdf = generate_workflow_rdf(n_steps)
+        assert plex_shacl_validate(rdf, engine='native')[0]
+        assert plex_shacl_validate(rdf, engine='pyshacl')[0]
+        t_native = min(timeit.repeat(lambda: plex_shacl_validate(rdf, engine='native'),
+                                     number=1, repeat=3))
+        t_pyshacl = min(timeit.repeat(lambda: plex_shacl_validate(rdf, engine='pyshacl'),
+                                      number=1, repeat=3))
+        print(f'{len(rdf):6d} triples: native {t_native * 1000:9.1f} ms, '
+              f'pyshacl {t_pyshacl * 1000:9.1f} ms, speedup {t_pyshacl / t_native:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import pytest
 import rdflib
 import requests
 from fairworkflows.config import TESTS_RESOURCES
+from fairworkflows.nanopub_cache import NanopubCache
 
 NANOPUB_SERVER = 'http://purl.org/np/'
 
@@ -10,6 +11,14 @@ skip_if_nanopub_server_unavailable = (
                        reason='Nanopub server is unavailable'))
 
 
+@pytest.fixture(autouse=True)
+def empty_nanopub_cache(tmp_path, monkeypatch):
+    """Use an empty nanopub cache in a temporary directory for every test."""
+    cache = NanopubCache(tmp_path / 'nanopub_cache')
+    monkeypatch.setattr('fairworkflows.nanopub_cache.nanopub_cache', cache)
+    monkeypatch.setattr('fairworkflows.rdf_wrapper.nanopub_cache', cache)
+
+
 def read_rdf_test_resource(filename: str) -> rdflib.Graph():
     """
     Read RDF from a test resource
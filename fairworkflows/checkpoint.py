@@ -0,0 +1,113 @@
+import contextvars
+import json
+import os
+import pickle
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from fairworkflows.config import CHECKPOINT_ENVIRONMENT_VARIABLE
+from fairworkflows.disk_store import write_atomic
+from fairworkflows.value_policy import ValuePolicy
+
+
+class Checkpoint:
+    """
+    Directory that the completed steps of an execution are persisted to as they finish, so a
+    failed execution can be resumed without executing them again.
+
+    Every completed step call is stored by its `result_cache_key`: the StepExecutionRecord
+    (including the output) pickled in `<key>.pickle`, and its StepRetroProv as N-Triples in
+    `<key>.nt`. Step calls with arguments or outputs that can not be pickled are not stored.
+
+    Args:
+        directory: The directory to store the completed steps in, created on first use.
+        resume_from: The directory of the checkpoint of a previous execution, steps that were
+            completed there are taken from it instead of being executed again (and are also
+            stored in directory). Defaults to None, i.e. no steps are skipped.
+        value_policy: How to record the input and output values in the stored StepRetroProv,
+            see StepRetroProv. Worker processes always use the default policy.
+    """
+    def __init__(self, directory: Path, resume_from: Path = None,
+                 value_policy: ValuePolicy = None):
+        self.directory = Path(directory)
+        self.resume_from = None if resume_from is None else Path(resume_from)
+        self.value_policy = value_policy
+
+    def _path(self, directory: Path, key: str, suffix: str) -> Path:
+        return directory / (key + suffix)
+
+    def load(self, key: str):
+        """Get the StepExecutionRecord of a step call completed in resume_from, or None.
+
+        The record has no step, the caller associates it with the executed step.
+        """
+        if self.resume_from is None:
+            return None
+        try:
+            with open(self._path(self.resume_from, key, '.pickle'), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.resume_from != self.directory:
+            # Keep the checkpoint of this execution complete, so it can be resumed in turn
+            try:
+                with open(self._path(self.resume_from, key, '.nt'), 'rb') as f:
+                    write_atomic(self._path(self.directory, key, '.nt'), f.read())
+            except FileNotFoundError:
+                pass
+            write_atomic(self._path(self.directory, key, '.pickle'), data)
+        return pickle.loads(data)
+
+    def save(self, key: str, record):
+        """Store the StepExecutionRecord of a completed step call, with its StepRetroProv."""
+        try:
+            data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        step_prov = record.to_step_retro_prov(value_policy=self.value_policy)
+        # The record is written last, a step call only counts as completed once it exists
+        write_atomic(self._path(self.directory, key, '.nt'), step_prov.rdf.serialize(format='nt'))
+        write_atomic(self._path(self.directory, key, '.pickle'), data)
+
+    def __len__(self) -> int:
+        """The number of step calls stored in directory."""
+        if not self.directory.exists():
+            return 0
+        return sum(1 for _ in self.directory.glob('*.pickle'))
+
+    @contextmanager
+    def activate(self):
+        """Make this the checkpoint of the current execution context, see `get_checkpoint`."""
+        token = _current_checkpoint.set(self)
+        try:
+            yield self
+        finally:
+            _current_checkpoint.reset(token)
+
+    def worker_environment(self) -> Dict[str, str]:
+        """The environment variables that make worker processes use this checkpoint."""
+        return {CHECKPOINT_ENVIRONMENT_VARIABLE: json.dumps(
+            {'directory': str(self.directory),
+             'resume_from': None if self.resume_from is None else str(self.resume_from)})}
+
+
+def _get_worker_checkpoint() -> Optional[Checkpoint]:
+    """Get the checkpoint of the parent process, if this is a worker process that has one."""
+    config = os.environ.get(CHECKPOINT_ENVIRONMENT_VARIABLE)
+    if config is None:
+        return None
+    return Checkpoint(**json.loads(config))
+
+
+# The checkpoint of the parent process, if this is a worker process. It is read once when the
+# worker starts, the parent process only sets it while starting its workers.
+WORKER_CHECKPOINT = _get_worker_checkpoint()
+
+_current_checkpoint = contextvars.ContextVar('checkpoint', default=None)
+
+
+def get_checkpoint() -> Optional[Checkpoint]:
+    """Get the Checkpoint of the current execution context, or None if steps are not persisted."""
+    checkpoint = _current_checkpoint.get()
+    return WORKER_CHECKPOINT if checkpoint is None else checkpoint
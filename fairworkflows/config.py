@@ -19,3 +19,46 @@ WARN_FOR_TYPE_HINTING = False
 
 MANUAL_ASSISTANT_HOST = 'localhost'
 MANUAL_ASSISTANT_PORT = 8000
+
+# Local cache of fetched nanopublications
+NANOPUB_CACHE_DIR = Path.home() / '.fairworkflows' / 'nanopub_cache'
+NANOPUB_CACHE_MAX_SIZE = 100 * 1024 * 1024  # bytes
+
+# Maximum number of steps that are fetched from the nanopub server at the same time
+MAX_CONCURRENT_STEP_FETCHES = 8
+
+# Maximum number of nanopublications that are published at the same time
+MAX_CONCURRENT_PUBLICATIONS = 8
+
+# Noodles runners that can be used to execute a FairWorkflow
+EXECUTION_BACKENDS = ('single', 'threads', 'processes')
+
+# Backends that can be used to run a compiled ExecutionPlan
+PLAN_EXECUTION_BACKENDS = ('single', 'threads')
+
+# Engines that can be used to validate against the PLEX shacl shapes
+SHACL_ENGINES = ('pyshacl', 'native')
+
+# Number of step executions a ProvFileSink buffers before appending them to its file
+PROV_SINK_BATCH_SIZE = 100
+
+# Environment variable pointing worker processes to the directory to spool provenance to
+PROV_SPOOL_ENVIRONMENT_VARIABLE = 'FAIRWORKFLOWS_PROV_SPOOL'
+
+# Caches of the results of step executions, see fairworkflows.result_cache
+RESULT_CACHE_DIR = Path.home() / '.fairworkflows' / 'result_cache'
+RESULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # bytes
+MEMORY_RESULT_CACHE_MAX_SIZE = 100 * 1024 * 1024  # bytes
+
+# Environment variable pointing worker processes to the directory of the result cache to use
+RESULT_CACHE_ENVIRONMENT_VARIABLE = 'FAIRWORKFLOWS_RESULT_CACHE'
+
+# Environment variable pointing worker processes to the checkpoint of the execution
+CHECKPOINT_ENVIRONMENT_VARIABLE = 'FAIRWORKFLOWS_CHECKPOINT'
+
+# Values of step inputs and outputs with a longer string representation are not inlined in the
+# retrospective provenance, but referenced by their content hash (see ValuePolicy)
+PROV_INLINE_VALUE_MAX_LENGTH = 1024
+
+# Content-addressed store of the values that are referenced from retrospective provenance
+BLOB_STORE_DIR = Path.home() / '.fairworkflows' / 'blobs'
@@ -0,0 +1,105 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+def write_atomic(path: Path, data: bytes):
+    """Write data to path through a temporary file, so other threads and processes (or an
+    interrupted execution) never leave or read a half-written file. Creates the directory."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class LruDirectory:
+    """
+    Files in a directory, of which the least recently used are evicted when their total size
+    exceeds a maximum. Used by the on-disk caches, that can be shared by processes.
+
+    The total size of the files is tracked in memory, so storing a file does not scan the
+    directory. The directory is only scanned on the first write, and when the tracked size
+    exceeds the maximum. Files that were added or removed by other processes are accounted for
+    at the next scan.
+
+    Args:
+        directory: The directory of the files, created on first use.
+        suffix: The suffix of the files, other files in the directory are ignored.
+    """
+    def __init__(self, directory: Path, suffix: str):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self._size = None  # The total size of the files, None until the directory is scanned
+
+    def path(self, name: str) -> Path:
+        return self.directory / (name + self.suffix)
+
+    def read(self, name: str) -> Optional[bytes]:
+        """Get the content of a file and mark it as recently used, or None if it does not exist."""
+        path = self.path(name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return data
+
+    def write(self, name: str, data: bytes, max_size: int):
+        """Write a file, and evict the least recently used files if they exceed max_size."""
+        path = self.path(name)
+        try:
+            previous_size = path.stat().st_size
+        except FileNotFoundError:
+            previous_size = 0
+        write_atomic(path, data)
+        with self.lock:
+            if self._size is not None:
+                self._size += len(data) - previous_size
+            if self._size is None or self._size > max_size:
+                self._evict(max_size)
+
+    def remove(self, name: str):
+        """Remove a file, if it exists."""
+        path = self.path(name)
+        with self.lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self, max_size: int):
+        """Remove least recently used files until they fit in max_size, must hold the lock."""
+        entries = []
+        for path in self.directory.glob('*' + self.suffix):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        self._size = total_size
+
+    def clear(self):
+        """Remove all files."""
+        with self.lock:
+            for path in self.directory.glob('*' + self.suffix):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._size = None
@@ -0,0 +1,286 @@
+import contextvars
+import inspect
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple, Union
+
+from fairworkflows.config import PLAN_EXECUTION_BACKENDS
+from fairworkflows.fairstep import FairStep
+from fairworkflows.prov import ProvLogger, WorkflowRetroProv
+from fairworkflows.result_cache import ResultCache
+from fairworkflows.value_policy import ValuePolicy
+
+
+class WorkflowInput:
+    """Placeholder for an input argument of a workflow function, while its steps are traced."""
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f'WorkflowInput({self.name!r})'
+
+
+def contains_workflow_input(value) -> bool:
+    """Whether value is, or is a container holding, a WorkflowInput."""
+    if isinstance(value, WorkflowInput):
+        return True
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return any(contains_workflow_input(item) for item in value)
+    if isinstance(value, dict):
+        return any(contains_workflow_input(item) for item in value.values())
+    return False
+
+
+# Kinds of sources of the value of a step argument: a constant value, the input of the plan
+# with the name source, or the result of the plan step with index source (or item of it)
+CONSTANT = 'constant'
+INPUT = 'input'
+STEP = 'step'
+
+Binding = namedtuple('Binding', ['kind', 'source', 'item'], defaults=[None])
+
+
+class PlanStep(NamedTuple):
+    """
+    A call of a step function in an ExecutionPlan.
+
+    Args:
+        step: The step that is called.
+        function: The function to call, that logs the execution of the step.
+        args: The bindings of the positional arguments.
+        kwargs: The (name, binding) pairs of the keyword arguments.
+        dependencies: The indices of the plan steps whose results are arguments of this call.
+        dependents: The indices of the plan steps that have the result of this call as argument.
+    """
+    step: FairStep
+    function: Callable
+    args: Tuple[Binding, ...]
+    kwargs: Tuple[Tuple[str, Binding], ...]
+    dependencies: Tuple[int, ...]
+    dependents: Tuple[int, ...]
+
+
+class _PlanRun:
+    """The state of one run of an ExecutionPlan."""
+    __slots__ = ('inputs', 'results', 'remaining', 'prov_logger', 'context')
+
+    def __init__(self, inputs: Dict, plan: 'ExecutionPlan', result_cache: ResultCache = None):
+        self.inputs = inputs
+        self.results = [None] * len(plan.steps)
+        # The number of dependencies of every step that did not finish yet
+        self.remaining = [len(plan_step.dependencies) for plan_step in plan.steps]
+        # Every run logs to its own logger, steps run in (a copy of) this context
+        self.prov_logger = ProvLogger()
+        with ExitStack() as stack:
+            stack.enter_context(self.prov_logger.activate())
+            if result_cache is not None:
+                stack.enter_context(result_cache.activate())
+            self.context = contextvars.copy_context()
+
+
+class ExecutionPlan:
+    """
+    A compiled FairWorkflow: its step calls in topological order, where the arguments of every
+    call come from, and which calls depend on each other. See `FairWorkflow.compile`.
+
+    The plan only holds tuples and is not changed by running it, so it can be run many times
+    (also concurrently) with different inputs, without tracing or analysing the workflow again.
+
+    Args:
+        workflow: The workflow that the plan was compiled from.
+        steps: The step calls, in topological order.
+        inputs: The names of the inputs of the plan, in the order of positional arguments.
+        result: The binding of the result of the plan.
+    """
+    def __init__(self, workflow, steps: Sequence[PlanStep], inputs: Sequence[str],
+                 result: Binding):
+        self.workflow = workflow
+        self.steps = tuple(steps)
+        self.inputs = tuple(inputs)
+        self.result = result
+        # The steps that can run as soon as a run starts
+        self.initial_steps = tuple(index for index, plan_step in enumerate(self.steps)
+                                   if not plan_step.dependencies)
+
+    @classmethod
+    def from_calls(cls, workflow, calls: Sequence[Tuple[FairStep, Callable, Tuple, Tuple,
+                                                        Sequence[int]]],
+                   inputs: Sequence[str], result: Binding) -> 'ExecutionPlan':
+        """Create a plan from (step, function, args, kwargs, dependencies) tuples, in
+        topological order. The dependents of every step are derived from the dependencies."""
+        # A step can depend on another step more than once (i.e. f(x, x)), but it is only
+        # counted once, so it runs as soon as all its distinct dependencies finished
+        unique_dependencies = [tuple(dict.fromkeys(dependencies))
+                               for _, _, _, _, dependencies in calls]
+        dependents = [[] for _ in calls]
+        for index, dependencies in enumerate(unique_dependencies):
+            for dependency in dependencies:
+                if dependency >= index:
+                    raise RuntimeError('The steps of the plan are not in topological order')
+                dependents[dependency].append(index)
+        steps = [PlanStep(step, function, tuple(args), tuple(kwargs), unique_dependencies[index],
+                          tuple(dependents[index]))
+                 for index, (step, function, args, kwargs, _) in enumerate(calls)]
+        return cls(workflow, steps, inputs, result)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def run(self, *args, backend: str = 'single', n_workers: int = None,
+            result_cache: ResultCache = None, value_policy: ValuePolicy = None, **kwargs):
+        """Run the plan once.
+
+        Args:
+            args: Positional inputs of the plan.
+            backend (str): 'single' to call the steps one after the other, or 'threads' to call
+                independent steps in parallel in a pool of threads.
+            n_workers (int): The number of threads, defaults to the number of CPUs.
+            result_cache (ResultCache): Take the results of steps from this cache if they were
+                called with the same arguments before, see `FairWorkflow.execute`.
+            value_policy (ValuePolicy): Decides which values are inlined in the retrospective
+                provenance, see `FairWorkflow.execute`.
+            kwargs: Inputs of the plan by name.
+
+        Returns a tuple (result, retroprov), as `FairWorkflow.execute`.
+        """
+        return self._run([self._bind_inputs(args, kwargs)], backend=backend,
+                         n_workers=n_workers, result_cache=result_cache,
+                         value_policy=value_policy)[0]
+
+    def run_many(self, input_sets: Sequence[Union[Dict, Sequence]], backend: str = 'single',
+                 n_workers: int = None, result_cache: ResultCache = None,
+                 value_policy: ValuePolicy = None) -> List[Tuple[object, WorkflowRetroProv]]:
+        """Run the plan for every set of inputs.
+
+        With the 'threads' backend all runs share one pool of threads, and the steps of all runs
+        are scheduled as soon as their arguments are available.
+
+        Args:
+            input_sets: The inputs of every run, either a dict of inputs by name or a sequence of
+                positional inputs.
+            backend, n_workers, result_cache, value_policy: See `run`.
+
+        Returns a list with a tuple (result, retroprov) for every set of inputs.
+        """
+        inputs = [self._bind_inputs((), input_set) if isinstance(input_set, dict)
+                  else self._bind_inputs(input_set, {}) for input_set in input_sets]
+        return self._run(inputs, backend=backend, n_workers=n_workers,
+                         result_cache=result_cache, value_policy=value_policy)
+
+    def _run(self, inputs: List[Dict], backend: str, n_workers: int, result_cache: ResultCache,
+             value_policy: ValuePolicy) -> List[Tuple[object, WorkflowRetroProv]]:
+        if backend not in PLAN_EXECUTION_BACKENDS:
+            raise ValueError(f'Unknown plan execution backend {backend}, '
+                             f'choose one of {", ".join(PLAN_EXECUTION_BACKENDS)}')
+        runs = [_PlanRun(run_inputs, self, result_cache) for run_inputs in inputs]
+        if backend == 'single':
+            for run in runs:
+                run.context.run(self._run_sequentially, run)
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count() or 1) as executor:
+                self._run_in_pool(runs, executor)
+        return [(self._resolve(self.result, run),
+                 self.workflow._generate_retrospective_prov_publication(
+                     run.prov_logger.get_all(), value_policy=value_policy))
+                for run in runs]
+
+    def _bind_inputs(self, args: Sequence, kwargs: Dict) -> Dict:
+        """Get the inputs of a run by name."""
+        if len(args) > len(self.inputs):
+            raise TypeError(f'The plan takes {len(self.inputs)} inputs, but {len(args)} '
+                            f'were given')
+        bound = dict(zip(self.inputs, args))
+        for name, value in kwargs.items():
+            if name not in self.inputs:
+                raise TypeError(f'The plan got an unexpected input {name}')
+            if name in bound:
+                raise TypeError(f'The plan got multiple values for input {name}')
+            bound[name] = value
+        missing = [name for name in self.inputs if name not in bound]
+        if missing:
+            raise TypeError(f'The plan is missing inputs: {", ".join(missing)}')
+        return bound
+
+    @staticmethod
+    def _resolve(binding: Binding, run: _PlanRun):
+        """Get the value of a binding in a run."""
+        if binding.kind == STEP:
+            value = run.results[binding.source]
+            return value if binding.item is None else value[binding.item]
+        if binding.kind == INPUT:
+            return run.inputs[binding.source]
+        return binding.source
+
+    def _call(self, index: int, run: _PlanRun):
+        plan_step = self.steps[index]
+        args = [self._resolve(binding, run) for binding in plan_step.args]
+        kwargs = {name: self._resolve(binding, run) for name, binding in plan_step.kwargs}
+        return plan_step.function(*args, **kwargs)
+
+    def _run_sequentially(self, run: _PlanRun):
+        for index in range(len(self.steps)):
+            run.results[index] = self._call(index, run)
+
+    def _run_in_pool(self, runs: List[_PlanRun], executor: ThreadPoolExecutor):
+        """Call the steps of all runs in the pool, each as soon as its dependencies finished."""
+        pending = {}
+
+        def submit(run: _PlanRun, index: int):
+            # A context can only be entered by one thread at a time, every call gets a copy
+            future = executor.submit(run.context.copy().run, self._call, index, run)
+            pending[future] = run, index
+
+        for run in runs:
+            for index in self.initial_steps:
+                submit(run, index)
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    run, index = pending.pop(future)
+                    run.results[index] = future.result()
+                    for dependent in self.steps[index].dependents:
+                        run.remaining[dependent] -= 1
+                        if run.remaining[dependent] == 0:
+                            submit(run, dependent)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+
+def topological_order(dependencies: Dict, keys: Sequence) -> List:
+    """Order keys so that every key comes after its dependencies, ties are kept in order.
+
+    Raises:
+        RuntimeError: If the dependencies contain a cycle.
+    """
+    remaining = {key: len(dependencies.get(key, ())) for key in keys}
+    dependents = {key: [] for key in keys}
+    for key in keys:
+        for dependency in dependencies.get(key, ()):
+            dependents[dependency].append(key)
+    ready = [key for key in keys if remaining[key] == 0]
+    order = []
+    while ready:
+        key = ready.pop(0)
+        order.append(key)
+        for dependent in dependents[key]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    if len(order) != len(keys):
+        raise RuntimeError('Cannot order the steps, their dependencies contain a cycle')
+    return order
+
+
+def bind_call(signature: inspect.Signature, arguments: Dict[str, object]
+              ) -> Tuple[Tuple[Binding, ...], Tuple[Tuple[str, Binding], ...]]:
+    """Get the positional and keyword argument bindings of a call, from the bindings by
+    parameter name (a tuple of bindings for *args, a dict of bindings for **kwargs)."""
+    bound = inspect.BoundArguments(signature, arguments)
+    return tuple(bound.args), tuple(bound.kwargs.items())
@@ -1,11 +1,12 @@
 import functools
 import sys
 import inspect
+import time
 import typing
-from copy import deepcopy
-from typing import Callable, get_type_hints, List, Union
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, get_type_hints, List, Union, Dict, Optional, Sequence
 from urllib.parse import urldefrag
-from datetime import datetime
 from warnings import warn
 
 import noodles
@@ -13,11 +14,13 @@ import rdflib
 from rdflib import RDF, RDFS, DCTERMS
 
 from fairworkflows import namespaces, LinguisticSystem, LINGSYS_ENGLISH, LINGSYS_PYTHON
+from fairworkflows.checkpoint import get_checkpoint
 from fairworkflows.config import DUMMY_FAIRWORKFLOWS_URI, IS_FAIRSTEP_RETURN_VALUE_PARAMETER_NAME, \
-    LOGGER, WARN_FOR_TYPE_HINTING
-from fairworkflows.prov import prov_logger, StepRetroProv
-from fairworkflows.rdf_wrapper import RdfWrapper, replace_in_rdf
-from fairworkflows import manual_assistant
+    LOGGER, WARN_FOR_TYPE_HINTING, MAX_CONCURRENT_PUBLICATIONS
+from fairworkflows.prov import get_prov_logger, StepExecutionRecord
+from fairworkflows.result_cache import get_result_cache, result_cache_key, step_fingerprint
+from fairworkflows.rdf_wrapper import RdfWrapper, get_reachable_triples, copy_triples, \
+    get_nanopub_client
 
 
 class FairVariable:
@@ -75,13 +78,38 @@ class FairVariable:
         return self.name == other.name and ((self.computational_type == other.computational_type) or (self.computational_type is None))
 
     def __hash__(self):
-        return hash(str(self))
+        # Equal variables have equal names, and a str caches its own hash
+        return hash(self.name)
 
     def __str__(self):
         return (f'FairVariable {self.name} of computational type: {self.computational_type},'
                 f'semantic types: {self.semantic_types}.\nHas URI {self.uri}.\n')
 
 
+class _VariableIndex:
+    """
+    The input and output variables of a step, as read from the step rdf.
+
+    It is valid as long as the step has the same rdf graph and uri, and the modification count of
+    the step did not change, i.e. the rdf was not changed through the step or assigned to
+    `FairStep.rdf`. Changes made directly on the graph are not noticed until it is assigned again.
+    """
+    __slots__ = ('rdf', 'modification_count', 'step_uri', 'inputs', 'outputs')
+
+    def __init__(self, step):
+        self.rdf = step._rdf
+        self.modification_count = step._modification_count
+        self.step_uri = step._uri
+        self.inputs = tuple(step._get_variable(var_ref) for var_ref
+                            in step.get_attribute(namespaces.PPLAN.hasInputVar, return_list=True))
+        self.outputs = tuple(step._get_variable(var_ref) for var_ref
+                             in step.get_attribute(namespaces.PPLAN.hasOutputVar, return_list=True))
+
+    def is_valid_for(self, step) -> bool:
+        return (self.rdf is step._rdf and self.modification_count == step._modification_count
+                and self.step_uri == step._uri)
+
+
 class FairStep(RdfWrapper):
     """Represent a step in a fair workflow.
 
@@ -113,6 +141,7 @@ class FairStep(RdfWrapper):
                  language: LinguisticSystem = LINGSYS_ENGLISH,
                  inputs: List[FairVariable] = None,
                  outputs: List[FairVariable] = None, derived_from=None):
+        self._variable_index = None
         super().__init__(uri=uri, ref_name='step', derived_from=derived_from, language=language)
 
         if label is not None:
@@ -137,7 +166,8 @@ class FairStep(RdfWrapper):
             self._uri = DUMMY_FAIRWORKFLOWS_URI + '#step' + str(hash(self))
 
         self._is_modified = False
-        self._workflows = set()
+        # The workflows this step is part of, weakly referenced so they can be garbage collected
+        self._workflows = weakref.WeakSet()
 
     @classmethod
     def from_rdf(cls, rdf, uri, fetch_references: bool = False, force: bool = False,
@@ -159,7 +189,7 @@ class FairStep(RdfWrapper):
         if remove_irrelevant_triples:
             self._rdf = self._get_relevant_triples(uri, rdf)
         else:
-            self._rdf = deepcopy(rdf)  # Make sure we don't mutate user RDF
+            self._rdf = copy_triples(rdf)  # Make sure we don't mutate user RDF
         self.anonymise_rdf()
         return self
 
@@ -173,25 +203,11 @@ class FairStep(RdfWrapper):
             step uri. So if 'URI predicate Something', then all triples 'Something predicate
             object' are selected, and so forth.
         """
-        # Remove workflow-related triples from the graph, they effectively make other steps or
-        # the whole workflow 'children' of a step so it is important to to this before the query
-        # TODO:  This would be neater to do in a subquery.
-        rdf = deepcopy(rdf)
-        rdf.remove((None, namespaces.DUL.precedes, None))
-        rdf.remove((None, namespaces.PPLAN.isStepOfPlan, None))
-        q = """
-        CONSTRUCT { ?s ?p ?o }
-        WHERE {
-            ?s ?p ?o .
-            # Match all triples that are through an arbitrary-length property path related to the
-            # step uri. (<>|!<>) matches all predicates. Binding to step_uri is done when executing.
-            ?step_uri (<>|!<>)* ?s .
-        }
-        """
-        g = rdflib.Graph(namespace_manager=rdf.namespace_manager)
-        for triple in rdf.query(q, initBindings={'step_uri': rdflib.URIRef(uri)}):
-            g.add(triple)
-        return g
+        # Workflow-related triples effectively make other steps or the whole workflow 'children'
+        # of a step, so it is important to not follow them.
+        return get_reachable_triples(rdf, rdflib.URIRef(uri),
+                                     excluded_predicates=[namespaces.DUL.precedes,
+                                                          namespaces.PPLAN.isStepOfPlan])
 
     @classmethod
     def from_function(cls, func: Callable):
@@ -254,6 +270,12 @@ class FairStep(RdfWrapper):
         else:
             self.remove_attribute(RDF.type, object=namespaces.BPMN.ScriptTask)
 
+    def _get_variables(self) -> _VariableIndex:
+        """Get the index of the input and output variables, read again if the rdf changed."""
+        if self._variable_index is None or not self._variable_index.is_valid_for(self):
+            self._variable_index = _VariableIndex(self)
+        return self._variable_index
+
     def _get_variable(self, var_ref: Union[rdflib.term.BNode, rdflib.URIRef]) -> FairVariable:
         """Retrieve a specific FairVariable from the RDF triples."""
 
@@ -281,6 +303,7 @@ class FairStep(RdfWrapper):
         self._rdf.add((var_ref, RDFS.label, rdflib.term.Literal(variable.name)))
         for sem_var in variable.semantic_types:
             self._rdf.add((var_ref, RDF.type, sem_var))
+        self._modification_count += 1
 
     @property
     def inputs(self) -> List[FairVariable]:
@@ -290,9 +313,10 @@ class FairStep(RdfWrapper):
         The name is stored as a blanknode with a hasInputVar relation to the step.
         This blanknode has an RDF:type, PPLAN:Variable; and an RDFS:comment, a string literal
         representing the type (i.e. int, str, float) of the variable.
+
+        The variables are read from the RDF once, until it changes.
         """
-        return [self._get_variable(var_ref) for var_ref
-                in self.get_attribute(namespaces.PPLAN.hasInputVar, return_list=True)]
+        return list(self._get_variables().inputs)
 
     @inputs.setter
     def inputs(self, variables: List[FairVariable]):
@@ -308,9 +332,10 @@ class FairStep(RdfWrapper):
         The name is stored as a blanknode with a hasOutputVar relation to the step.
         This blanknode has an RDF:type, PPLAN:Variable; and an RDFS:comment, a string literal
         representing the type (i.e. int, str, float) of the variable.
+
+        The variables are read from the RDF once, until it changes.
         """
-        return [self._get_variable(var_ref) for var_ref
-                in self.get_attribute(namespaces.PPLAN.hasOutputVar, return_list=True)]
+        return list(self._get_variables().outputs)
 
     @outputs.setter
     def outputs(self, variables: List[FairVariable]):
@@ -318,11 +343,13 @@ class FairStep(RdfWrapper):
         for variable in variables:
             self._add_variable(variable, namespaces.PPLAN.hasOutputVar)
 
-    def validate(self, shacl=False):
+    def validate(self, shacl=False, engine='pyshacl'):
         """Validate step.
 
         Check whether this step rdf has sufficient information required of
-        a step in the Plex ontology.
+        a step in the Plex ontology. If shacl is True, also validate against
+        the PLEX shacl shapes using engine, either 'pyshacl' or the much
+        faster 'native' validator.
         """
         conforms = True
         log = ''
@@ -347,7 +374,7 @@ class FairStep(RdfWrapper):
 
         # Now validate against the PLEX shacl shapes file, if requested
         if shacl:
-            self.shacl_validate()
+            self.shacl_validate(engine=engine)
 
     def register_workflow(self, workflow):
         """Register workflow that this step is part of."""
@@ -357,8 +384,8 @@ class FairStep(RdfWrapper):
         """Update the workflows that this step is part of.
         NB: it could be that a step was deleted from a workflow
         """
-        self._workflows = {workflow for workflow in self._workflows
-                           if self in workflow}
+        self._workflows = weakref.WeakSet([workflow for workflow in self._workflows
+                                           if self in workflow])
 
     def publish_as_nanopub(self, use_test_server=False, **kwargs):
         """
@@ -374,26 +401,19 @@ class FairStep(RdfWrapper):
         Returns:
             a dictionary with publication info, including 'nanopub_uri', and 'concept_uri'
         """
-        self._update_registered_workflows()
-        old_uri = self.uri
-        self._publish_as_nanopub(use_test_server=use_test_server, **kwargs)
-        var_names = [var.name for var in (self.inputs + self.outputs)]
-        for workflow in self._workflows:
-            replace_in_rdf(workflow.rdf, oldvalue=rdflib.URIRef(old_uri),
-                           newvalue=rdflib.URIRef(self.uri))
-
-            # Similarly replace old URIs for variable name bindings
-            # in both this step and any workflow objects that use it.
-            published_step_uri_defrag, _ = urldefrag(self.uri)
-            for var_name in var_names:
-                old_var_uri = old_uri + '#' + var_name
-                new_var_uri = published_step_uri_defrag + '#' + var_name
-                replace_in_rdf(self.rdf, oldvalue=rdflib.URIRef(old_var_uri),
-                               newvalue=rdflib.URIRef(new_var_uri))
-                replace_in_rdf(workflow.rdf, oldvalue=rdflib.URIRef(old_var_uri),
-                               newvalue=rdflib.URIRef(new_var_uri))
-            del workflow._steps[old_uri]
-            workflow._steps[self.uri] = self
+        return publish_steps_as_nanopubs([self], use_test_server=use_test_server, **kwargs)[0]
+
+    def _published_uri_replacements(self, old_uri: str) -> Dict[rdflib.URIRef, rdflib.URIRef]:
+        """
+        Get the replacements of the uris that referred to this step (and its variables) before it
+        was published at a new uri.
+        """
+        replacements = {rdflib.URIRef(old_uri): rdflib.URIRef(self.uri)}
+        published_step_uri_defrag, _ = urldefrag(self.uri)
+        for var in self.inputs + self.outputs:
+            replacements[rdflib.URIRef(old_uri + '#' + var.name)] = \
+                rdflib.URIRef(published_step_uri_defrag + '#' + var.name)
+        return replacements
 
     def __str__(self):
         """
@@ -404,6 +424,67 @@ class FairStep(RdfWrapper):
         return s
 
 
+def publish_steps_as_nanopubs(steps: List[FairStep], use_test_server=False,
+                              **kwargs) -> List[dict]:
+    """
+    Publish a batch of steps as nanopublications.
+
+    All nanopublications are created first and are then signed and published concurrently,
+    through one nanopub client. Afterwards the temporary uris of the published steps (and their
+    variables) are replaced with the published uris, in the steps and in all workflows they are
+    part of, in a single pass over each graph.
+
+    Args:
+        steps: The steps to publish.
+        use_test_server (bool): Toggle using the test nanopub server.
+        kwargs: Keyword arguments to be passed to [nanopub.Publication.from_assertion](
+            https://nanopub.readthedocs.io/en/latest/reference/publication.html#
+            nanopub.publication.Publication.from_assertion).
+
+    Returns:
+        a list with a dictionary with publication info for every step, including 'nanopub_uri',
+        and 'concept_uri'
+    """
+    old_uris = [step.uri for step in steps]
+    for step in steps:
+        step._update_registered_workflows()
+    publications = [step._prepare_publication(**kwargs) for step in steps]
+
+    client = get_nanopub_client(use_test_server=use_test_server)
+
+    def _publish(publication):
+        if publication is None:
+            return {'nanopub_uri': None, 'concept_uri': None}
+        return client.publish(publication)
+
+    if len(steps) <= 1:
+        publication_infos = [_publish(publication) for publication in publications]
+    else:
+        max_workers = min(len(steps), MAX_CONCURRENT_PUBLICATIONS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            publication_infos = list(executor.map(_publish, publications))
+
+    replacements = {}
+    renamed_steps = {}  # For every affected workflow, the (step, old uri) pairs to rename
+    for step, old_uri, publication, publication_info in zip(steps, old_uris, publications,
+                                                            publication_infos):
+        if publication is None:
+            continue
+        step._set_published(publication_info)
+        step_replacements = step._published_uri_replacements(old_uri)
+        step._replace_all_in_rdf(step_replacements)
+        replacements.update(step_replacements)
+        for workflow in step._workflows:
+            renamed_steps.setdefault(workflow, []).append((step, old_uri))
+
+    for workflow, renamed in renamed_steps.items():
+        workflow._replace_all_in_rdf(replacements)
+        for step, old_uri in renamed:
+            workflow._rename_step(old_uri, step.uri)
+
+    return publication_infos
+
+
 def is_fairstep(label: str = None, is_pplan_step: bool = True, is_manual_task: bool = False,
                      is_script_task: bool = True, **kwargs):
     """Mark a function as a FAIR step to be used in a fair workflow.
@@ -464,33 +545,84 @@ def is_fairstep(label: str = None, is_pplan_step: bool = True, is_manual_task: b
                             language=LINGSYS_PYTHON,
                             inputs=inputs,
                             outputs=outputs)
+        func._fairstep = fairstep
+        return noodles.schedule(step_function_with_logging(func, fairstep))
 
-        def _add_logging(func):
-            @functools.wraps(func)
-            def _wrapper(*func_args, **func_kwargs):
+    return _modify_function
 
-                # Get the arg label/value pairs as a dict (for both args and kwargs)
-                func_args_dict = dict(zip(inspect.getfullargspec(func).args, func_args))
-                all_args = {**func_args_dict, **func_kwargs}
 
-                # Execute step (with timing)
-                t0 = datetime.now()
-                if is_manual_task:
-                    execution_result = manual_assistant.execute_manual_step(fairstep)
-                else:
-                    execution_result = func(*func_args, **func_kwargs)
-                t1 = datetime.now()
+def step_function_with_logging(func: Optional[Callable], fairstep: FairStep,
+                               arg_names: Sequence[str] = None) -> Callable:
+    """Wrap the function of a step, so that calling it logs a StepExecutionRecord.
 
-                # Log step execution
-                prov_logger.add(StepRetroProv(step=fairstep, step_args=all_args, output=execution_result, time_start=t0, time_end=t1))
+    The result of the call is taken from the ResultCache of the current execution (if any), and
+    manual tasks are executed by the Manual Step Assistant instead of calling func. If the
+    execution has a Checkpoint, the completed call is stored in it, and a call that was completed
+    in the checkpoint that is resumed is not executed again: its record is logged instead.
 
-                return execution_result
+    Args:
+        func: The function of the step, can be None for a manual task.
+        fairstep: The step that the function implements.
+        arg_names: The names of the positional arguments of func, defaults to the names in its
+            signature (or the names of the step inputs if func is None).
+    """
+    is_manual_task = fairstep.is_manual_task
+    if arg_names is None:
+        if func is None:
+            arg_names = [var.name for var in fairstep.inputs]
+        else:
+            arg_names = inspect.getfullargspec(func).args
+    # Results are cached by the code and language of the step and the arguments
+    fingerprint = step_fingerprint(fairstep.description or '', fairstep.language)
+
+    def _wrapper(*func_args, **func_kwargs):
+
+        # Skip the step if this call was completed in the checkpoint that is resumed
+        checkpoint = get_checkpoint()
+        result_cache = None if is_manual_task else get_result_cache()
+        cache_key = None
+        if checkpoint is not None or result_cache is not None:
+            cache_key = result_cache_key(fingerprint, arg_names, func_args, func_kwargs)
+        if checkpoint is not None and cache_key is not None:
+            record = checkpoint.load(cache_key)
+            if record is not None:
+                record.step = fairstep
+                get_prov_logger().add(record)
+                return record.output
+
+        # Execute step (with timing), unless the result of this call is cached
+        t0 = time.perf_counter()
+        cache_hit = False
+        if result_cache is not None and cache_key is not None:
+            try:
+                execution_result = result_cache.get(cache_key)
+                cache_hit = True
+            except KeyError:
+                pass
+        if not cache_hit:
+            if is_manual_task:
+                # The assistant is only imported when a manual task is executed
+                from fairworkflows import manual_assistant
+                execution_result = manual_assistant.execute_manual_step(fairstep)
+            else:
+                execution_result = func(*func_args, **func_kwargs)
+            if result_cache is not None and cache_key is not None:
+                result_cache.put(cache_key, execution_result)
+        t1 = time.perf_counter()
 
-            return _wrapper
-        func._fairstep = fairstep
-        return noodles.schedule(_add_logging(func))
+        # Log step execution to the logger of the current execution, the provenance RDF
+        # is only built when the retrospective provenance of the workflow is generated
+        record = StepExecutionRecord(fairstep, arg_names, func_args, func_kwargs,
+                                     execution_result, t0, t1, cache_hit=cache_hit)
+        if checkpoint is not None and cache_key is not None:
+            checkpoint.save(cache_key, record)
+        get_prov_logger().add(record)
 
-    return _modify_function
+        return execution_result
+
+    if func is not None:
+        _wrapper = functools.wraps(func)(_wrapper)
+    return _wrapper
 
 
 def _extract_inputs_from_function(func, additional_params) -> List[FairVariable]:
@@ -560,17 +692,6 @@ def _is_generic_tuple(type_):
     """
     Check whether a type annotation is Tuple
     """
-    if hasattr(typing, '_GenericAlias'):
-        # 3.7
-        # _GenericAlias cannot be imported from typing, because it doesn't
-        # exist in all versions, and it will fail the type check in those
-        # versions as well, so we ignore it.
-        return (isinstance(type_, typing._GenericAlias)
-                and type_.__origin__ is tuple)
-    else:
-        # 3.6 and earlier
-        # GenericMeta cannot be imported from typing, because it doesn't
-        # exist in all versions, and it will fail the type check in those
-        # versions as well, so we ignore it.
-        return (isinstance(type_, typing.GenericMeta)
-                and type_.__origin__ is typing.Tuple)
+    # _GenericAlias cannot be imported from typing, so we ignore it.
+    return (isinstance(type_, typing._GenericAlias)
+            and type_.__origin__ is tuple)
@@ -1,25 +1,40 @@
+import contextvars
 import inspect
 import io
 import logging
+import os
+import random
+import threading
 import warnings
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Iterator, Optional, Callable
+from typing import Iterator, Optional, Callable, List, Dict
+from urllib.parse import urldefrag
 
-import networkx as nx
 import noodles
 import rdflib
 from noodles.interface import PromisedObject
+from noodles.lib import Queue, EndOfQueue, pull_map, thread_pool
+from noodles.run.hybrid import hybrid_threaded_worker
+from noodles.run.process import process_worker
+from noodles.run.scheduler import Scheduler
+from noodles.run.worker import run_job
+from noodles.workflow import get_workflow
 from rdflib import RDF
-from rdflib.tools.rdf2dot import rdf2dot
-from requests import HTTPError
 
 from fairworkflows import namespaces, LinguisticSystem, LINGSYS_PYTHON
-from fairworkflows.config import LOGGER
-from fairworkflows.fairstep import FairStep
-from fairworkflows.prov import WorkflowRetroProv, prov_logger
-from fairworkflows.rdf_wrapper import RdfWrapper
+from fairworkflows.checkpoint import Checkpoint
+from fairworkflows.config import LOGGER, EXECUTION_BACKENDS, MAX_CONCURRENT_STEP_FETCHES, \
+    PROV_SPOOL_ENVIRONMENT_VARIABLE
+from fairworkflows.execution_plan import ExecutionPlan, Binding, WorkflowInput, CONSTANT, INPUT, \
+    STEP, bind_call, contains_workflow_input, topological_order
+from fairworkflows.fairstep import FairStep, publish_steps_as_nanopubs, step_function_with_logging
+from fairworkflows.prov import WorkflowRetroProv, ProvLogger, ProvFileSink, get_prov_logger
+from fairworkflows.result_cache import ResultCache, DiskResultCache
+from fairworkflows.value_policy import ValuePolicy
+from fairworkflows.rdf_wrapper import RdfWrapper, get_reachable_triples, copy_triples
 
 
 class FairWorkflow(RdfWrapper):
@@ -43,6 +58,12 @@ class FairWorkflow(RdfWrapper):
         if label is not None:
             self.label = label
         self._steps = {}
+        # Index of the dul:precedes relations between steps (the uris of the following steps by
+        # step uri, every step in a relation is a key), and the topological order of the steps
+        # that is derived from it. The order is cached until the workflow changes.
+        self._precedes = {}
+        self._ordered_step_uris = None
+        self._execution_plan = None
         self._last_step_added = None
         if first_step is not None:
             self.first_step = first_step
@@ -64,15 +85,15 @@ class FairWorkflow(RdfWrapper):
                 the passed RDF
             remove_irrelevant_triples: Toggle removing irrelevant triples for this FairWorkflow.
         """
-        rdf = deepcopy(rdf)  # Make sure we don't mutate user RDF
         cls._uri_is_subject_in_rdf(uri, rdf, force=force)
         self = cls(uri=uri)
         self._extract_steps(rdf, uri, fetch_references)
         if remove_irrelevant_triples:
             self._rdf = self._get_relevant_triples(uri, rdf)
         else:
-            self._rdf = deepcopy(rdf)  # Make sure we don't mutate user RDF
+            self._rdf = copy_triples(rdf)  # Make sure we don't mutate user RDF
         self.anonymise_rdf()
+        self._rebuild_precedes_graph()
         return self
 
     @classmethod
@@ -81,10 +102,11 @@ class FairWorkflow(RdfWrapper):
         Return a FairWorkflow object for a function decorated with is_fairworkflow decorator
         """
         try:
-            return func._fairworkflow
+            lazy_workflow = func._lazy_fairworkflow
         except AttributeError:
             raise ValueError('The function was not marked as a fair workflow,'
                              'use is_fairworkflow decorator to mark it.')
+        return lazy_workflow.get()
 
     @classmethod
     def from_noodles_promise(cls, workflow_level_promise: PromisedObject,
@@ -121,9 +143,7 @@ class FairWorkflow(RdfWrapper):
                 to_uri = rdflib.URIRef(linked_step.uri + '#' + linked_var_name)
                 self._rdf.add((from_uri, namespaces.PPLAN.bindsTo, to_uri))
 
-                precedes_triple = (rdflib.URIRef(current_step.uri), namespaces.DUL.precedes, rdflib.URIRef(linked_step.uri))
-                if precedes_triple not in self._rdf:
-                    self._rdf.add(precedes_triple)
+                self._add_precedes(current_step, linked_step)
 
             if len(workflow.links[i]) == 0:
                 to_uri = rdflib.BNode('result')
@@ -139,11 +159,12 @@ class FairWorkflow(RdfWrapper):
         """
         step_refs = rdf.subjects(predicate=namespaces.PPLAN.isStepOfPlan,
                                  object=rdflib.URIRef(uri))
-        for step_ref in step_refs:
-            step_uri = str(step_ref)
-            step = None
-            if fetch_steps:
-                step = self._fetch_step(uri=step_uri)
+        step_uris = list(dict.fromkeys(str(step_ref) for step_ref in step_refs))
+        if fetch_steps:
+            steps = self._fetch_steps(step_uris)
+        else:
+            steps = [None] * len(step_uris)
+        for step_uri, step in zip(step_uris, steps):
             if step is None:
                 warnings.warn(f'Could not get detailed information for '
                               f'step {step_uri}, adding a FairStep '
@@ -152,6 +173,19 @@ class FairWorkflow(RdfWrapper):
                 step = FairStep(uri=step_uri)
             self._add_step(step)
 
+    @classmethod
+    def _fetch_steps(cls, uris: List[str]) -> List[Optional[FairStep]]:
+        """Fetch steps from nanopub concurrently.
+
+        Every fetch is a blocking HTTP request, so we do them in a bounded pool of threads.
+        Returns the steps (or None if fetching failed) in the same order as the passed uris.
+        """
+        if len(uris) <= 1:
+            return [cls._fetch_step(uri=uri) for uri in uris]
+        max_workers = min(len(uris), MAX_CONCURRENT_STEP_FETCHES)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda uri: cls._fetch_step(uri=uri), uris))
+
     @staticmethod
     def _get_relevant_triples(uri, rdf):
         """
@@ -162,23 +196,11 @@ class FairWorkflow(RdfWrapper):
         NB: We assume that all step-related triples are already extracted by the _extract_steps
         method
         """
-        q = """
-        CONSTRUCT { ?s ?p ?o }
-        WHERE {
-            ?s ?p ?o .
-            # Match all triples that are through an arbitrary-length property path related to the
-            # workflow uri. (<>|!<>) matches all predicates. Binding to workflow_uri is done when
-            # executing.
-            ?workflow_uri (<>|!<>)* ?s .
-        }
-        """
-        g = rdflib.Graph(namespace_manager=rdf.namespace_manager)
-        for triple in rdf.query(q, initBindings={'workflow_uri': rdflib.URIRef(uri)}):
-            g.add(triple)
-        return g
+        return get_reachable_triples(rdf, rdflib.URIRef(uri))
 
     @staticmethod
     def _fetch_step(uri: str) -> Optional[FairStep]:
+        from requests import HTTPError
         try:
             return FairStep.from_nanopub(uri=uri)
         except HTTPError as e:
@@ -214,12 +236,45 @@ class FairWorkflow(RdfWrapper):
         """Add a step to workflow (low-level method)."""
 
         self._steps[step.uri] = step
+        self._ordered_step_uris = None
+        self._execution_plan = None
 
         self._rdf.add((rdflib.URIRef(step.uri), namespaces.PPLAN.isStepOfPlan,
                        self.self_ref))
         self._last_step_added = step
         step.register_workflow(self)
 
+    def _add_precedes(self, step: FairStep, next_step: FairStep):
+        """Add a dul:precedes relation between two steps (low-level method)."""
+        self._rdf.add((rdflib.URIRef(step.uri), namespaces.DUL.precedes,
+                       rdflib.URIRef(next_step.uri)))
+        self._add_precedes_edge(str(step.uri), str(next_step.uri))
+        self._ordered_step_uris = None
+        self._execution_plan = None
+
+    def _add_precedes_edge(self, uri: str, next_uri: str):
+        self._precedes.setdefault(uri, {})[next_uri] = None
+        self._precedes.setdefault(next_uri, {})
+
+    def _rebuild_precedes_graph(self):
+        """Rebuild the index of dul:precedes relations from the rdf."""
+        self._precedes = {}
+        for s, _, o in self._rdf.triples((None, namespaces.DUL.precedes, None)):
+            self._add_precedes_edge(str(s), str(o))
+        self._ordered_step_uris = None
+        self._execution_plan = None
+
+    def _rename_step(self, old_uri: str, new_uri: str):
+        """Update the step index after the uri of a step changed (i.e. when it was published)."""
+        self._steps[new_uri] = self._steps.pop(old_uri)
+        if old_uri in self._precedes:
+            def rename(uri):
+                return new_uri if uri == old_uri else uri
+            self._precedes = {rename(uri): {rename(next_uri): None for next_uri in next_uris}
+                              for uri, next_uris in self._precedes.items()}
+        self._ordered_step_uris = None
+        self._execution_plan = None
+
     def add(self, step: FairStep, follows: FairStep = None):
         """Add a step.
 
@@ -234,10 +289,29 @@ class FairWorkflow(RdfWrapper):
             else:
                 self.add(step, follows=self._last_step_added)
         else:
-            self._rdf.add((rdflib.URIRef(follows.uri), namespaces.DUL.precedes, rdflib.URIRef(step.uri)))
+            self._add_precedes(follows, step)
             self._add_step(follows)
             self._add_step(step)
 
+    def _get_ordered_step_uris(self):
+        """Get the uris of the steps in topological order, computed only if the workflow changed."""
+        if self._ordered_step_uris is None:
+            if len(self._steps) == 1:
+                # In case of only one step we do not need to sort
+                self._ordered_step_uris = list(self._steps.keys())
+            elif len(self._precedes) == len(self._steps):
+                import networkx as nx
+                precedes_graph = nx.DiGraph()
+                precedes_graph.add_nodes_from(self._precedes)
+                precedes_graph.add_edges_from((uri, next_uri)
+                                              for uri, next_uris in self._precedes.items()
+                                              for next_uri in next_uris)
+                self._ordered_step_uris = list(nx.topological_sort(precedes_graph))
+            else:
+                raise RuntimeError('Cannot sort steps based on precedes '
+                                   'predicate')
+        return self._ordered_step_uris
+
     def __iter__(self) -> Iterator[FairStep]:
         """
         Iterate over this FairWorkflow, return one step at a
@@ -250,21 +324,12 @@ class FairWorkflow(RdfWrapper):
              connected to each other by the precedes predicate. We do not
              know how to sort in that case.
         """
-        if len(self._steps) == 1:
-            # In case of only one step we do not need to sort
-            ordered_steps = [step.uri for step in self._steps.values()]
-        else:
-            G = nx.MultiDiGraph()
-            for s, p, o in self._rdf:
-                if p == namespaces.DUL.precedes:
-                    G.add_edge(s, o)
-            if len(G) == len(self._steps):
-                ordered_steps = nx.topological_sort(G)
-            else:
-                raise RuntimeError('Cannot sort steps based on precedes '
-                                   'predicate')
-        for step_uri in ordered_steps:
-            yield self.get_step(str(step_uri))
+        for step_uri in self._get_ordered_step_uris():
+            yield self.get_step(step_uri)
+
+    def __contains__(self, step) -> bool:
+        """Whether step (the FairStep object itself) is a step of this workflow."""
+        return isinstance(step, FairStep) and self._steps.get(step.uri) is step
 
     @property
     def is_pplan_plan(self):
@@ -291,7 +356,7 @@ class FairWorkflow(RdfWrapper):
         """
         return self._steps[uri]
 
-    def validate(self, shacl=False):
+    def validate(self, shacl=False, engine='pyshacl'):
         """Validate workflow.
 
         Checks whether this workflow's rdf:
@@ -299,6 +364,8 @@ class FairWorkflow(RdfWrapper):
             ontology.
          * Step 'hasInputVar' and 'hasOutputVar' match with workflows 'precedes'
             predicate
+        If shacl is True, also validates against the PLEX shacl shapes using
+        engine, either 'pyshacl' or the much faster 'native' validator.
         """
         conforms = True
         log = ''
@@ -323,7 +390,7 @@ class FairWorkflow(RdfWrapper):
 
         # Now validate against the PLEX shacl shapes file, if requested
         if shacl:
-            self.shacl_validate()
+            self.shacl_validate(engine=engine)
 
     def _get_workflow_graph(self, promise):
         """Get a graph of a promise."""
@@ -354,40 +421,280 @@ class FairWorkflow(RdfWrapper):
                 file.write(dot.pipe(format='svg'))
             display(SVG(filename=filename))
 
-    def execute(self, *args, **kwargs):
+    def execute(self, *args, backend: str = 'single', n_workers: int = None,
+                prov_sink: ProvFileSink = None, result_cache: ResultCache = None,
+                value_policy: ValuePolicy = None, checkpoint_dir: Path = None,
+                resume: Path = None, **kwargs):
         """
         Executes the workflow on the specified number of threads. Noodles is used as the execution
         engine. If a noodles workflow has not been generated for this fairworkflow object, then
         it cannot be executed and an exception will be raised.
 
+        Args:
+            args: Positional arguments to pass to the workflow function.
+            backend (str): The noodles runner used to execute the steps, one of:
+                * 'single': run all steps one after the other in a single thread (default).
+                * 'threads': run independent steps in parallel in a pool of threads.
+                * 'processes': run independent steps in parallel in a pool of python worker
+                    processes. The step functions must be importable (i.e. defined at module
+                    level) and their arguments and return values must be picklable.
+            n_workers (int): The number of threads or processes to use, defaults to the number
+                of CPUs. Ignored for the 'single' backend.
+            prov_sink (ProvFileSink): Stream the provenance of the steps to this sink as they
+                finish, instead of keeping it in memory. The returned retroprov then has no
+                steps, use `load_retrospective_prov` to read them back from the sink.
+            result_cache (ResultCache): Take the results of steps from this cache if they were
+                called with the same arguments before (and the code of the step did not change),
+                instead of executing them again. Cache hits are recorded in the retrospective
+                provenance. Use a MemoryResultCache or a DiskResultCache, the 'processes' backend
+                only supports a DiskResultCache.
+            value_policy (ValuePolicy): Decides which input and output values of the steps are
+                inlined in the retrospective provenance, and which are referenced by their
+                content hash (and optionally stored in a BlobStore). Defaults to inlining scalars
+                only. For a prov_sink, pass the policy to the ProvFileSink instead.
+            checkpoint_dir (Path): Persist the output and StepRetroProv of every step to this
+                directory as soon as it finishes (see Checkpoint), so the execution can be
+                resumed if it fails.
+            resume (Path): The checkpoint_dir of a previous (failed) execution. Steps that were
+                completed in it are not executed again, their outputs and provenance are
+                reloaded instead. Steps completed in this execution are stored in checkpoint_dir,
+                which defaults to resume.
+            kwargs: Keyword arguments to pass to the workflow function.
+
         Returns a tuple (result, retroprov), where result is the final output of the executed
         workflow and retroprov is the retrospective provenance logged during execution.
         """
         if not hasattr(self, 'workflow_level_promise'):
-            raise ValueError('Cannot execute workflow as no noodles step_level_promise has been constructed.')
-        prov_logger.empty()
-        self.workflow_level_promise = noodles.workflow.from_call(
-            noodles.get_workflow(self.workflow_level_promise).root_node.foo, args, kwargs, {})
-        result = noodles.run_single(self.workflow_level_promise)
+            raise ValueError('Cannot execute workflow as no noodles step_level_promise has been '
+                             'constructed. Use compile(step_functions) to run it.')
+        if backend not in EXECUTION_BACKENDS:
+            raise ValueError(f'Unknown execution backend {backend}, '
+                             f'choose one of {", ".join(EXECUTION_BACKENDS)}')
+        if (backend == 'processes' and result_cache is not None
+                and not isinstance(result_cache, DiskResultCache)):
+            raise ValueError('The processes backend can only use a DiskResultCache')
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        checkpoint = None
+        if checkpoint_dir is not None or resume is not None:
+            checkpoint = Checkpoint(checkpoint_dir if checkpoint_dir is not None else resume,
+                                    resume_from=resume, value_policy=value_policy)
+        workflow_function = noodles.get_workflow(self.workflow_level_promise).root_node.foo
+        # Keep the promise of this call local, the workflow can be executed concurrently
+        workflow_level_promise = noodles.workflow.from_call(workflow_function, args, kwargs, {})
+        self.workflow_level_promise = workflow_level_promise
+        # Every execution logs to its own logger, so concurrent executions keep their provenance
+        prov_logger = ProvLogger()
+        with ExitStack() as stack:
+            stack.enter_context(prov_logger.activate())
+            if prov_sink is not None:
+                stack.enter_context(prov_logger.stream_to(prov_sink))
+            if result_cache is not None:
+                stack.enter_context(result_cache.activate())
+            if checkpoint is not None:
+                stack.enter_context(checkpoint.activate())
+            if backend == 'single':
+                result = noodles.run_single(workflow_level_promise)
+            elif backend == 'threads':
+                result = _run_parallel(workflow_level_promise, n_threads=n_workers)
+            else:
+                # Worker processes only receive individual step jobs, so we expand the workflow
+                # function to its steps here instead of sending it to a worker.
+                with prov_logger.collect_from_worker_processes(steps=self._steps) as spool_dir:
+                    environment = {PROV_SPOOL_ENVIRONMENT_VARIABLE: spool_dir}
+                    if result_cache is not None:
+                        environment.update(result_cache.worker_environment())
+                    if checkpoint is not None:
+                        environment.update(checkpoint.worker_environment())
+                    result = _run_process(workflow_function(*args, **kwargs),
+                                          n_processes=n_workers, environment=environment)
 
         # Generate the retrospective provenance as a (nano-) Publication object
-        retroprov = self._generate_retrospective_prov_publication()
+        retroprov = self._generate_retrospective_prov_publication(prov_logger.get_all(),
+                                                                  value_policy=value_policy)
 
         return result, retroprov
 
-    def _generate_retrospective_prov_publication(self) -> WorkflowRetroProv:
+    def compile(self, step_functions: Dict[str, Callable] = None) -> ExecutionPlan:
+        """Compile this workflow into an ExecutionPlan, that can be run many times.
+
+        The plan holds the step calls in topological order, where their arguments come from and
+        which calls depend on each other, so running it does not trace or analyse the workflow
+        again. A workflow built with is_fairworkflow is compiled from the step calls that were
+        traced when it was decorated. Other workflows (i.e. loaded with from_rdf or
+        from_nanopub) are compiled from their dul:precedes and pplan:bindsTo relations. Their
+        step inputs that are not bound to the output of another step are the inputs of the
+        plan, by variable name (in the order of the steps, and sorted by name within a step), so
+        they must have a different name in every step.
+
+        Args:
+            step_functions: The functions to call for the steps, by step uri or label. Manual
+                tasks need no function. If given, the plan is always compiled from the RDF.
+
+        Returns:
+            The plan, which is cached until the workflow changes if no step_functions are given.
+        """
+        if step_functions is not None:
+            return self._compile_from_rdf(step_functions)
+        if self._execution_plan is None:
+            if hasattr(self, 'step_level_promise'):
+                self._execution_plan = self._compile_traced()
+            else:
+                self._execution_plan = self._compile_from_rdf({})
+        return self._execution_plan
+
+    def _compile_traced(self) -> ExecutionPlan:
+        """Compile the plan from the traced step calls of a workflow built with is_fairworkflow."""
+        workflow_function = noodles.get_workflow(self.workflow_level_promise).root_node.foo
+        traced = noodles.get_workflow(self.step_level_promise)
+        links = {}  # The node whose result is passed, by (node, argument name)
+        dependencies = {node_id: [] for node_id in traced.nodes}
+        for node_id, targets in traced.links.items():
+            for target_id, address in targets:
+                if getattr(address, 'key', None) is not None:
+                    raise ValueError('Passing the result of a step inside *args or **kwargs is '
+                                     'not supported by compile, use execute instead')
+                links[target_id, address.name] = node_id
+                dependencies[target_id].append(node_id)
+        order = topological_order(dependencies, list(traced.nodes))
+        index_of = {node_id: index for index, node_id in enumerate(order)}
+
+        calls = []
+        for node_id in order:
+            node = traced.nodes[node_id]
+            signature = node.bound_args.signature
+            arguments = {}
+            for name, value in node.bound_args.arguments.items():
+                kind = signature.parameters[name].kind
+                if (node_id, name) in links:
+                    arguments[name] = Binding(STEP, index_of[links[node_id, name]])
+                elif kind == inspect.Parameter.VAR_POSITIONAL:
+                    arguments[name] = tuple(_traced_binding(item) for item in value)
+                elif kind == inspect.Parameter.VAR_KEYWORD:
+                    arguments[name] = {key: _traced_binding(item) for key, item in value.items()}
+                else:
+                    arguments[name] = _traced_binding(value)
+            args, kwargs = bind_call(signature, arguments)
+            calls.append((node.foo._fairstep, node.foo, args, kwargs,
+                          [index_of[dependency] for dependency in dependencies[node_id]]))
+        inputs = list(inspect.signature(workflow_function).parameters)
+        return ExecutionPlan.from_calls(self, calls, inputs,
+                                        result=Binding(STEP, index_of[traced.root]))
+
+    def _compile_from_rdf(self, step_functions: Dict[str, Callable]) -> ExecutionPlan:
+        """Compile the plan from the dul:precedes and pplan:bindsTo relations in the RDF."""
+        step_uris = self._get_ordered_step_uris()
+        if not step_uris:
+            raise ValueError('Cannot compile a workflow without steps')
+        index_of = {uri: index for index, uri in enumerate(step_uris)}
+        step_functions = {str(key): function for key, function in step_functions.items()}
+
+        # The uris of the variables of the steps, as they are referred to by pplan:bindsTo
+        input_vars = {}  # (step uri, variable name) by variable uri
+        output_vars = {}  # (step uri, item of the step result) by variable uri
+        for uri in step_uris:
+            step = self._steps[uri]
+            for var in step.inputs:
+                for var_uri in _variable_uris(uri, var.name):
+                    input_vars[var_uri] = uri, var.name
+            outputs = step.outputs
+            for item, var in enumerate(outputs):
+                for var_uri in _variable_uris(uri, var.name):
+                    output_vars[var_uri] = uri, (None if len(outputs) == 1 else item)
+        sources = {}  # (step uri, item) by (step uri, variable name) of the inputs they bind to
+        result = None
+        for s, _, o in self._rdf.triples((None, namespaces.PPLAN.bindsTo, None)):
+            source = output_vars.get(str(s))
+            if source is None:
+                continue
+            target = input_vars.get(str(o)) if isinstance(o, rdflib.URIRef) else None
+            if target is None:
+                result = source  # Bound to the result of the workflow
+            else:
+                sources[target] = source
+
+        predecessors = {}
+        for previous_uri, next_uris in self._precedes.items():
+            for next_uri in next_uris:
+                predecessors.setdefault(next_uri, []).append(index_of[previous_uri])
+
+        calls = []
+        inputs = {}  # The step uris by the names of the unbound step inputs, in order
+        for uri in step_uris:
+            step = self._steps[uri]
+            function = step_functions.get(uri)
+            if function is None and step.label is not None:
+                function = step_functions.get(str(step.label))
+            if function is None and not step.is_manual_task:
+                raise ValueError(f'No function given for step {uri}')
+            if function is not None:
+                # Call the function itself, not the is_fairstep wrapper of another step object
+                function = inspect.unwrap(function)
+            kwargs = []
+            dependencies = list(predecessors.get(uri, ()))
+            # The rdf does not order the inputs of a step, so they are ordered by name
+            for var in sorted(step.inputs, key=lambda var: var.name):
+                source = sources.get((uri, var.name))
+                if source is None:
+                    if var.name in inputs:
+                        raise ValueError(f'Steps {inputs[var.name]} and {uri} both have an unbound '
+                                         f'input {var.name}, the inputs of the plan must have '
+                                         f'unique names')
+                    inputs[var.name] = uri
+                    kwargs.append((var.name, Binding(INPUT, var.name)))
+                else:
+                    source_uri, item = source
+                    kwargs.append((var.name, Binding(STEP, index_of[source_uri], item)))
+                    dependencies.append(index_of[source_uri])
+            calls.append((step, step_function_with_logging(function, step), (), kwargs,
+                          dependencies))
+        if result is None:
+            result = step_uris[-1], None  # The result of the last step
+        result_uri, result_item = result
+        return ExecutionPlan.from_calls(self, calls, list(inputs),
+                                        result=Binding(STEP, index_of[result_uri], result_item))
+
+    def execute_many(self, input_sets, backend: str = 'single', n_workers: int = None,
+                     result_cache: ResultCache = None, value_policy: ValuePolicy = None):
+        """Execute the workflow for every set of inputs, with its compiled ExecutionPlan.
+
+        Args:
+            input_sets: The inputs of every execution, either a dict of inputs by name or a
+                sequence of positional inputs.
+            backend (str): 'single' to call the steps one after the other, or 'threads' to call
+                independent steps (of all executions) in parallel in one pool of threads.
+            n_workers, result_cache, value_policy: See `execute`.
+
+        Returns a list with a tuple (result, retroprov) for every set of inputs.
+        """
+        return self.compile().run_many(input_sets, backend=backend, n_workers=n_workers,
+                                       result_cache=result_cache, value_policy=value_policy)
+
+    def _generate_retrospective_prov_publication(self, step_provs: List = None,
+                                                 value_policy: ValuePolicy = None
+                                                 ) -> WorkflowRetroProv:
         """
         Utility method for generating a Publication object for the retrospective
-        provenance of this workflow. Uses the given 'log' string as the actual
-        provenance for now.
+        provenance of this workflow. Uses the step provenance logged by the ProvLogger of the
+        current execution context, unless step_provs is given.
         """
         if self._is_published:
             workflow_uri = rdflib.URIRef(self.uri)
         else:
             workflow_uri = rdflib.URIRef('http://www.example.org/unpublishedworkflow')
 
-        step_provs = prov_logger.get_all()
-        return WorkflowRetroProv(self, workflow_uri, step_provs)
+        if step_provs is None:
+            step_provs = get_prov_logger().get_all()
+        return WorkflowRetroProv(self, workflow_uri, step_provs, value_policy=value_policy)
+
+    def load_retrospective_prov(self, prov_sink: ProvFileSink) -> WorkflowRetroProv:
+        """Load the retrospective provenance of the executions of this workflow from a sink.
+
+        Args:
+            prov_sink: The sink that was passed to `execute`, or a new ProvFileSink for its path.
+        """
+        return self._generate_retrospective_prov_publication(
+            prov_sink.read_step_provs(steps=self._steps))
 
     def draw(self, filepath):
         """Visualize workflow.
@@ -398,6 +705,7 @@ class FairWorkflow(RdfWrapper):
         .dot.png file is one of those renderings.
         """
 
+        from rdflib.tools.rdf2dot import rdf2dot
         graphviz = self._import_graphviz()
         filepath = filepath.split('.')[0] + '.dot'
         with open(filepath, 'w') as f:
@@ -432,14 +740,17 @@ class FairWorkflow(RdfWrapper):
             a dictionary with publication info, including 'nanopub_uri', and 'concept_uri' of the
                 published workflow
         """
+        unpublished_steps = []
         for step in self:
             if step.is_modified or not step._is_published:
                 self._is_modified = True  # If one of the steps is modified the workflow is too.
                 if publish_steps:
-                    step.publish_as_nanopub(use_test_server=use_test_server, **kwargs)
+                    unpublished_steps.append(step)
                 else:
                     raise RuntimeError(f'{step} was not published yet, please publish steps first, '
                                        f'or use publish_steps=True')
+        if unpublished_steps:
+            publish_steps_as_nanopubs(unpublished_steps, use_test_server=use_test_server, **kwargs)
 
         return self._publish_as_nanopub(use_test_server=use_test_server, **kwargs)
 
@@ -470,34 +781,148 @@ def is_fairworkflow(label: str = None, is_pplan_plan: bool = True):
     """
     def _modify_function(func):
         """
-        Store FairWorkflow as _fairworkflow attribute of the function. Use inspection to get the
-        description, inputs, and outputs of the workflow based on the function specification.
-        Call the scheduled_workflow with empty arguments so we get a PromisedObject. These empty
-        arguments will be replaced upon execution with the input arguments that the .execute()
-        method is called with.
+        Store a _LazyFairWorkflow as _lazy_fairworkflow attribute of the function, that builds
+        the FairWorkflow on first use. Call the scheduled_workflow with empty arguments so we get
+        a PromisedObject. These empty arguments will be replaced upon execution with the input
+        arguments that the .execute() method is called with.
         """
         scheduled_workflow = noodles.schedule(func)
-        num_params = len(inspect.signature(func).parameters)
-        empty_args = ([inspect.Parameter.empty()] * num_params)
+        # Placeholders for the inputs, so compile can tell which step arguments they are
+        empty_args = [WorkflowInput(name) for name in inspect.signature(func).parameters]
         workflow_level_promise = scheduled_workflow(*empty_args)
-        _validate_decorated_function(func, empty_args)
-        step_level_promise = func(*empty_args)
-
-        # Description of workflow is the raw function code
-        description = inspect.getsource(func)
-        workflow_level_promise._fairworkflow = FairWorkflow.from_noodles_promise(
-            workflow_level_promise, step_level_promise, description=description, label=label,
-            is_pplan_plan=is_pplan_plan, derived_from=None)
+        # Trace the steps of the workflow once, this also validates the function
+        step_level_promise = _validate_decorated_function(func, empty_args)
+        workflow_level_promise._lazy_fairworkflow = _LazyFairWorkflow(
+            func, workflow_level_promise, step_level_promise, label=label,
+            is_pplan_plan=is_pplan_plan)
         return workflow_level_promise
     return _modify_function
 
 
+class _LazyFairWorkflow:
+    """
+    The FairWorkflow of a function decorated with is_fairworkflow, built on first use.
+
+    Getting the source code of the function (the description of the workflow) and building the
+    RDF of the workflow is slow, and only needed when the workflow is used, not when the module
+    defining it is imported.
+    """
+    def __init__(self, func, workflow_level_promise: PromisedObject,
+                 step_level_promise: PromisedObject, label: str = None,
+                 is_pplan_plan: bool = True):
+        self.func = func
+        self.workflow_level_promise = workflow_level_promise
+        self.step_level_promise = step_level_promise
+        self.label = label
+        self.is_pplan_plan = is_pplan_plan
+        self.lock = threading.Lock()
+        self._workflow = None
+
+    def get(self) -> FairWorkflow:
+        """Get the FairWorkflow, it is built once."""
+        with self.lock:
+            if self._workflow is None:
+                # Description of workflow is the raw function code
+                description = inspect.getsource(self.func)
+                self._workflow = FairWorkflow.from_noodles_promise(
+                    self.workflow_level_promise, self.step_level_promise,
+                    description=description, label=self.label,
+                    is_pplan_plan=self.is_pplan_plan, derived_from=None)
+            return self._workflow
+
+
+def _traced_binding(value) -> Binding:
+    """Get the binding of a step argument that is not the result of another step."""
+    if isinstance(value, WorkflowInput):
+        return Binding(INPUT, value.name)
+    if contains_workflow_input(value):
+        raise ValueError('Passing workflow inputs inside a container to a step is not supported '
+                         'by compile, use execute instead')
+    return Binding(CONSTANT, value)
+
+
+def _variable_uris(step_uri: str, name: str) -> List[str]:
+    """The uris a variable of a step can be referred to with, before and after publishing."""
+    step_uri_defrag, _ = urldefrag(step_uri)
+    return list(dict.fromkeys([step_uri + '#' + name, step_uri_defrag + '#' + name]))
+
+
+def _context_worker(context: contextvars.Context):
+    """Noodles worker that runs the jobs in context, i.e. with the ProvLogger of the execution."""
+    @pull_map
+    def worker(job):
+        if job is EndOfQueue:
+            return
+        key, node = job
+        return context.run(run_job, key, node)
+    return worker
+
+
+def _run_parallel(workflow, n_threads: int):
+    """Like noodles.run_parallel, but the threads run the jobs in a copy of the current context.
+
+    A context can only be entered by one thread at a time, so every thread gets its own copy.
+    """
+    threaded_worker = Queue() >> thread_pool(
+        *(_context_worker(contextvars.copy_context()) for _ in range(n_threads)))
+    return Scheduler().run(threaded_worker, get_workflow(workflow))
+
+
+_worker_environment_lock = threading.Lock()
+
+
+@contextmanager
+def _worker_process_environment(environment: Dict[str, str]):
+    """Start worker processes within this context to give them the environment variables.
+
+    The environment of this process is only changed within this context, and it is locked so
+    concurrent executions start their workers with their own environment.
+    """
+    with _worker_environment_lock:
+        previous = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
+
+
+def _run_process(workflow, n_processes: int, environment: Dict[str, str]):
+    """Like noodles.run_process, but the worker processes are started with the environment
+    variables (i.e. the directory to spool their provenance to)."""
+    with _worker_process_environment(environment):
+        workers = {f'worker {i:2}': process_worker(_process_registry)
+                   for i in range(n_processes)}
+    worker_names = list(workers.keys())
+    master_worker = hybrid_threaded_worker(lambda _: random.choice(worker_names), workers)
+    try:
+        return Scheduler().run(master_worker, get_workflow(workflow))
+    finally:
+        for worker in workers.values():
+            try:
+                worker.sink().send(EndOfQueue)
+            except StopIteration:
+                pass
+
+
+def _process_registry():
+    """Serialisation registry used to send jobs to and results from noodles worker processes."""
+    return noodles.serial.pickle() + noodles.serial.base()
+
+
 def _validate_decorated_function(func, empty_args):
     """
     Validate that a function decorated with is_fairworkflow actually consists of steps that are
     decorated with is_fairstep. Call the function using empty arguments to test. NB: This won't
     catch all edgecases of users misusing the is_fairworkflow decorator, but at least will
     provide more useful error messages in frequently occurring cases.
+
+    Returns:
+        The promise returned by the function, which includes the individual steps.
     """
     try:
         result = func(*empty_args)
@@ -509,3 +934,4 @@ def _validate_decorated_function(func, empty_args):
     if not isinstance(result, PromisedObject):
         raise TypeError("The workflow does not return a 'promise'. Did you use the "
                         "is_fairstep decorator on all the steps?")
+    return result
@@ -23,16 +23,21 @@ class LinguisticSystem:
                    see_also=see_also,
                    version_info=version_info)
 
-    def generate_rdf(self, ref: rdflib.BNode):
-        rdf = rdflib.Graph()
+    def triples(self, ref: rdflib.BNode):
+        """Yield the triples describing this linguistic system, with ref as subject."""
         if self.lstype:
-            rdf.add( (ref, RDF.type, self.lstype) )
+            yield ref, RDF.type, self.lstype
         if self.label:
-            rdf.add( (ref, RDFS.label, self.label) )
+            yield ref, RDFS.label, self.label
         if self.see_also:
-            rdf.add( (ref, RDFS.seeAlso, self.see_also) )
+            yield ref, RDFS.seeAlso, self.see_also
         if self.version_info:
-            rdf.add( (ref, OWL.versionInfo, self.version_info) )
+            yield ref, OWL.versionInfo, self.version_info
+
+    def generate_rdf(self, ref: rdflib.BNode):
+        rdf = rdflib.Graph()
+        for triple in self.triples(ref):
+            rdf.add(triple)
         return rdf
 
     def __str__(self):
@@ -1,22 +1,42 @@
+import asyncio
 import base64
-import cgi
-import logging
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import List, Dict
-from fairworkflows.config import MANUAL_ASSISTANT_HOST, MANUAL_ASSISTANT_PORT
-from jinja2 import Environment, PackageLoader, select_autoescape
+import functools
+import itertools
+import threading
+from concurrent.futures import Future
+from http import HTTPStatus
+from typing import List, Dict, Tuple
+from urllib.parse import parse_qs
 
-logging.basicConfig(level=logging.INFO)
-env = Environment(loader=PackageLoader('fairworkflows', 'templates'), autoescape=select_autoescape('html'))
+from fairworkflows.config import LOGGER, MANUAL_ASSISTANT_HOST, MANUAL_ASSISTANT_PORT
 
 ENCODING = 'UTF-8'
 
 
+@functools.lru_cache(maxsize=None)
+def _get_environment():
+    """Get the jinja environment, jinja is only imported when the first page is rendered."""
+    from jinja2 import Environment, PackageLoader, select_autoescape
+    return Environment(loader=PackageLoader('fairworkflows', 'templates'),
+                       autoescape=select_autoescape('html'))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_template(name: str):
+    """Get a template, it is compiled once."""
+    return _get_environment().get_template(name)
+
+
 def _render_manual_step(step):
-    template = env.get_template('manualstep.html')
+    template = _get_template('manualstep.html')
     return template.render(step=step, outputs=_outputs_to_html(step.outputs)).encode(ENCODING)
 
 
+def _render_manual_tasks(tasks):
+    template = _get_template('manualtasks.html')
+    return template.render(tasks=tasks).encode(ENCODING)
+
+
 def _outputs_to_html(outputs):
     """
     Extract the information necessary to render the outputs in an html form.
@@ -28,75 +48,194 @@ def _outputs_to_html(outputs):
         yield base64.b64encode(o.name.encode()).decode(), o.name, o.computational_type
 
 
-def _create_request_handler(step):
-    class ManualStepRequestHandler(BaseHTTPRequestHandler):
-        def __init__(self, request, client_address, server):
-            self.step = step
-            super().__init__(request, client_address, server)
-
-        def _set_response(self):
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-
-        def do_GET(self):
-            self._set_response()
-            self.wfile.write(_render_manual_step(self.step))
-
-        def do_POST(self):
-            # Parse the form data posted
-            form_data = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={
-                    'REQUEST_METHOD': 'POST',
-                    'CONTENT_TYPE': self.headers['Content-Type'],
-                }
-            )
-
-            # Assuming all ids are unique
-            form_data = {field.name: field.value for field in form_data.list}
-
-            if _all_boxes_checked(form_data, step.outputs):
-                self.server.confirm_output(form_data)
-            else:
-                # Just display the page again
-                self.do_GET()
+def _all_boxes_checked(form_data: Dict[str, List[str]], outputs):
+    return len(form_data.keys()) == len(outputs)
 
-    return ManualStepRequestHandler
 
+class ManualTask:
+    """A manual step that is waiting to be completed by a human, at /tasks/<task_id>."""
+    def __init__(self, task_id: int, step):
+        self.task_id = task_id
+        self.step = step
+        self.future = Future()
+        self._page = None
 
-def _all_boxes_checked(form_data: Dict[str, List[str]], outputs):
-    return len(form_data.keys()) == len(outputs)
+    @property
+    def path(self) -> str:
+        return f'/tasks/{self.task_id}'
 
+    @property
+    def page(self) -> bytes:
+        """The rendered page of the manual step, it is rendered once."""
+        if self._page is None:
+            self._page = _render_manual_step(self.step)
+        return self._page
 
-class ManualTaskServer(HTTPServer):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
-        self.done = False
-        self.outputs = []
+class ManualAssistant:
+    """
+    Serves the pages of all pending manual steps from a single asyncio HTTP server.
 
-    def confirm_output(self, outputs):
-        self.outputs = {base64.b64decode(k).decode(): bool(v) for k, v in outputs.items()}
-        self.done = True
+    The server runs in its own thread with its own event loop, and is started when the first
+    manual step is submitted. `submit` does not block, so steps running in other threads (or
+    coroutines awaiting `execute_manual_step_async`) keep running while humans complete the
+    manual steps. The index page lists the pending manual steps, each one has its own page.
 
-    def is_done(self):
-        return self.done
+    Args:
+        host: The host to serve on.
+        port: The port to serve on, 0 picks a free port (see `port` after `start`).
+    """
+    def __init__(self, host: str = MANUAL_ASSISTANT_HOST, port: int = MANUAL_ASSISTANT_PORT):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self._tasks = {}
+        self._task_ids = itertools.count(1)
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        """Start the server in a background thread, if it is not running yet."""
+        with self.lock:
+            if self._thread is not None:
+                return
+            loop = asyncio.new_event_loop()
+            started = Future()
+            thread = threading.Thread(target=self._serve, args=(loop, started),
+                                      name='manual-assistant', daemon=True)
+            thread.start()
+            self.port = started.result()
+            self._loop = loop
+            self._thread = thread
+            LOGGER.info(f'Started Manual Step Assistant at {self.url}')
+
+    def _serve(self, loop: asyncio.AbstractEventLoop, started: Future):
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port))
+        except Exception as e:
+            started.set_exception(e)
+            loop.close()
+            return
+        started.set_result(self._server.sockets[0].getsockname()[1])
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+
+    def stop(self):
+        """Stop the server, manual steps that are still pending fail with a RuntimeError."""
+        with self.lock:
+            if self._thread is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = self._server = self._thread = None
+            tasks, self._tasks = self._tasks, {}
+        for task in tasks.values():
+            task.future.set_exception(RuntimeError('The Manual Step Assistant was stopped'))
+
+    def submit(self, step) -> Future:
+        """Make a manual step available to be completed, without blocking.
+
+        Returns:
+            A Future that is resolved with the confirmed outputs of the step (a dict of output
+            name to bool) when a human completes it.
+        """
+        self.start()
+        with self.lock:
+            task = ManualTask(next(self._task_ids), step)
+            self._tasks[task.task_id] = task
+        LOGGER.info(f'Please go to {self.url}{task.path} to perform the manual step '
+                    f'{step.label}')
+        return task.future
+
+    def pending_tasks(self) -> List[ManualTask]:
+        with self.lock:
+            return list(self._tasks.values())
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        """Handle a single HTTP/1.0 request."""
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, response_headers, content = self._respond(method, path, body)
+            writer.write(f'HTTP/1.0 {status.value} {status.phrase}\r\n'.encode('latin-1'))
+            response_headers['Content-Length'] = str(len(content))
+            for name, value in response_headers.items():
+                writer.write(f'{name}: {value}\r\n'.encode('latin-1'))
+            writer.write(b'\r\n' + content)
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # Malformed request or the client went away
+        finally:
+            writer.close()
+
+    def _respond(self, method: str, path: str, body: bytes) -> Tuple[HTTPStatus, Dict, bytes]:
+        """Get the status, headers and content of the response to a request."""
+        html = {'Content-Type': 'text/html'}
+        path = path.split('?', 1)[0]
+        if path == '/' and method == 'GET':
+            return HTTPStatus.OK, html, _render_manual_tasks(self.pending_tasks())
+        task = None
+        prefix, _, task_id = path.rpartition('/')
+        if prefix == '/tasks' and task_id.isdigit():
+            with self.lock:
+                task = self._tasks.get(int(task_id))
+        if task is None:
+            return HTTPStatus.NOT_FOUND, html, b'No pending manual step here'
+        if method == 'POST':
+            # Assuming all ids are unique
+            form_data = {name: values[0]
+                         for name, values in parse_qs(body.decode(ENCODING)).items()}
+            if _all_boxes_checked(form_data, task.step.outputs):
+                with self.lock:
+                    self._tasks.pop(task.task_id, None)
+                outputs = {base64.b64decode(k).decode(): bool(v) for k, v in form_data.items()}
+                LOGGER.info(f'Manual step {task.step.label} has been completed.')
+                task.future.set_result(outputs)
+                return HTTPStatus.SEE_OTHER, {'Location': '/'}, b''
+        elif method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, html, b''
+        # Display the page (again, if not all outputs were confirmed)
+        return HTTPStatus.OK, html, task.page
+
+
+_manual_assistant = None
+_manual_assistant_lock = threading.Lock()
+
+
+def get_manual_assistant() -> ManualAssistant:
+    """Get the ManualAssistant of this process, that serves on MANUAL_ASSISTANT_PORT."""
+    global _manual_assistant
+    with _manual_assistant_lock:
+        if _manual_assistant is None:
+            _manual_assistant = ManualAssistant()
+        return _manual_assistant
 
 
 def execute_manual_step(step):
-    server_address = (MANUAL_ASSISTANT_HOST, MANUAL_ASSISTANT_PORT)
-    server = ManualTaskServer(server_address, _create_request_handler(step))
-
-    logging.info('Starting Manual Step Assistant')
-    logging.info(f'Please go to http://{MANUAL_ASSISTANT_HOST}:{MANUAL_ASSISTANT_PORT} to perform the manual step')
+    """Wait for a human to complete a manual step, only blocks the calling thread."""
+    return get_manual_assistant().submit(step).result()
 
-    try:
-        while not server.is_done():
-            server.handle_request()
 
-        logging.info('Manual step has been completed.')
-        return server.outputs
-    finally:
-        server.server_close()
+async def execute_manual_step_async(step):
+    """Wait for a human to complete a manual step, without blocking the event loop."""
+    return await asyncio.wrap_future(get_manual_assistant().submit(step))
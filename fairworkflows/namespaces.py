@@ -12,3 +12,14 @@ Namespace for
 `http://www.w3.org/ns/prov#`
 """
 PROV = rdflib.Namespace("http://www.w3.org/ns/prov#")
+
+"""
+Namespace for
+`http://www.w3.org/ns/shacl#`
+"""
+SHACL = rdflib.Namespace("http://www.w3.org/ns/shacl#")
+
+"""
+Namespace for terms that are specific to fairworkflows
+"""
+FW = rdflib.Namespace("http://fairworkflows.org/terms#")
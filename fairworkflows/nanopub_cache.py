@@ -0,0 +1,80 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import rdflib
+
+from fairworkflows.config import NANOPUB_CACHE_DIR, NANOPUB_CACHE_MAX_SIZE
+from fairworkflows.disk_store import LruDirectory
+
+
+class NanopubCache:
+    """
+    Persistent on-disk cache of the assertions of fetched nanopublications.
+
+    Published nanopublications are immutable, so they can be cached by URI forever. Every
+    cached nanopublication is stored in its own file, named by the hash of its URI, containing
+    the assertion as N-Triples together with the namespace bindings and the introduced concept.
+    When the total size of the cache exceeds max_size the least recently used entries are
+    evicted.
+
+    Args:
+        directory: The directory to store the cache in, created on first use.
+        max_size: Maximum total size of the cache in bytes.
+    """
+    def __init__(self, directory: Path = NANOPUB_CACHE_DIR, max_size: int = NANOPUB_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._files = LruDirectory(directory, '.json')
+
+    @property
+    def directory(self) -> Path:
+        """The directory the cache is stored in."""
+        return self._files.directory
+
+    @staticmethod
+    def _name(uri: str) -> str:
+        return hashlib.sha256(uri.encode()).hexdigest()
+
+    def _path(self, uri: str) -> Path:
+        return self._files.path(self._name(uri))
+
+    def get(self, uri: str) -> Optional[Tuple[rdflib.Graph, Optional[rdflib.URIRef]]]:
+        """Get the assertion and introduced concept of a cached nanopub, or None if not cached."""
+        data = self._files.read(self._name(uri))
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+        if entry.get('uri') != uri:
+            return None
+        assertion = rdflib.Graph()
+        for prefix, namespace in entry['namespaces'].items():
+            assertion.bind(prefix, namespace)
+        assertion.parse(data=entry['assertion'], format='nt')
+        introduces_concept = entry['introduces_concept']
+        if introduces_concept is not None:
+            introduces_concept = rdflib.URIRef(introduces_concept)
+        return assertion, introduces_concept
+
+    def put(self, uri: str, assertion: rdflib.Graph, introduces_concept=None):
+        """Store the assertion and introduced concept of a nanopub in the cache."""
+        entry = {
+            'uri': uri,
+            'namespaces': {prefix: str(namespace)
+                           for prefix, namespace in assertion.namespaces()},
+            'introduces_concept': (str(introduces_concept)
+                                   if introduces_concept is not None else None),
+            'assertion': assertion.serialize(format='nt').decode('utf-8'),
+        }
+        self._files.write(self._name(uri), json.dumps(entry).encode('utf-8'), self.max_size)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._files.clear()
+
+
+# nanopub_cache will be used as a singleton throughout the library to cache fetched nanopubs
+nanopub_cache = NanopubCache()
@@ -0,0 +1,254 @@
+import datetime
+import re
+from typing import Callable, List, Tuple
+
+import rdflib
+from rdflib import RDF, RDFS, XSD
+
+from fairworkflows.namespaces import SHACL as SH
+
+# Shacl predicates that do not express a constraint, these are ignored when compiling the shapes
+NON_CONSTRAINT_PARAMETERS = {SH.targetClass, SH.targetNode, SH.property, SH.path, SH.flags,
+                             SH.name, SH.description, SH.message, SH.severity, SH.deactivated,
+                             SH.order, SH.group}
+
+NODE_KINDS = {
+    SH.IRI: (rdflib.URIRef,),
+    SH.BlankNode: (rdflib.BNode,),
+    SH.Literal: (rdflib.Literal,),
+    SH.BlankNodeOrIRI: (rdflib.BNode, rdflib.URIRef),
+    SH.BlankNodeOrLiteral: (rdflib.BNode, rdflib.Literal),
+    SH.IRIOrLiteral: (rdflib.URIRef, rdflib.Literal),
+}
+
+# Python types of the values of well-formed literals, for the datatypes that can be checked
+DATATYPE_VALUE_TYPES = {
+    XSD.string: (str, bytes),
+    RDF.langString: (str, bytes),
+    XSD.integer: (int,),
+    XSD.float: (float,),
+    XSD.boolean: (bool,),
+    XSD.date: (datetime.date,),
+    XSD.time: (datetime.time,),
+    XSD.dateTime: (datetime.datetime,),
+}
+
+
+class _Constraint:
+    """A single compiled constraint of a shape, checking one value node at a time."""
+    def __init__(self, component: rdflib.URIRef, check: Callable, message: str):
+        self.component = component
+        self.check = check
+        self.message = message
+
+
+class _Shape:
+    """A compiled node or property shape."""
+    def __init__(self, node, path, severity, messages):
+        self.node = node
+        self.path = path
+        self.severity = severity
+        self.messages = messages
+        self.target_classes = []
+        self.target_nodes = []
+        self.constraints: List[_Constraint] = []
+        self.property_shapes: List['_Shape'] = []
+
+
+class PlexValidator:
+    """
+    Validates RDF against a shacl shapes graph by evaluating the constraints directly with
+    indexed triple lookups, as a fast alternative to pyshacl.
+
+    The shapes are compiled once when the validator is created. Only the shacl core features
+    used by the PLEX shapes are supported (targetClass and targetNode targets, property shapes
+    with a predicate path, and the nodeKind, class, datatype and pattern constraints), a
+    ValueError is raised for shapes using anything else. Like pyshacl with RDFS inference,
+    instances of subclasses are targeted and every node is an instance of rdfs:Resource, but no
+    other RDFS entailment is done. PLEX steps and workflows carry no schema triples, so this
+    gives the same results as pyshacl for them.
+
+    Args:
+        shapes_graph: The graph with the shacl shapes to validate against.
+    """
+    def __init__(self, shapes_graph: rdflib.Graph):
+        self._shapes_graph = shapes_graph
+        self._shapes = {}
+        for node in set(shapes_graph.subjects(RDF.type, SH.NodeShape)) | set(
+                shapes_graph.subjects(RDF.type, SH.PropertyShape)):
+            self._compile_shape(node)
+        # Only shapes with targets are validated directly, other shapes through sh:property
+        self._targeted_shapes = [shape for shape in self._shapes.values()
+                                 if shape is not None
+                                 and (shape.target_classes or shape.target_nodes)
+                                 and (shape.constraints or shape.property_shapes)]
+
+    def _compile_shape(self, node) -> _Shape:
+        if node in self._shapes:
+            return self._shapes[node]
+        sg = self._shapes_graph
+        if sg.value(node, SH.deactivated) == rdflib.Literal(True):
+            self._shapes[node] = None
+            return None
+        shape = _Shape(node, path=sg.value(node, SH.path),
+                       severity=sg.value(node, SH.severity) or SH.Violation,
+                       messages=[str(m) for m in sg.objects(node, SH.message)])
+        if shape.path is not None and not isinstance(shape.path, rdflib.URIRef):
+            raise ValueError(f'Unsupported shacl path in shape {node}, only predicate paths are '
+                             f'supported')
+        self._shapes[node] = shape
+        for predicate, value in sg.predicate_objects(node):
+            if predicate == SH.targetClass:
+                shape.target_classes.append(value)
+            elif predicate == SH.targetNode:
+                shape.target_nodes.append(value)
+            elif predicate == SH.property:
+                property_shape = self._compile_shape(value)
+                if property_shape is not None:
+                    shape.property_shapes.append(property_shape)
+            elif predicate == SH.nodeKind:
+                shape.constraints.append(self._node_kind_constraint(value))
+            elif predicate == SH['class']:
+                shape.constraints.append(self._class_constraint(value))
+            elif predicate == SH.datatype:
+                shape.constraints.append(self._datatype_constraint(value))
+            elif predicate == SH.pattern:
+                shape.constraints.append(self._pattern_constraint(value, sg.value(node, SH.flags)))
+            elif predicate in NON_CONSTRAINT_PARAMETERS or not predicate.startswith(SH):
+                continue
+            else:
+                raise ValueError(f'Unsupported shacl constraint {predicate} in shape {node}')
+        return shape
+
+    def _node_kind_constraint(self, node_kind) -> _Constraint:
+        node_types = NODE_KINDS[node_kind]
+        return _Constraint(SH.NodeKindConstraintComponent,
+                           lambda value, _: isinstance(value, node_types),
+                           f'Value is not of Node Kind '
+                           f'{node_kind.n3(self._shapes_graph.namespace_manager)}')
+
+    def _class_constraint(self, class_) -> _Constraint:
+        return _Constraint(SH.ClassConstraintComponent,
+                           lambda value, rdf: _is_instance(value, class_, rdf),
+                           f'Value does not have class '
+                           f'{class_.n3(self._shapes_graph.namespace_manager)}')
+
+    def _datatype_constraint(self, datatype) -> _Constraint:
+        def check(value, _):
+            if not isinstance(value, rdflib.Literal):
+                return False
+            if value.datatype == datatype or (value.datatype is None and (
+                    (value.language is None and datatype == XSD.string)
+                    or (value.language is not None and datatype == RDF.langString))):
+                value_types = DATATYPE_VALUE_TYPES.get(datatype)
+                return value_types is None or isinstance(value.value, value_types)
+            return False
+        return _Constraint(SH.DatatypeConstraintComponent, check,
+                           f'Value is not Literal with datatype '
+                           f'{datatype.n3(self._shapes_graph.namespace_manager)}')
+
+    def _pattern_constraint(self, pattern, flags) -> _Constraint:
+        re_flags = 0
+        if flags is not None:
+            if 'i' in str(flags).lower():
+                re_flags |= re.I
+            if 'm' in str(flags).lower():
+                re_flags |= re.M
+        matcher = re.compile(str(pattern), re_flags)
+        return _Constraint(SH.PatternConstraintComponent,
+                           lambda value, _: (not isinstance(value, rdflib.BNode)
+                                             and matcher.search(str(value)) is not None),
+                           f"Value does not match pattern '{pattern}'")
+
+    def validate(self, rdf: rdflib.Graph) -> Tuple[bool, rdflib.Graph, str]:
+        """
+        Validate rdf against the shapes.
+
+        Returns:
+            a tuple (conforms, results_graph, results_text), like pyshacl.validate
+        """
+        results = []
+        for shape in self._targeted_shapes:
+            for focus_node in _focus_nodes(shape, rdf):
+                self._validate_shape(shape, focus_node, rdf, results)
+        return (len(results) == 0, self._results_graph(results), self._results_text(results))
+
+    def _validate_shape(self, shape: _Shape, focus_node, rdf: rdflib.Graph, results: list):
+        if shape.path is None:
+            value_nodes = [focus_node]
+        else:
+            value_nodes = list(rdf.objects(focus_node, shape.path))
+        for constraint in shape.constraints:
+            for value_node in value_nodes:
+                if not constraint.check(value_node, rdf):
+                    results.append((shape, constraint, focus_node, value_node))
+        for property_shape in shape.property_shapes:
+            self._validate_shape(property_shape, focus_node, rdf, results)
+
+    @staticmethod
+    def _results_graph(results) -> rdflib.Graph:
+        results_graph = rdflib.Graph()
+        results_graph.bind('sh', SH)
+        report = rdflib.BNode()
+        results_graph.add((report, RDF.type, SH.ValidationReport))
+        results_graph.add((report, SH.conforms, rdflib.Literal(len(results) == 0)))
+        for shape, constraint, focus_node, value_node in results:
+            result = rdflib.BNode()
+            results_graph.add((report, SH.result, result))
+            results_graph.add((result, RDF.type, SH.ValidationResult))
+            results_graph.add((result, SH.sourceConstraintComponent, constraint.component))
+            results_graph.add((result, SH.sourceShape, shape.node))
+            results_graph.add((result, SH.resultSeverity, shape.severity))
+            results_graph.add((result, SH.focusNode, focus_node))
+            results_graph.add((result, SH.value, value_node))
+            if shape.path is not None:
+                results_graph.add((result, SH.resultPath, shape.path))
+            for message in shape.messages or [constraint.message]:
+                results_graph.add((result, SH.resultMessage, rdflib.Literal(message)))
+        return results_graph
+
+    def _results_text(self, results) -> str:
+        namespace_manager = self._shapes_graph.namespace_manager
+        text = (f'Validation Report\nConforms: {len(results) == 0}\n'
+                + (f'Results ({len(results)}):\n' if results else ''))
+        for shape, constraint, focus_node, value_node in results:
+            severity_text = ('Constraint Violation' if shape.severity == SH.Violation
+                             else 'Validation Result')
+            text += (f'{severity_text} in {constraint.component.n3(namespace_manager)}:\n'
+                     f'\tSeverity: {shape.severity.n3(namespace_manager)}\n'
+                     f'\tSource Shape: {shape.node.n3(namespace_manager)}\n'
+                     f'\tFocus Node: {focus_node.n3()}\n'
+                     f'\tValue Node: {value_node.n3()}\n')
+            if shape.path is not None:
+                text += f'\tResult Path: {shape.path.n3(namespace_manager)}\n'
+            for message in shape.messages or [constraint.message]:
+                text += f'\tMessage: {message}\n'
+        return text
+
+
+def _is_instance(node, class_, rdf: rdflib.Graph) -> bool:
+    """Whether node has rdf:type class_ or one of its subclasses, as pyshacl checks sh:class."""
+    if isinstance(node, rdflib.Literal):
+        return False
+    if class_ == RDFS.Resource:
+        return True
+    for node_type in rdf.objects(node, RDF.type):
+        if node_type == class_ or class_ in rdf.transitive_objects(node_type, RDFS.subClassOf):
+            return True
+    return False
+
+
+def _focus_nodes(shape: _Shape, rdf: rdflib.Graph) -> list:
+    """The nodes in rdf targeted by a shape, without duplicates."""
+    focus_nodes = dict.fromkeys(shape.target_nodes)
+    for target_class in shape.target_classes:
+        if target_class == RDFS.Resource:
+            for s, _, o in rdf:
+                focus_nodes[s] = None
+                if not isinstance(o, rdflib.Literal):
+                    focus_nodes[o] = None
+            continue
+        for class_ in rdf.transitive_subjects(RDFS.subClassOf, target_class):
+            for instance in rdf.subjects(RDF.type, class_):
+                focus_nodes[instance] = None
+    return list(focus_nodes)
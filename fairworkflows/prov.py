@@ -1,37 +1,220 @@
+import contextvars
+import itertools
+import os
+import pickle
+import re
 import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Iterator, Dict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Iterator, Dict, Sequence, Union, Optional
 
 import rdflib
 
 from fairworkflows import namespaces
-from fairworkflows.rdf_wrapper import RdfWrapper
+from fairworkflows.config import PROV_SPOOL_ENVIRONMENT_VARIABLE, PROV_SINK_BATCH_SIZE
+from fairworkflows.rdf_wrapper import RdfWrapper, get_reachable_triples, replace_all_in_rdf
+from fairworkflows.value_policy import ValuePolicy, default_value_policy
 
 
 class ProvLogger:
     """
     Simple logger for provenance. It allows storing items to a list in a thread-safe way.
+
+    Every execution of a workflow logs to its own ProvLogger, which is made the logger of the
+    current execution context with `activate` (see `get_prov_logger`). Items added in worker
+    processes (see `collect_from_worker_processes`) are written to a spool directory instead,
+    and are picked up by the logger of the parent process. Items can also be streamed to a sink
+    instead of being kept in memory, see `stream_to`.
     """
     def __init__(self):
         self.lock = threading.Lock()
         self.items = []
+        self._spool_counter = itertools.count()
+        self._sink = None
 
     def add(self, item):
+        if WORKER_SPOOL_DIR is not None:
+            # We are running in a worker process, hand the item over to the parent process
+            self._spool(item, Path(WORKER_SPOOL_DIR))
+            return
+        if self._sink is not None:
+            self._sink.write(item)
+            return
         with self.lock:
             self.items.append(item)
 
+    @contextmanager
+    def activate(self):
+        """Make this the logger of the current execution context, see `get_prov_logger`.
+
+        Steps executed within this context (also in threads started with a copy of it) log to
+        this logger, so concurrent executions do not mix up each other's provenance.
+        """
+        token = _current_prov_logger.set(self)
+        try:
+            yield self
+        finally:
+            _current_prov_logger.reset(token)
+
+    @contextmanager
+    def stream_to(self, sink: 'ProvFileSink'):
+        """Write items that are added within this context to sink, instead of keeping them.
+
+        The sink is flushed when the context exits, also when an exception is raised, so the
+        provenance of a crashed run is kept up to the failing step.
+        """
+        self._sink = sink
+        try:
+            yield
+        finally:
+            self._sink = None
+            sink.flush()
+
+    def _spool(self, item, spool_dir: Path):
+        """Write an item to the spool directory, atomically so the parent never reads half."""
+        name = f'{time.time_ns()}-{os.getpid()}-{next(self._spool_counter)}'
+        tmp_path = spool_dir / (name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(item, f)
+        tmp_path.rename(spool_dir / (name + '.pickle'))
+
+    @contextmanager
+    def collect_from_worker_processes(self, steps: Dict = None):
+        """Collect items that are logged in worker processes, yielding the spool directory.
+
+        Worker processes must be started with the yielded spool directory in their environment
+        (as PROV_SPOOL_ENVIRONMENT_VARIABLE), so they write their items there. When the context exits the spooled
+        items are added to this logger (in the order they were logged).
+
+        Args:
+            steps: The FairSteps that can be executed, by uri. Items are pickled without their
+                step, it is looked up here.
+        """
+        with TemporaryDirectory() as spool_dir:
+            try:
+                yield spool_dir
+            finally:
+                for path in sorted(Path(spool_dir).glob('*.pickle'),
+                                   key=lambda path: [int(part) for part in path.stem.split('-')]):
+                    with open(path, 'rb') as f:
+                        item = pickle.load(f)
+                    if item.step is None and steps is not None:
+                        item.step = steps.get(str(item.step_uri))
+                    self.add(item)
+
     def get_all(self):
         with self.lock:
             items, self.items = self.items, []
         return items
 
     def empty(self):
-        self.items = []
+        with self.lock:
+            self.items = []
 
 
-# prov_logger will be used as a singleton throughout the library to log provenance during execution
+# prov_logger is the logger that is used outside of workflow executions, i.e. when a step
+# function is called directly
 prov_logger = ProvLogger()
 
+_current_prov_logger = contextvars.ContextVar('prov_logger', default=None)
+
+
+def get_prov_logger() -> ProvLogger:
+    """Get the ProvLogger of the current execution context, or prov_logger outside of one."""
+    logger = _current_prov_logger.get()
+    return prov_logger if logger is None else logger
+
+
+# The spool directory of the parent process, if this is a worker process. It is read once when
+# the worker starts, the parent process only sets it while starting its workers.
+WORKER_SPOOL_DIR = os.environ.get(PROV_SPOOL_ENVIRONMENT_VARIABLE)
+
+# Offset to convert time.perf_counter() values of this process to seconds since the epoch
+PERF_COUNTER_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+class StepExecutionRecord:
+    """
+    Cheap record of a single step execution, logged in the call path of a FAIR step.
+
+    It only keeps references to the call arguments and the output, and the perf_counter
+    timestamps, in slots so that many records take little memory. It is turned into a
+    StepRetroProv (building its RDF) only when that is accessed in the WorkflowRetroProv, see
+    `to_step_retro_prov`.
+
+    Args:
+        step: The executed FairStep.
+        arg_names: The names of the positional arguments of the step function.
+        args: The positional arguments the step was called with.
+        kwargs: The keyword arguments the step was called with.
+        output: The output of the step.
+        perf_start: The time.perf_counter() value at the start of execution.
+        perf_end: The time.perf_counter() value at the end of execution.
+        cache_hit: Whether the output was taken from a result cache instead of executing the step.
+    """
+    __slots__ = ('step', 'step_uri', 'arg_names', 'args', 'kwargs', 'output', 'perf_start',
+                 'perf_end', 'epoch_offset', 'cache_hit')
+
+    def __init__(self, step, arg_names: Sequence[str], args: tuple, kwargs: dict, output,
+                 perf_start: float, perf_end: float, cache_hit: bool = False):
+        self.step = step
+        self.step_uri = None
+        self.arg_names = arg_names
+        self.args = args
+        self.kwargs = kwargs or None
+        self.output = output
+        self.perf_start = perf_start
+        self.perf_end = perf_end
+        self.epoch_offset = PERF_COUNTER_EPOCH_OFFSET
+        self.cache_hit = cache_hit
+
+    @property
+    def step_args(self) -> Dict:
+        """The argument names and values (for both args and kwargs) as a dict."""
+        step_args = dict(zip(self.arg_names, self.args))
+        if self.kwargs:
+            step_args.update(self.kwargs)
+        return step_args
+
+    @property
+    def time_start(self) -> datetime:
+        return datetime.fromtimestamp(self.epoch_offset + self.perf_start)
+
+    @property
+    def time_end(self) -> datetime:
+        return datetime.fromtimestamp(self.epoch_offset + self.perf_end)
+
+    def to_step_retro_prov(self, step=None,
+                           value_policy: ValuePolicy = None) -> 'StepRetroProv':
+        """Build the retrospective provenance of this execution.
+
+        Args:
+            step: The FairStep to associate the provenance with, defaults to the executed step.
+            value_policy: How to record the input and output values, see StepRetroProv.
+        """
+        return StepRetroProv(step=step or self.step, step_args=self.step_args, output=self.output,
+                             time_start=self.time_start, time_end=self.time_end,
+                             cache_hit=self.cache_hit, value_policy=value_policy)
+
+    def __getstate__(self):
+        """Pickle without the associated FairStep (and the workflows registered to it).
+
+        This is used to send records from worker processes back to the parent process,
+        the parent re-associates the step using `step_uri`.
+        """
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['step'] = None
+        state['step_uri'] = self.step.uri if self.step is not None else self.step_uri
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
 
 class StepRetroProv(RdfWrapper):
     """
@@ -43,13 +226,15 @@ class StepRetroProv(RdfWrapper):
     * Bindings of the input values to the prospective input variables of the associated step
     * Bindings of the output values to the prospective output variables of the associated step
     * The start and end time of step execution
+    * Whether the output was taken from a result cache, as fw:resultFromCache predicate
 
     Attributes:
         step_uri: Refers to URI of step associated to this provenance.
 
     """
     def __init__(self, step=None, step_args: Dict = None, time_start: datetime = None,
-                 time_end: datetime = None, output=None):
+                 time_end: datetime = None, output=None, cache_hit: bool = False,
+                 value_policy: ValuePolicy = None):
         """Constructor.
 
         Args:
@@ -57,11 +242,20 @@ class StepRetroProv(RdfWrapper):
             step_args: a dictionary containing the input arguments and values
             time_start: the start time of execution of the step
             time_end: the end time of execution of the step
+            output: the output of the step
+            cache_hit: whether the output was taken from a result cache
+            value_policy: decides which input and output values are inlined as rdf:value, and
+                which are only referenced by their content hash, size and type (as
+                fw:contentHash, fw:byteSize and fw:valueType, and prov:atLocation if stored).
+                Defaults to default_value_policy.
         """
         super().__init__(uri=None, ref_name='fairstepprov')
         self.set_attribute(rdflib.RDF.type, namespaces.PPLAN.Activity, overwrite=False)
         self.step = step
+        if step is None:
+            return
         self.step_uri = step.uri
+        self._value_policy = value_policy or default_value_policy
 
         # Bind inputs
         for inputvar in step.inputs:
@@ -84,6 +278,27 @@ class StepRetroProv(RdfWrapper):
             self.set_attribute(namespaces.PROV.startedAtTime, rdflib.Literal(time_start, datatype=rdflib.XSD.dateTime))
         if time_end:
             self.set_attribute(namespaces.PROV.endedAtTime, rdflib.Literal(time_end, datatype=rdflib.XSD.dateTime))
+        if cache_hit:
+            self.set_attribute(namespaces.FW.resultFromCache, rdflib.Literal(True))
+
+    @property
+    def cache_hit(self) -> bool:
+        """Whether the output of the step was taken from a result cache."""
+        return bool(self.get_attribute(namespaces.FW.resultFromCache))
+
+    @classmethod
+    def from_rdf(cls, rdf: rdflib.Graph, step=None):
+        """Construct StepRetroProv from rdf in which the activity is the self_ref blank node.
+
+        Args:
+            rdf: The RDF graph
+            step: the associated FairStep object, if known
+        """
+        self = cls()
+        self._rdf = rdf
+        self._bind_namespaces()
+        self.step = step
+        return self
 
     def _add_retrospective_variable(self, prospective_var, value):
         """
@@ -91,13 +306,24 @@ class StepRetroProv(RdfWrapper):
 
         Args:
             prospective_var (FairVariable): FairVariable object of associated variable
-            value: the variable value
+            value: the variable value, inlined or referenced according to the value policy
         """
         retrovar = rdflib.BNode(prospective_var.name)
         self.set_attribute(namespaces.PROV.used, retrovar, overwrite=False)
         self._rdf.add((retrovar, rdflib.RDF.type, namespaces.PPLAN.Entity))
         self._rdf.add((retrovar, rdflib.RDFS.label, rdflib.Literal(prospective_var.name)))
-        self._rdf.add((retrovar, rdflib.RDF.value, rdflib.Literal(value)))
+        if self._value_policy.should_inline(value):
+            self._rdf.add((retrovar, rdflib.RDF.value, rdflib.Literal(value)))
+        else:
+            reference = self._value_policy.reference(value)
+            self._rdf.add((retrovar, namespaces.FW.valueType, rdflib.Literal(reference.value_type)))
+            if reference.digest is not None:
+                self._rdf.add((retrovar, namespaces.FW.contentHash,
+                               rdflib.Literal('sha256:' + reference.digest)))
+                self._rdf.add((retrovar, namespaces.FW.byteSize, rdflib.Literal(reference.size)))
+            if reference.path is not None:
+                self._rdf.add((retrovar, namespaces.PROV.atLocation,
+                               rdflib.URIRef(reference.path.absolute().as_uri())))
 
         if prospective_var.uri:
             self._rdf.add((retrovar, namespaces.PPLAN.correspondsToVariable, prospective_var.uri))
@@ -147,29 +373,37 @@ class WorkflowRetroProv(RdfWrapper):
     * References to the retrospective provenance of the individual steps, indicated by the
         prov:hasMember predicate
 
+    The StepRetroProv of a step is only built when it is accessed, from the StepExecutionRecord
+    logged during execution.
+
     Attributes:
         workflow_uri: Refers to URI of workflow associated to this provenance.
     """
-    def __init__(self, workflow, workflow_uri, step_provs: List[StepRetroProv]):
+    def __init__(self, workflow, workflow_uri,
+                 step_provs: List[Union[StepRetroProv, StepExecutionRecord]],
+                 value_policy: ValuePolicy = None):
         """Constructor.
 
         Args:
             workflow: the FairWorkflow object corresponding to this retrospective prov
             workflow_uri: uri of the prospective workflow (NB: we do not use workflow.uri for
                 this because the workflow can be unpublished.)
-            step_provs: A list of StepRetroProv objects for each individual step of the workflow.
-
+            step_provs: A list of StepRetroProv objects (or StepExecutionRecords to build them
+                from) for each individual step of the workflow.
+            value_policy: How to record the input and output values when building a
+                StepRetroProv from a StepExecutionRecord, see StepRetroProv.
         """
         super().__init__(uri=None, ref_name='fairworkflowprov')
         self.set_attribute(rdflib.RDF.type, namespaces.PPLAN.Bundle, overwrite=False)
         self.set_attribute(rdflib.RDF.type, namespaces.PROV.Collection, overwrite=False)
         self.workflow = workflow
         self.workflow_uri = workflow_uri
-        self._step_provs = step_provs
+        self._step_provs = list(step_provs)
+        self._value_policy = value_policy
 
         # Add the Entity links for now (dummy links, if unpublished)
         for stepprov in self._step_provs:
-            if stepprov.uri:
+            if isinstance(stepprov, StepRetroProv) and stepprov.uri:
                 self._rdf.add((self.self_ref, namespaces.PROV.hasMember, rdflib.URIRef(stepprov.uri)))
             else:
                 self._rdf.add((self.self_ref, namespaces.PROV.hasMember, rdflib.URIRef('http://www.example.org/unpublished-entity-' + str(hash(stepprov)))))
@@ -186,9 +420,18 @@ class WorkflowRetroProv(RdfWrapper):
     def workflow_uri(self, value):
         self.set_attribute(namespaces.PROV.wasDerivedFrom, rdflib.URIRef(value), overwrite=True)
 
+    def _get_step_prov(self, index: int) -> StepRetroProv:
+        """Get the StepRetroProv at index, building it from its record on first access."""
+        stepprov = self._step_provs[index]
+        if isinstance(stepprov, StepExecutionRecord):
+            stepprov = self._step_provs[index] = stepprov.to_step_retro_prov(
+                value_policy=self._value_policy)
+        return stepprov
+
     def __iter__(self) -> Iterator[StepRetroProv]:
         """Iterate over StepRetroProv that were part of the execution of the workflow."""
-        yield from self._step_provs
+        for index in range(len(self._step_provs)):
+            yield self._get_step_prov(index)
 
     def __len__(self) -> int:
         return len(self._step_provs)
@@ -211,7 +454,7 @@ class WorkflowRetroProv(RdfWrapper):
         # Clear existing members of this entity (to be replaced with newly published links)
         self.remove_attribute(namespaces.PROV.hasMember)
 
-        for stepprov in self._step_provs:
+        for stepprov in self:
             stepprov.publish_as_nanopub(use_test_server=use_test_server, **kwargs)
             self._rdf.add((self.self_ref, namespaces.PROV.hasMember, rdflib.URIRef(stepprov.uri)))
 
@@ -222,3 +465,115 @@ class WorkflowRetroProv(RdfWrapper):
         s = f'Workflow retrospective provenance.\n'
         s += self._rdf.serialize(format='turtle').decode('utf-8')
         return s
+
+
+class ProvFileSink:
+    """
+    Streams the retrospective provenance of step executions to N-Quads or N-Triples files.
+
+    Items (StepExecutionRecords or StepRetroProvs) are buffered and appended to the file in
+    batches, every step execution with its own blank nodes (and in its own named graph for
+    N-Quads). Use with `ProvLogger.stream_to` to keep the memory use of long runs bounded, and
+    `read_step_provs` (or `FairWorkflow.load_retrospective_prov`) to load the provenance back.
+
+    Args:
+        path: The file to append to. If max_file_size is given, the next files are named like
+            prov.1.nq, prov.2.nq, etc. for a path prov.nq.
+        format: 'nquads' or 'nt'
+        batch_size: The number of step executions to buffer before appending them to the file.
+        max_file_size: Continue in a new file once the current file is larger than this many
+            bytes. By default everything is written to a single file.
+        value_policy: How to record the input and output values of StepExecutionRecords, see
+            StepRetroProv.
+    """
+    def __init__(self, path, format: str = 'nquads', batch_size: int = PROV_SINK_BATCH_SIZE,
+                 max_file_size: Optional[int] = None, value_policy: ValuePolicy = None):
+        if format not in ('nquads', 'nt'):
+            raise ValueError(f'Unsupported format {format}, use nquads or nt')
+        self.path = Path(path)
+        self.format = format
+        self.batch_size = batch_size
+        self.max_file_size = max_file_size
+        self.value_policy = value_policy
+        self.lock = threading.Lock()
+        self._buffer = []
+        existing_paths = self.paths()
+        self._file_index = self._get_file_index(existing_paths[-1]) if existing_paths else 0
+
+    def _file_path(self, index: int) -> Path:
+        if index == 0:
+            return self.path
+        return self.path.with_name(f'{self.path.stem}.{index}{self.path.suffix}')
+
+    def _get_file_index(self, path: Path) -> int:
+        if path == self.path:
+            return 0
+        return int(path.name[len(self.path.stem) + 1:len(path.name) - len(self.path.suffix)])
+
+    def paths(self) -> List[Path]:
+        """The files of this sink that exist, in the order they were written."""
+        pattern = re.compile(re.escape(self.path.stem) + r'\.\d+' + re.escape(self.path.suffix))
+        rotated_paths = [path for path in self.path.parent.glob(f'{self.path.stem}.*')
+                         if pattern.fullmatch(path.name)]
+        paths = [self.path] if self.path.exists() else []
+        return paths + sorted(rotated_paths, key=self._get_file_index)
+
+    def write(self, item: Union[StepExecutionRecord, StepRetroProv]):
+        """Add the provenance of a step execution, it is written once a batch is complete."""
+        with self.lock:
+            self._buffer.append(item)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        """Write all buffered step executions to the file."""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        batch = rdflib.ConjunctiveGraph()
+        for item in self._buffer:
+            if isinstance(item, StepExecutionRecord):
+                item = item.to_step_retro_prov(value_policy=self.value_policy)
+            context = batch.get_context(rdflib.URIRef(f'urn:uuid:{uuid.uuid4()}'))
+            # Give the blank nodes of every step execution their own identity in the file
+            bnodes = {}
+            for triple in item.rdf:
+                context.add(tuple(bnodes.setdefault(term, rdflib.BNode())
+                                  if isinstance(term, rdflib.BNode) else term
+                                  for term in triple))
+        self._buffer = []
+        path = self._file_path(self._file_index)
+        if (self.max_file_size is not None and path.exists()
+                and path.stat().st_size >= self.max_file_size):
+            self._file_index += 1
+            path = self._file_path(self._file_index)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(batch.serialize(format=self.format))
+            f.flush()
+
+    def read_step_provs(self, steps: Dict = None) -> List[StepRetroProv]:
+        """
+        Read back the provenance of all step executions written to the files of this sink,
+        ordered by start time.
+
+        Args:
+            steps: FairSteps by uri, to associate with the loaded StepRetroProvs.
+        """
+        rdf = rdflib.ConjunctiveGraph()
+        for path in self.paths():
+            # Parse every file separately, blank nodes are local to a file
+            rdf.parse(str(path), format=self.format)
+        step_provs = []
+        for activity in rdf.subjects(rdflib.RDF.type, namespaces.PPLAN.Activity):
+            step_prov_rdf = get_reachable_triples(rdf, activity)
+            replace_all_in_rdf(step_prov_rdf, {activity: rdflib.BNode('fairstepprov')})
+            step_uri = step_prov_rdf.value(rdflib.BNode('fairstepprov'),
+                                           namespaces.PPLAN.correspondsToStep)
+            step = steps.get(str(step_uri)) if steps is not None else None
+            step_provs.append(StepRetroProv.from_rdf(step_prov_rdf, step=step))
+        return sorted(step_provs, key=lambda step_prov: (
+            str(step_prov.get_attribute(namespaces.PROV.startedAtTime) or '')))
@@ -1,24 +1,63 @@
+import functools
 import warnings
+from collections import deque
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import List
+from typing import List, Iterable, Dict, Optional, Tuple, TYPE_CHECKING
 from urllib.parse import urldefrag
 
-import pyshacl
 import rdflib
 from rdflib import RDF, RDFS, DCTERMS, OWL
-from nanopub import Publication, NanopubClient
-from rdflib.tools.rdf2dot import rdf2dot
 
 from fairworkflows import namespaces, LinguisticSystem
-from fairworkflows.config import PACKAGE_DIR
+from fairworkflows.config import PACKAGE_DIR, SHACL_ENGINES
+from fairworkflows.nanopub_cache import nanopub_cache
+from fairworkflows.plex_validator import PlexValidator
+
+if TYPE_CHECKING:
+    # nanopub, pyshacl and rdf2dot are slow to import, they are imported where they are used
+    from nanopub import Publication, NanopubClient
 
 PLEX_SHAPES_SHACL_FILEPATH = str(PACKAGE_DIR / 'resources' / 'plex-shapes.ttl')
 
+# Namespaces used often in fair step and fair workflow, bound in the graph of every RdfWrapper.
+# Unused namespaces will be removed upon serialization.
+NAMESPACE_BINDINGS = tuple((prefix, rdflib.URIRef(str(namespace))) for prefix, namespace in (
+    ('npx', namespaces.NPX),
+    ('pplan', namespaces.PPLAN),
+    ('prov', namespaces.PROV),
+    ('dul', namespaces.DUL),
+    ('bpmn', namespaces.BPMN),
+    ('pwo', namespaces.PWO),
+    ('schema', namespaces.SCHEMAORG),
+    ('dc', DCTERMS),
+    ('owl', OWL),
+))
+
+
+def new_graph() -> rdflib.Graph:
+    """
+    Create an empty graph with the NAMESPACE_BINDINGS bound.
+
+    The bindings are written to the store of the new graph directly, instead of through
+    Graph.bind. That skips the conflict checks (there is nothing to conflict with in an empty
+    store), and the namespace manager of the graph is only created when it is first used
+    (e.g. when serializing). Wrapping thousands of objects, like one StepRetroProv per step
+    execution, is then cheap.
+    """
+    rdf = rdflib.Graph()
+    store = rdf.store
+    for prefix, namespace in NAMESPACE_BINDINGS:
+        store.bind(prefix, namespace)
+    return rdf
+
+
 class RdfWrapper:
     def __init__(self, uri, ref_name='fairobject', derived_from: List[str] = None,
                  language: LinguisticSystem = None ):
-        self._rdf = rdflib.Graph()
+        self._rdf = new_graph()
+        # Incremented on every change of the rdf by this object, so derived data can be cached
+        self._modification_count = 0
         if uri:
             self._uri = str(uri)
         else:
@@ -28,8 +67,6 @@ class RdfWrapper:
         self._is_published = False
         self.derived_from = derived_from
 
-        self._bind_namespaces()
-
         # A blank node to which triples about the linguistic
         # system for this FAIR object can be added
         self.lingsys_ref = rdflib.BNode('LinguisticSystem')
@@ -38,25 +75,26 @@ class RdfWrapper:
             self.language = language
 
     def _bind_namespaces(self):
-        """Bind namespaces used often in fair step and fair workflow.
-
-        Unused namespaces will be removed upon serialization.
-        """
-        self.rdf.bind("npx", namespaces.NPX)
-        self.rdf.bind("pplan", namespaces.PPLAN)
-        self.rdf.bind("prov", namespaces.PROV)
-        self.rdf.bind("dul", namespaces.DUL)
-        self.rdf.bind("bpmn", namespaces.BPMN)
-        self.rdf.bind("pwo", namespaces.PWO)
-        self.rdf.bind("schema", namespaces.SCHEMAORG)
-        self.rdf.bind("dc", DCTERMS)
-        self.rdf.bind("owl", OWL)
+        """Bind the NAMESPACE_BINDINGS in a graph that did not come from new_graph."""
+        for prefix, namespace in NAMESPACE_BINDINGS:
+            self._rdf.bind(prefix, namespace)
 
     @property
     def rdf(self) -> rdflib.Graph:
-        """Get the rdf graph."""
+        """Get the rdf graph.
+
+        Data derived from the graph (such as the inputs and outputs of a FairStep) is cached, so
+        after changing the graph directly rather than through this object, assign it again with
+        `obj.rdf = graph` to make the change visible.
+        """
         return self._rdf
 
+    @rdf.setter
+    def rdf(self, value: rdflib.Graph):
+        """Replace the rdf graph, or mark it as changed after changing it directly."""
+        self._modification_count += 1
+        self._rdf = value
+
     @property
     def uri(self) -> str:
         """Get the URI for this RDF."""
@@ -80,6 +118,7 @@ class RdfWrapper:
 
     def add_triple(self, s, p, o):
         """ Add any general triple to the rdf i.e. that does not have the self_ref (step, or plan) as subject """
+        self._modification_count += 1
         self._rdf.add((s, p, o))
 
     def get_attribute(self, predicate, return_list=False):
@@ -117,6 +156,7 @@ class RdfWrapper:
             warnings.warn(f'A predicate {predicate} was already defined'
                           f'overwriting {predicate} for {self.self_ref}')
             self.remove_attribute(predicate)
+        self._modification_count += 1
         self._rdf.add((self.self_ref, predicate, value))
         self._is_modified = True
 
@@ -128,6 +168,7 @@ class RdfWrapper:
         self-reference subject. Else remove only attributes with the object
         matching the `object` arg.
         """
+        self._modification_count += 1
         self._rdf.remove((self.self_ref, predicate, object))
 
     @property
@@ -180,25 +221,34 @@ class RdfWrapper:
            Removes the existing linguistic system triples from the RDF decription
            and replaces them with the new linguistic system."""
 
+        self._modification_count += 1
         if (None, DCTERMS.language, self.lingsys_ref) not in self._rdf:
             self._rdf.add((self.self_ref, DCTERMS.language, self.lingsys_ref))
 
-        lingsys_triples = list(self._rdf.triples( (self.lingsys_ref, None, None) ))
-        if len(lingsys_triples) > 0:
-            self._rdf.remove(lingsys_triples)
-        self._rdf += value.generate_rdf(self.lingsys_ref)
+        self._rdf.remove((self.lingsys_ref, None, None))
+        self._rdf.addN(triple + (self._rdf,) for triple in value.triples(self.lingsys_ref))
+
+    def shacl_validate(self, engine: str = 'pyshacl'):
+        """
+        Validate the rdf against the PLEX shacl shapes.
 
-    def shacl_validate(self):
-        sg = rdflib.Graph()
-        sg.parse(PLEX_SHAPES_SHACL_FILEPATH, format='ttl')
-        conforms, _, results_text = pyshacl.validate(self._rdf, shacl_graph=sg, inference='rdfs')
+        Args:
+            engine: The validation engine to use, either 'pyshacl' or 'native'. The native engine
+                is a lot faster, see PlexValidator.
+        """
+        conforms, _, results_text = plex_shacl_validate(self._rdf, engine=engine)
         assert conforms, results_text
 
     def anonymise_rdf(self):
         """
         Replace any subjects or objects referring directly to the rdf uri, with a blank node
         """
-        replace_in_rdf(self._rdf, oldvalue=rdflib.URIRef(self.uri), newvalue=self.self_ref)
+        self._replace_all_in_rdf({rdflib.URIRef(self.uri): self.self_ref})
+
+    def _replace_all_in_rdf(self, replacements: Dict):
+        """Replace all occurrences of the keys of replacements in the rdf, see replace_all_in_rdf."""
+        self._modification_count += 1
+        replace_all_in_rdf(self._rdf, replacements)
 
     @classmethod
     def from_rdf(cls, rdf: rdflib.Graph, uri: str, fetch_references: bool = False,
@@ -225,7 +275,7 @@ class RdfWrapper:
             uri: Uri of the object
             force: Toggle raising an error (force=False) or just a warning (force=True)
         """
-        if rdflib.URIRef(uri) not in rdf.subjects():
+        if (rdflib.URIRef(uri), None, None) not in rdf:
             message = (f"Provided URI '{uri}' does not "
                        f"match any subject in provided rdf graph.")
             if force:
@@ -234,7 +284,7 @@ class RdfWrapper:
                 raise ValueError(message + " Use force=True to suppress this error")
 
     @classmethod
-    def from_nanopub(cls, uri: str, use_test_server=False):
+    def from_nanopub(cls, uri: str, use_test_server=False, use_cache=True):
         """Construct RdfWrapper object from an existing nanopublication.
 
         Fetch the nanopublication corresponding to the specified URI. Pass its assertion
@@ -245,24 +295,26 @@ class RdfWrapper:
                 the RDF object as a concept or the URI of a nanopublication fragment pointing to a
                 concept (e.g.: http://purl.org/np/id#concept)
             use_test_server: Toggle using the test nanopub server.
+            use_cache: Toggle using the local on-disk cache of fetched nanopublications. Published
+                nanopublications never change, so this is only worth disabling for debugging.
         """
         # Work out the nanopub URI by defragging the step URI
         nanopub_uri, frag = urldefrag(uri)
 
         # Fetch the nanopub
-        client = NanopubClient(use_test_server=use_test_server)
-        nanopub = client.fetch(nanopub_uri)
+        assertion, introduces_concept = fetch_nanopub_assertion(
+            nanopub_uri, use_test_server=use_test_server, use_cache=use_cache)
 
         if len(frag) > 0:
             # If we found a fragment we can use the passed URI
             uri = uri
-        elif nanopub.introduces_concept:
+        elif introduces_concept:
             # Otherwise we try to extract it from 'introduced concept'
-            uri = str(nanopub.introduces_concept)
+            uri = str(introduces_concept)
         else:
             raise ValueError('This nanopub does not introduce any concepts. Please provide URI to '
                              'the FAIR object itself (not just the nanopub).')
-        self = cls.from_rdf(rdf=nanopub.assertion, uri=uri, fetch_references=True)
+        self = cls.from_rdf(rdf=assertion, uri=uri, fetch_references=True)
         self._derived_from = [uri]
         # Record that this RDF originates from a published source
         self._is_published = True
@@ -283,13 +335,27 @@ class RdfWrapper:
             a dictionary with publication info, including 'nanopub_uri', and 'concept_uri'
         """
 
+        publication = self._prepare_publication(**kwargs)
+        if publication is None:
+            return {'nanopub_uri': None, 'concept_uri': None}
+
+        client = get_nanopub_client(use_test_server=use_test_server)
+        publication_info = client.publish(publication)
+        self._set_published(publication_info)
+        return publication_info
+
+    def _prepare_publication(self, **kwargs) -> Optional['Publication']:
+        """
+        Create the nanopublication for this rdf, see _publish_as_nanopub. Returns None if there is
+        nothing to publish because this rdf was published before and has not been modified.
+        """
         # If this RDF has been modified from something that was previously published,
         # include the original URI in the derived_from PROV (if applicable)
         if self._is_published and not self._is_modified:
             warnings.warn(f'Cannot publish() this Fair object. '
                           f'This rdf is already published (at {self._uri}) '
                           f'and has not been modified locally.')
-            return {'nanopub_uri': None, 'concept_uri': None}
+            return None
 
         for invalid_kwarg in ['introduces_concept', 'assertion_rdf']:
             if invalid_kwarg in kwargs:
@@ -305,14 +371,14 @@ class RdfWrapper:
                                  f'property of this object: {self._derived_from}')
 
         # Publish the rdf of this step as a nanopublication
-        nanopub = Publication.from_assertion(assertion_rdf=self.rdf,
-                                             introduces_concept=self.self_ref,
-                                             derived_from=self._derived_from,
-                                             **kwargs)
-
-        client = NanopubClient(use_test_server=use_test_server)
-        publication_info = client.publish(nanopub)
-
+        from nanopub import Publication
+        return Publication.from_assertion(assertion_rdf=self.rdf,
+                                          introduces_concept=self.self_ref,
+                                          derived_from=self._derived_from,
+                                          **kwargs)
+
+    def _set_published(self, publication_info):
+        """Record that this rdf was published, with the publication info returned by nanopub."""
         # Set the new, published, URI, which should be whatever the (published) URI of the concept that was introduced is.
         # Note that this is NOT the nanopub's URI, since the nanopub is not the step/workflow. The rdf object describing the step/workflow
         # is contained in the assertion graph of the nanopub, and has its own URI.
@@ -321,8 +387,6 @@ class RdfWrapper:
         self._is_published = True
         self._is_modified = False
 
-        return publication_info
-
     @staticmethod
     def _import_graphviz():
         """Import graphviz.
@@ -339,6 +403,7 @@ class RdfWrapper:
                               'Version 0.14.1 is known to work well.')
 
     def display_rdf(self):
+        from rdflib.tools.rdf2dot import rdf2dot
         graphviz = self._import_graphviz()
 
         with TemporaryDirectory() as td:
@@ -348,14 +413,215 @@ class RdfWrapper:
             return graphviz.Source.from_file(filename)
 
 
+@functools.lru_cache()
+def get_plex_shapes_graph() -> rdflib.Graph:
+    """
+    Return the PLEX SHACL shapes graph. It is parsed only once per process, so the returned graph
+    is shared and should not be modified.
+    """
+    sg = rdflib.Graph()
+    sg.parse(PLEX_SHAPES_SHACL_FILEPATH, format='ttl')
+    return sg
+
+
+@functools.lru_cache()
+def get_plex_validator() -> PlexValidator:
+    """Return the native validator for the PLEX shacl shapes, compiled only once per process."""
+    return PlexValidator(get_plex_shapes_graph())
+
+
+def plex_shacl_validate(rdf: rdflib.Graph, engine: str = 'pyshacl'):
+    """
+    Validate rdf against the PLEX shacl shapes.
+
+    Args:
+        rdf: The rdf to validate.
+        engine: The validation engine to use, either 'pyshacl' (with rdfs inference) or 'native'.
+
+    Returns:
+        a tuple (conforms, results_graph, results_text)
+    """
+    if engine not in SHACL_ENGINES:
+        raise ValueError(f'Unknown shacl engine {engine}, must be one of {SHACL_ENGINES}')
+    if engine == 'native':
+        return get_plex_validator().validate(rdf)
+    import pyshacl
+    return pyshacl.validate(rdf, shacl_graph=get_plex_shapes_graph(), inference='rdfs')
+
+
+def shacl_validate_all(objects: List[RdfWrapper], engine: str = 'pyshacl') -> List[Tuple[bool, str]]:
+    """
+    Validate the rdf of many FairSteps and FairWorkflows against the PLEX shacl shapes. With the
+    pyshacl engine this is done in a single pyshacl run over the merged rdf, the native engine
+    validates every object separately.
+
+    The blank nodes of every object (i.e. the self_ref) are renamed while merging, so the objects
+    do not get mixed up. Every validation result is attributed to the objects that contain its
+    focus node.
+
+    Returns:
+        a list with for every object a tuple (conforms, results_text)
+    """
+    if engine == 'native':
+        results = []
+        for obj in objects:
+            conforms, _, results_text = plex_shacl_validate(obj.rdf, engine=engine)
+            results.append((conforms, results_text))
+        return results
+    merged_rdf = rdflib.Graph()
+    node_owners = {}  # The indices of the objects that contain a node in the merged graph
+    original_nodes = {}  # The original (not renamed) nodes
+    for i, obj in enumerate(objects):
+        renamed_bnodes = {}
+
+        def _rename(term):
+            if isinstance(term, rdflib.BNode):
+                if term not in renamed_bnodes:
+                    renamed_bnodes[term] = rdflib.BNode()
+                    original_nodes[renamed_bnodes[term]] = term
+                return renamed_bnodes[term]
+            return term
+
+        for s, p, o in obj.rdf:
+            s, o = _rename(s), _rename(o)
+            merged_rdf.add((s, _rename(p), o))
+            node_owners.setdefault(s, set()).add(i)
+            node_owners.setdefault(o, set()).add(i)
+
+    conforms, report_rdf, _ = plex_shacl_validate(merged_rdf, engine=engine)
+    results = [[] for _ in objects]
+    if not conforms:
+        for result in report_rdf.subjects(RDF.type, namespaces.SHACL.ValidationResult):
+            focus_node = report_rdf.value(result, namespaces.SHACL.focusNode)
+            result_text = _format_shacl_result(report_rdf, result,
+                                               original_nodes.get(focus_node, focus_node))
+            for i in node_owners.get(focus_node, []):
+                results[i].append(result_text)
+    return [(len(object_results) == 0,
+             f'Validation Report\nConforms: {len(object_results) == 0}\n'
+             f'Results ({len(object_results)}):\n' + ''.join(object_results))
+            for object_results in results]
+
+
+def _format_shacl_result(report_rdf: rdflib.Graph, result, focus_node) -> str:
+    """Format a single shacl validation result, similar to the pyshacl results text."""
+    text = (f'Constraint Violation in '
+            f'{report_rdf.value(result, namespaces.SHACL.sourceConstraintComponent)}:\n'
+            f'\tSeverity: {report_rdf.value(result, namespaces.SHACL.resultSeverity)}\n'
+            f'\tSource Shape: {report_rdf.value(result, namespaces.SHACL.sourceShape)}\n'
+            f'\tFocus Node: {focus_node.n3()}\n')
+    result_path = report_rdf.value(result, namespaces.SHACL.resultPath)
+    if result_path is not None:
+        text += f'\tResult Path: {result_path}\n'
+    for message in report_rdf.objects(result, namespaces.SHACL.resultMessage):
+        text += f'\tMessage: {message}\n'
+    return text
+
+
+@functools.lru_cache()
+def get_nanopub_client(use_test_server=False) -> 'NanopubClient':
+    """
+    Return a NanopubClient that is shared throughout the library (one per nanopub server).
+    The client does not hold state between requests, so it can safely be used from
+    multiple threads.
+    """
+    from nanopub import NanopubClient
+    return NanopubClient(use_test_server=use_test_server)
+
+
+def fetch_nanopub_assertion(nanopub_uri: str, use_test_server=False, use_cache=True):
+    """
+    Fetch the assertion graph and the introduced concept (or None) of a nanopublication,
+    from the local nanopub cache if possible.
+    """
+    if use_cache:
+        cached = nanopub_cache.get(nanopub_uri)
+        if cached is not None:
+            return cached
+    client = get_nanopub_client(use_test_server=use_test_server)
+    nanopub = client.fetch(nanopub_uri)
+    if use_cache:
+        nanopub_cache.put(nanopub_uri, nanopub.assertion, nanopub.introduces_concept)
+    return nanopub.assertion, nanopub.introduces_concept
+
+
+def graph_with_namespaces_of(rdf: rdflib.Graph) -> rdflib.Graph:
+    """
+    Create an empty graph with the namespace bindings of rdf. The bindings are copied to the
+    store of the new graph, so binding prefixes in (or serializing) the new graph does not change
+    the prefixes of rdf.
+    """
+    g = rdflib.Graph()
+    store = g.store
+    for prefix, namespace in rdf.namespaces():
+        store.bind(prefix, namespace)
+    return g
+
+
+def copy_triples(rdf: rdflib.Graph) -> rdflib.Graph:
+    """
+    Copy the triples of rdf to a new graph with the same namespace bindings. This is much cheaper
+    than deepcopy, which also copies every term and the internals of the store.
+    """
+    g = graph_with_namespaces_of(rdf)
+    g += rdf
+    return g
+
+
+def get_reachable_triples(rdf: rdflib.Graph, root, excluded_predicates: Iterable = ()):
+    """
+    Select all triples whose subject can be reached from root through an arbitrary-length
+    path of triples (including root itself). So if 'root predicate Something', then all triples
+    'Something predicate object' are selected, and so forth. Triples with one of the
+    excluded_predicates are ignored, and are not followed.
+
+    This is equivalent to the SPARQL query
+    `CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o . ?root (<>|!<>)* ?s . }`, but done as a breadth-first
+    traversal using the indexes of the graph instead.
+    """
+    excluded_predicates = set(excluded_predicates)
+    g = graph_with_namespaces_of(rdf)
+    visited = {root}
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        for s, p, o in rdf.triples((node, None, None)):
+            if p in excluded_predicates:
+                continue
+            g.add((s, p, o))
+            if o not in visited and not isinstance(o, rdflib.Literal):
+                visited.add(o)
+                queue.append(o)
+    return g
+
+
+def replace_all_in_rdf(rdf: rdflib.Graph, replacements: Dict):
+    """
+    Replace every term that is a key in replacements with the corresponding value, wherever it is
+    used as subject, predicate or object. All replacements are done at once, and only the triples
+    that contain one of the terms are visited (found through the indexes of the graph).
+    In a ConjunctiveGraph, replaced triples stay in the named graph they were in.
+    """
+    if isinstance(rdf, rdflib.ConjunctiveGraph):
+        def _find(pattern):
+            return ((s, p, o, context) for s, p, o, context in rdf.quads(pattern))
+    else:
+        def _find(pattern):
+            return ((s, p, o, rdf) for s, p, o in rdf.triples(pattern))
+
+    changed_quads = set()
+    for term in replacements:
+        changed_quads.update(_find((term, None, None)))
+        changed_quads.update(_find((None, term, None)))
+        changed_quads.update(_find((None, None, term)))
+    for s, p, o, context in changed_quads:
+        context.remove((s, p, o))
+    for s, p, o, context in changed_quads:
+        context.add((replacements.get(s, s), replacements.get(p, p), replacements.get(o, o)))
+
+
 def replace_in_rdf(rdf: rdflib.Graph, oldvalue, newvalue):
     """
-    Replace subjects or objects of oldvalue with newvalue
+    Replace subjects, predicates or objects of oldvalue with newvalue
     """
-    for s, p, o in rdf:
-        if s == oldvalue:
-            rdf.remove((s, p, o))
-            rdf.add((newvalue, p, o))
-        elif o == oldvalue:
-            rdf.remove((s, p, o))
-            rdf.add((s, p, newvalue))
+    replace_all_in_rdf(rdf, {oldvalue: newvalue})
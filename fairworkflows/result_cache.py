@@ -0,0 +1,200 @@
+import contextvars
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from fairworkflows.config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_SIZE, \
+    MEMORY_RESULT_CACHE_MAX_SIZE, RESULT_CACHE_ENVIRONMENT_VARIABLE
+from fairworkflows.disk_store import LruDirectory
+
+
+def step_fingerprint(description: str, language) -> str:
+    """Hash of the description (i.e. the code) and the language of a step."""
+    return hashlib.sha256(f'{language}\n{description}'.encode('utf-8')).hexdigest()
+
+
+def result_cache_key(fingerprint: str, arg_names: Sequence[str], args: tuple,
+                     kwargs: dict) -> Optional[str]:
+    """Get the key of the result of a step call in a ResultCache.
+
+    Args:
+        fingerprint: The `step_fingerprint` of the step.
+        arg_names: The names of the positional arguments of the step function.
+        args: The positional arguments the step was called with.
+        kwargs: The keyword arguments the step was called with.
+
+    Returns:
+        The key, or None if the arguments can not be pickled (and the result can not be cached).
+    """
+    step_args = dict(zip(arg_names, args))
+    if kwargs:
+        step_args.update(kwargs)
+    try:
+        serialized_args = pickle.dumps(sorted(step_args.items()), protocol=4)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return hashlib.sha256(fingerprint.encode('utf-8') + serialized_args).hexdigest()
+
+
+class ResultCache:
+    """
+    Base class of caches of the results of step executions, by `result_cache_key`.
+
+    Results are stored pickled, so a cached result is never changed by the code that uses it.
+    Subclasses implement `_get_data`, `_put_data` and `clear`.
+    """
+    def get(self, key: str):
+        """Get the cached result for key, raises KeyError if it is not cached."""
+        data = self._get_data(key)
+        if data is None:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def put(self, key: str, result):
+        """Cache the result for key, results that can not be pickled are not cached."""
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        self._put_data(key, data)
+
+    @contextmanager
+    def activate(self):
+        """Make this the result cache of the current execution context, see `get_result_cache`."""
+        token = _current_result_cache.set(self)
+        try:
+            yield self
+        finally:
+            _current_result_cache.reset(token)
+
+    def _get_data(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _put_data(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        raise NotImplementedError
+
+
+class MemoryResultCache(ResultCache):
+    """
+    In-memory cache of step results. When the total size of the pickled results exceeds max_size
+    the least recently used entries are evicted.
+
+    Args:
+        max_size: Maximum total size of the cache in bytes.
+    """
+    def __init__(self, max_size: int = MEMORY_RESULT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def _get_data(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)  # Mark as recently used
+            return data
+
+    def _put_data(self, key: str, data: bytes):
+        with self.lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_size and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class DiskResultCache(ResultCache):
+    """
+    Persistent on-disk cache of step results, that can be shared by processes.
+
+    Every result is stored pickled in its own file, named by its key. When the total size of the
+    cache exceeds max_size the least recently used entries are evicted.
+
+    Args:
+        directory: The directory to store the cache in, created on first use.
+        max_size: Maximum total size of the cache in bytes.
+    """
+    def __init__(self, directory: Path = RESULT_CACHE_DIR, max_size: int = RESULT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._files = LruDirectory(directory, '.pickle')
+
+    @property
+    def directory(self) -> Path:
+        """The directory the cache is stored in."""
+        return self._files.directory
+
+    def _path(self, key: str) -> Path:
+        return self._files.path(key)
+
+    def get(self, key: str):
+        """Get the cached result for key, raises KeyError if it is not cached.
+
+        An entry that can not be unpickled (e.g. a file that was truncated or written by another
+        version of the step code) is treated as not cached, and removed.
+        """
+        data = self._get_data(key)
+        if data is None:
+            raise KeyError(key)
+        try:
+            return pickle.loads(data)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError,
+                TypeError, ValueError):
+            self._files.remove(key)
+            raise KeyError(key)
+
+    def _get_data(self, key: str) -> Optional[bytes]:
+        return self._files.read(key)
+
+    def _put_data(self, key: str, data: bytes):
+        self._files.write(key, data, self.max_size)
+
+    def clear(self):
+        self._files.clear()
+
+    def worker_environment(self) -> Dict[str, str]:
+        """The environment variables that make worker processes use this cache."""
+        return {RESULT_CACHE_ENVIRONMENT_VARIABLE: json.dumps(
+            {'directory': str(self.directory), 'max_size': self.max_size})}
+
+
+def _get_worker_result_cache() -> Optional[DiskResultCache]:
+    """Get the result cache of the parent process, if this is a worker process that has one."""
+    config = os.environ.get(RESULT_CACHE_ENVIRONMENT_VARIABLE)
+    if config is None:
+        return None
+    return DiskResultCache(**json.loads(config))
+
+
+# The result cache of the parent process, if this is a worker process. It is read once when the
+# worker starts, the parent process only sets it while starting its workers.
+WORKER_RESULT_CACHE = _get_worker_result_cache()
+
+_current_result_cache = contextvars.ContextVar('result_cache', default=None)
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Get the ResultCache of the current execution context, or None if results are not cached."""
+    result_cache = _current_result_cache.get()
+    return WORKER_RESULT_CACHE if result_cache is None else result_cache
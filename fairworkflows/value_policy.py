@@ -0,0 +1,125 @@
+import hashlib
+import math
+import pickle
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+
+from fairworkflows.config import PROV_INLINE_VALUE_MAX_LENGTH, BLOB_STORE_DIR
+from fairworkflows.disk_store import write_atomic
+
+# Types of values that can be inlined in provenance RDF as literals
+SCALAR_TYPES = (bool, int, float, str, datetime, date)
+
+
+class BlobStore:
+    """
+    Content-addressed store of values that are referenced from retrospective provenance.
+
+    Every value is stored in its own file, named by the sha256 hash of its content, so a value
+    that is used in many step executions is stored only once.
+
+    Args:
+        directory: The directory to store the values in, created on first use.
+    """
+    def __init__(self, directory: Path = BLOB_STORE_DIR):
+        self.directory = Path(directory)
+
+    def path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / digest
+
+    def put(self, digest: str, data: bytes) -> Path:
+        """Store data with the given sha256 hex digest, returns the path of its file."""
+        path = self.path(digest)
+        if path.exists():
+            return path
+        write_atomic(path, data)
+        return path
+
+    def get(self, digest: str) -> bytes:
+        """Get the data with the given sha256 hex digest, raises KeyError if it is not stored."""
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(digest)
+
+
+class ValueReference:
+    """
+    Reference to a value that is not inlined in retrospective provenance.
+
+    Attributes:
+        value_type: The qualified name of the type of the value.
+        digest: The sha256 hex digest of the serialized value, or None if it can not be
+            serialized.
+        size: The size of the serialized value in bytes, or None if it can not be serialized.
+        path: The path of the value in the BlobStore, if it was stored.
+    """
+    __slots__ = ('value_type', 'digest', 'size', 'path')
+
+    def __init__(self, value_type: str, digest: Optional[str] = None, size: Optional[int] = None,
+                 path: Optional[Path] = None):
+        self.value_type = value_type
+        self.digest = digest
+        self.size = size
+        self.path = path
+
+
+class ValuePolicy:
+    """
+    Decides how the input and output values of step executions are recorded in retrospective
+    provenance.
+
+    Scalars (see SCALAR_TYPES) with a string representation of at most inline_max_length
+    characters are inlined as literals. Other values are replaced by a ValueReference with their
+    type, size and content hash, so their string representation is never computed. Strings and
+    bytes are hashed as they are, other values are pickled.
+
+    Args:
+        inline_max_length: The maximum length of the string representation of inlined scalars.
+        blob_store: Store the referenced values in this BlobStore, so they can be retrieved by
+            their hash. By default they are not stored.
+    """
+    def __init__(self, inline_max_length: int = PROV_INLINE_VALUE_MAX_LENGTH,
+                 blob_store: Optional[BlobStore] = None):
+        self.inline_max_length = inline_max_length
+        self.blob_store = blob_store
+
+    def should_inline(self, value) -> bool:
+        if value is None:
+            return True
+        if not isinstance(value, SCALAR_TYPES):
+            return False
+        if isinstance(value, str):
+            return len(value) <= self.inline_max_length
+        if isinstance(value, int) and not isinstance(value, bool):
+            # Estimate the number of digits, very large ints can not be converted to str
+            return value.bit_length() * math.log10(2) < self.inline_max_length
+        return True
+
+    def reference(self, value) -> ValueReference:
+        """Get a ValueReference for a value that is not inlined."""
+        value_type = f'{type(value).__module__}.{type(value).__qualname__}'
+        data = _serialize(value)
+        if data is None:
+            return ValueReference(value_type)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_store.put(digest, data) if self.blob_store is not None else None
+        return ValueReference(value_type, digest=digest, size=len(data), path=path)
+
+
+def _serialize(value) -> Optional[bytes]:
+    """Serialize a value for hashing and storing, or None if it can not be serialized."""
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+
+# default_value_policy is used for all retrospective provenance that is not given a policy
+default_value_policy = ValuePolicy()
@@ -0,0 +1,26 @@
+"""
+Workflows defined at module level, so that they can be imported by noodles worker processes.
+"""
+from fairworkflows import is_fairstep, is_fairworkflow
+
+
+@is_fairstep(label='Addition')
+def add(a: float, b: float) -> float:
+    """Adding up numbers."""
+    return a + b
+
+
+@is_fairstep(label='Multiplication')
+def mul(a: float, b: float) -> float:
+    """Multiplying numbers."""
+    return a * b
+
+
+@is_fairworkflow(label='Fan-out workflow')
+def fan_out_workflow(in1, in2):
+    """
+    Two independent additions, followed by a multiplication of their results.
+    """
+    t1 = add(in1, in2)
+    t2 = add(in2, in2)
+    return mul(t1, t2)
@@ -0,0 +1,37 @@
+import rdflib
+
+from fairworkflows import FairStep
+from fairworkflows.checkpoint import Checkpoint
+from fairworkflows.prov import StepExecutionRecord
+from tests import example_workflows
+
+
+def test_save_and_load(tmp_path):
+    step = FairStep.from_function(example_workflows.add)
+    record = StepExecutionRecord(step, ['a', 'b'], (1, 2), {}, 3, 1.0, 2.0)
+    checkpoint = Checkpoint(tmp_path / 'first')
+    checkpoint.save('key', record)
+    assert len(checkpoint) == 1
+    step_prov = rdflib.Graph().parse(str(tmp_path / 'first' / 'key.nt'), format='nt')
+    assert len(step_prov) > 0
+    # Completed steps are only taken from the checkpoint that is resumed
+    assert checkpoint.load('key') is None
+
+    resumed = Checkpoint(tmp_path / 'second', resume_from=tmp_path / 'first')
+    assert resumed.load('other') is None
+    loaded = resumed.load('key')
+    assert loaded.output == 3
+    assert loaded.step is None
+    assert loaded.step_uri == step.uri
+    assert loaded.time_start == record.time_start
+    # The loaded step is also stored in the checkpoint of the resumed execution
+    assert len(resumed) == 1
+    assert (tmp_path / 'second' / 'key.nt').exists()
+
+
+def test_unpicklable_output_is_not_saved(tmp_path):
+    step = FairStep.from_function(example_workflows.add)
+    record = StepExecutionRecord(step, ['a', 'b'], (1, 2), {}, lambda: 3, 1.0, 2.0)
+    checkpoint = Checkpoint(tmp_path)
+    checkpoint.save('key', record)
+    assert len(checkpoint) == 0
@@ -0,0 +1,210 @@
+import time
+from unittest import mock
+
+import pytest
+import rdflib
+
+from fairworkflows import FairStep, FairVariable, FairWorkflow, is_fairstep, is_fairworkflow, \
+    namespaces
+from fairworkflows.execution_plan import STEP, INPUT, CONSTANT
+from fairworkflows.prov import StepRetroProv
+from fairworkflows.result_cache import MemoryResultCache
+from tests import example_workflows
+
+
+def test_compile_decorated_workflow():
+    workflow = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+    plan = workflow.compile()
+    assert workflow.compile() is plan  # Cached until the workflow changes
+    assert plan.inputs == ('in1', 'in2')
+    # Both calls of add are in the plan, followed by mul
+    assert str(plan.steps[-1].step.label) == 'Multiplication'
+    assert len(plan) == 3
+    assert sorted(plan.initial_steps) == [0, 1]
+    assert sorted(plan.steps[2].dependencies) == [0, 1]
+    assert plan.result == (STEP, 2, None)
+    assert {binding.kind for plan_step in plan.steps[:2] for binding in plan_step.args} == {INPUT}
+
+
+@pytest.mark.parametrize('backend', ['single', 'threads'])
+def test_run_plan(backend):
+    workflow = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+    plan = workflow.compile()
+    result, prov = plan.run(1, 4, backend=backend, n_workers=2)
+    assert result == workflow.execute(1, 4)[0] == 40
+    assert len(prov) == 3
+    for step_prov in prov:
+        assert isinstance(step_prov, StepRetroProv)
+        assert step_prov.step in workflow._steps.values()
+    assert plan.run(in1=2, in2=3, backend=backend)[0] == 30
+    with pytest.raises(TypeError):
+        plan.run(1)
+
+
+@pytest.mark.parametrize('backend', ['single', 'threads'])
+def test_execute_many(backend):
+    workflow = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+    with mock.patch('noodles.workflow.from_call') as mock_from_call:
+        results = workflow.execute_many([(1, 4), {'in1': 2, 'in2': 3}, [0, 1]],
+                                        backend=backend, n_workers=4)
+        assert mock_from_call.call_count == 0  # The workflow is not traced again
+    assert [result for result, _ in results] == [40, 30, 2]
+    # Every execution has its own provenance
+    assert [len(prov) for _, prov in results] == [3, 3, 3]
+
+
+def test_execute_many_result_cache():
+    workflow = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+    result_cache = MemoryResultCache()
+    results = workflow.execute_many([(1, 4), (1, 4)], result_cache=result_cache)
+    assert [result for result, _ in results] == [40, 40]
+    assert [step_prov.cache_hit for step_prov in results[1][1]] == [True, True, True]
+
+
+def test_compile_constant_arguments():
+    @is_fairstep(label='Power')
+    def power(base: float, exponent: int = 2) -> float:
+        """Raise to a power."""
+        return base ** exponent
+
+    @is_fairworkflow(label='Constant workflow')
+    def constant_workflow(in1):
+        """
+        A workflow passing constants to its steps.
+        """
+        return power(power(in1, 3))
+
+    plan = FairWorkflow.from_function(constant_workflow).compile()
+    assert plan.steps[0].args[1] == (CONSTANT, 3, None)
+    assert plan.run(2)[0] == 64
+
+
+def test_run_traced_fan_in_plan_threads():
+    @is_fairstep(label='Slow multiplication')
+    def slow_mul(a: float, b: float) -> float:
+        time.sleep(0.05)
+        return a * b
+
+    @is_fairstep(label='Sum of three')
+    def add3(a: float, b: float, c: float) -> float:
+        return a + b + c
+
+    @is_fairworkflow(label='Fan-in workflow')
+    def fan_in_workflow(in1, in2):
+        """
+        A step that takes the result of one step twice, and the result of a slower step.
+        """
+        t1 = example_workflows.add(in1, in2)
+        t2 = slow_mul(in2, in2)
+        return add3(t1, t1, t2)
+
+    plan = FairWorkflow.from_function(fan_in_workflow).compile()
+    fan_in = len(plan) - 1
+    assert sorted(plan.steps[fan_in].dependencies) == [0, 1]
+    # The fan-in step is a dependent of each of its dependencies once
+    assert all(plan_step.dependents == (fan_in,) for plan_step in plan.steps[:fan_in])
+    assert plan.run(1, 4, backend='threads', n_workers=2)[0] == 26
+
+
+def test_run_rdf_fan_in_plan_threads():
+    def first(p: float) -> float:
+        return p + 1
+
+    def second(q: float) -> float:
+        time.sleep(0.05)
+        return q * 10
+
+    def combine(x: float, y: float) -> float:
+        return x + y
+
+    example = 'http://www.example.org/'
+    first_step = FairStep(uri=example + 'first', label='first',
+                          inputs=[FairVariable('p', 'float')],
+                          outputs=[FairVariable('out1', 'float')])
+    second_step = FairStep(uri=example + 'second', label='second',
+                           inputs=[FairVariable('q', 'float')],
+                           outputs=[FairVariable('out1', 'float')])
+    combine_step = FairStep(uri=example + 'combine', label='combine',
+                            inputs=[FairVariable('x', 'float'), FairVariable('y', 'float')],
+                            outputs=[FairVariable('out1', 'float')])
+    workflow = FairWorkflow(first_step=first_step)
+    workflow.add(combine_step, follows=first_step)
+    workflow.add(combine_step, follows=second_step)
+    for source, target in [('first#out1', 'combine#x'), ('second#out1', 'combine#y')]:
+        workflow.rdf.add((rdflib.URIRef(example + source), namespaces.PPLAN.bindsTo,
+                          rdflib.URIRef(example + target)))
+
+    # combine depends on first and second through both dul:precedes and pplan:bindsTo
+    plan = workflow.compile(step_functions={'first': first, 'second': second,
+                                            'combine': combine})
+    assert sorted(plan.steps[-1].dependencies) == [0, 1]
+    assert plan.run(p=1, q=2, backend='threads', n_workers=2)[0] == 22
+
+
+def test_compile_from_rdf():
+    def add(a: float, b: float) -> float:
+        return a + b
+
+    def double(x: float) -> float:
+        return 2 * x
+
+    add_step = FairStep(uri='http://www.example.org/add', label='add',
+                        inputs=[FairVariable('a', 'float'), FairVariable('b', 'float')],
+                        outputs=[FairVariable('out1', 'float')])
+    double_step = FairStep(uri='http://www.example.org/double', label='double',
+                           inputs=[FairVariable('x', 'float')],
+                           outputs=[FairVariable('out1', 'float')])
+    workflow = FairWorkflow(first_step=add_step)
+    workflow.add(double_step, follows=add_step)
+    workflow.rdf.add((rdflib.URIRef('http://www.example.org/add#out1'), namespaces.PPLAN.bindsTo,
+                      rdflib.URIRef('http://www.example.org/double#x')))
+
+    # Workflows that are not built with is_fairworkflow can not be executed
+    with pytest.raises(ValueError):
+        workflow.execute(1, 2)
+    with pytest.raises(ValueError):
+        workflow.compile()
+
+    plan = workflow.compile(step_functions={'http://www.example.org/add': add, 'double': double})
+    assert plan.inputs == ('a', 'b')
+    result, prov = plan.run(1, b=2)
+    assert result == 6
+    assert [step_prov.step for step_prov in prov] == [add_step, double_step]
+    assert [result for result, _ in plan.run_many([(1, 2), (3, 4)], backend='threads')] == [6, 14]
+
+
+def test_compile_from_rdf_with_shared_input_name():
+    def identity(a: float) -> float:
+        return a
+
+    def add(x: float, y: float) -> float:
+        return x + y
+
+    example = 'http://www.example.org/'
+    first_step = FairStep(uri=example + 'first', label='first',
+                          inputs=[FairVariable('a', 'float')],
+                          outputs=[FairVariable('out1', 'float')])
+    second_step = FairStep(uri=example + 'second', label='second',
+                           inputs=[FairVariable('a', 'float')],
+                           outputs=[FairVariable('out1', 'float')])
+    add_step = FairStep(uri=example + 'add', label='add',
+                        inputs=[FairVariable('x', 'float'), FairVariable('y', 'float')],
+                        outputs=[FairVariable('out1', 'float')])
+    workflow = FairWorkflow(first_step=first_step)
+    workflow.add(add_step, follows=first_step)
+    workflow.add(add_step, follows=second_step)
+    for source, target in [('first#out1', 'add#x'), ('second#out1', 'add#y')]:
+        workflow.rdf.add((rdflib.URIRef(example + source), namespaces.PPLAN.bindsTo,
+                          rdflib.URIRef(example + target)))
+    step_functions = {'first': identity, 'second': identity, 'add': add}
+
+    # Both source steps have an unbound input a, they can not both be the input a of the plan
+    with pytest.raises(ValueError, match='unbound input a'):
+        workflow.compile(step_functions=step_functions)
+
+    # Binding one of them to the output of another step resolves it
+    workflow.rdf.add((rdflib.URIRef(example + 'first#out1'), namespaces.PPLAN.bindsTo,
+                      rdflib.URIRef(example + 'second#a')))
+    plan = workflow.compile(step_functions=step_functions)
+    assert plan.inputs == ('a',)
+    assert plan.run(a=3)[0] == 6
@@ -52,6 +52,51 @@ class TestFairStep:
         step.outputs = [outputs]
         assert len(step.outputs) == 1
 
+    def test_variables_are_cached_until_rdf_changes(self):
+        step = FairStep(inputs=[FairVariable('input1', 'int')],
+                        outputs=[FairVariable('output1', 'int')])
+        with patch.object(FairStep, '_get_variable', wraps=step._get_variable) as mock_get:
+            for _ in range(3):
+                assert [var.name for var in step.inputs] == ['input1']
+                assert [var.name for var in step.outputs] == ['output1']
+                assert step.rdf is not None  # Getting the rdf does not invalidate them
+            assert mock_get.call_count == 2
+
+            # Changing the rdf directly invalidates the variables once it is assigned again
+            step.rdf.remove((step.self_ref, namespaces.PPLAN.hasOutputVar, None))
+            step.rdf = step.rdf
+            assert step.outputs == []
+
+        # As does setting them, or replacing the graph
+        step.inputs = [FairVariable('input2', 'str')]
+        assert [(var.name, var.computational_type) for var in step.inputs] == [('input2', 'str')]
+        step.rdf = rdflib.Graph()
+        assert step.inputs == []
+
+    def test_variables_are_invalidated_by_same_size_rdf_change(self):
+        step = FairStep(inputs=[FairVariable('input1', 'int')],
+                        outputs=[FairVariable('output1', 'int')])
+        rdf = step.rdf  # Taken before the variables are cached
+        assert [var.computational_type for var in step.inputs] == ['int']
+        n_triples = len(rdf)
+        var_ref = rdflib.BNode('input1')
+        # Swap one triple for another in place, the number of triples does not change
+        rdf.remove((var_ref, rdflib.RDFS.comment, rdflib.Literal('int')))
+        rdf.add((var_ref, rdflib.RDFS.comment, rdflib.Literal('str')))
+        assert len(rdf) == n_triples
+        step.rdf = rdf
+        assert [var.computational_type for var in step.inputs] == ['str']
+
+        replace_in_rdf(rdf, rdflib.Literal('str'), rdflib.Literal('bool'))
+        step.rdf = rdf
+        assert [var.computational_type for var in step.inputs] == ['bool']
+        step._replace_all_in_rdf({rdflib.Literal('bool'): rdflib.Literal('float')})
+        assert [var.computational_type for var in step.inputs] == ['float']
+
+    def test_variable_hash_is_consistent_with_eq(self):
+        assert hash(FairVariable('a', 'int')) == hash(FairVariable('a', None))
+        assert FairVariable('a', None) == FairVariable('a', 'int')
+
     def test_setters(self):
         step = FairStep()
         step.is_pplan_step = True
@@ -169,8 +214,8 @@ class TestFairStep:
         with pytest.raises(AssertionError):
             step.validate()
 
-    @patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
-    @patch('fairworkflows.rdf_wrapper.NanopubClient.fetch')
+    @patch('nanopub.NanopubClient.publish')
+    @patch('nanopub.NanopubClient.fetch')
     def test_modification_and_republishing(self, nanopub_fetch_mock,
                                            nanopub_publish_mock):
 
@@ -247,7 +292,7 @@ class TestFairStep:
 
         assert len(step.rdf) == n_triples_before, 'shacl_validate mutated RDF'
 
-@patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
+@patch('nanopub.NanopubClient.publish')
 def test_is_fairstep_decorator(mock_publish):
     @is_fairstep(label='test_label')
     def add(a: int, b: int) -> int:
@@ -1,7 +1,12 @@
+import gc
 import inspect
+import threading
 import warnings
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
+import networkx as nx
 import pytest
 import rdflib
 from nanopub.definitions import DUMMY_NANOPUB_URI
@@ -9,9 +14,14 @@ from requests import HTTPError
 
 from conftest import skip_if_nanopub_server_unavailable, read_rdf_test_resource
 from fairworkflows import FairWorkflow, FairStep, namespaces, FairVariable, is_fairstep, is_fairworkflow
-from fairworkflows.prov import WorkflowRetroProv, StepRetroProv
+from fairworkflows.checkpoint import Checkpoint
+from fairworkflows.config import TESTS_RESOURCES
+from fairworkflows.prov import WorkflowRetroProv, StepRetroProv, StepExecutionRecord, ProvFileSink
 from fairworkflows.rdf_wrapper import replace_in_rdf
+from fairworkflows.result_cache import MemoryResultCache, DiskResultCache
+from fairworkflows.value_policy import ValuePolicy, BlobStore
 from nanopub import Publication
+from tests import example_workflows
 
 
 class TestFairWorkflow:
@@ -166,6 +176,25 @@ class TestFairWorkflow:
         for irrelevant_triple in test_irrelevant_triples:
             assert irrelevant_triple not in workflow.rdf
 
+    def test_construct_from_rdf_does_not_copy_graph(self):
+        """
+        Constructing a FairWorkflow from a large graph should not copy the whole graph, only the
+        triples of the workflow. See benchmarks/bench_from_rdf.py for its time and memory.
+        """
+        rdf = read_rdf_test_resource('test_workflow.trig')
+        uri = 'http://www.example.org/workflow1'
+        noise = rdflib.Namespace('http://www.example.org/noise#')
+        for i in range(5000):
+            rdf.add((noise[f'subject{i}'], noise.predicate, rdflib.Literal(i)))
+
+        with mock.patch('copy.deepcopy') as mock_deepcopy:
+            workflow = FairWorkflow.from_rdf(rdf, uri, fetch_references=False)
+
+        assert mock_deepcopy.call_count == 0
+        assert workflow.rdf is not rdf
+        assert len(workflow.rdf) < 10
+        assert (noise.subject0, noise.predicate, rdflib.Literal(0)) not in workflow.rdf
+
     @pytest.mark.flaky(max_runs=10)
     @skip_if_nanopub_server_unavailable
     def test_construction_from_nanopub(self):
@@ -183,6 +212,75 @@ class TestFairWorkflow:
             steps = list(workflow)
             assert len(steps) > 0
 
+    @pytest.fixture()
+    def concurrent_nanopub_server(self):
+        """
+        Local stand-in for the nanopub server that serves the sample step nanopub for any
+        nanopub id. It holds every request until expected_in_flight requests are in flight at
+        the same time (or a timeout passes), and records the maximum number of requests that
+        were in flight in max_in_flight.
+        """
+        original_uri = 'http://purl.org/np/RACLlhNijmCk4AX_2PuoBPHKfY1T6jieGaUPVFv-fWCAg'
+        with open(TESTS_RESOURCES / 'sample_fairstep_nanopub.trig') as f:
+            sample_trig = f.read()
+
+        class ConcurrentNanopubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server = self.server
+                with server.lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    if server.in_flight >= server.expected_in_flight:
+                        server.all_in_flight.set()
+                try:
+                    # Requests that are made one after the other each wait for the timeout
+                    server.all_in_flight.wait(timeout=5)
+                    nanopub_uri = f'http://localhost:{server.server_port}' \
+                                  + self.path[:-len('.trig')]
+                    body = sample_trig.replace(original_uri, nanopub_uri).encode()
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/trig')
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('localhost', 0), ConcurrentNanopubHandler)
+        server.lock = threading.Lock()
+        server.in_flight = 0
+        server.max_in_flight = 0
+        server.expected_in_flight = 1
+        server.all_in_flight = threading.Event()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_construct_from_rdf_fetch_steps_concurrently(self, concurrent_nanopub_server):
+        """Steps are fetched concurrently, so all requests are in flight at the same time."""
+        n_steps = 6
+        concurrent_nanopub_server.expected_in_flight = n_steps
+        uri = 'http://www.example.org/workflow1'
+        rdf = rdflib.Graph()
+        rdf.add((rdflib.URIRef(uri), rdflib.RDF.type, namespaces.PPLAN.Plan))
+        step_uris = [f'http://localhost:{concurrent_nanopub_server.server_port}/np{i}#step'
+                     for i in range(n_steps)]
+        for step_uri in step_uris:
+            rdf.add((rdflib.URIRef(step_uri), namespaces.PPLAN.isStepOfPlan,
+                     rdflib.URIRef(uri)))
+
+        workflow = FairWorkflow.from_rdf(rdf, uri, fetch_references=True)
+
+        assert sorted(workflow._steps.keys()) == sorted(step_uris)
+        for step in workflow._steps.values():
+            assert str(step.label) == 'Preheat oven'
+        assert concurrent_nanopub_server.max_in_flight == n_steps
+
     @mock.patch('fairworkflows.fairworkflow.FairStep.from_nanopub')
     def test_fetch_step_404(self, mock_from_nanopub, test_workflow):
         response = mock.MagicMock(status_code=404)
@@ -209,6 +307,31 @@ class TestFairWorkflow:
         for i, step in enumerate(workflow_steps):
             assert step == right_order_steps[i]
 
+    def test_iterator_order_is_cached(self, test_workflow, test_step3):
+        """The topological order is only recomputed after the workflow changed."""
+        with mock.patch('networkx.topological_sort',
+                        wraps=nx.topological_sort) as mock_sort:
+            for _ in range(3):
+                list(test_workflow)
+            assert mock_sort.call_count == 1
+
+            step4 = FairStep(uri='http://www.example.org/step4')
+            test_workflow.add(step4, follows=test_step3)
+            assert list(test_workflow)[-1] == step4
+            assert mock_sort.call_count == 2
+
+    def test_iterator_from_rdf(self):
+        rdf = read_rdf_test_resource('test_workflow.trig')
+        uri = 'http://www.example.org/workflow1'
+        step1 = rdflib.URIRef('http://www.example.org/step1')
+        step2 = rdflib.URIRef('http://www.example.org/step2')
+        rdf.add((step2, namespaces.PPLAN.isStepOfPlan, rdflib.URIRef(uri)))
+        rdf.add((step1, namespaces.DUL.precedes, step2))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            workflow = FairWorkflow.from_rdf(rdf, uri, fetch_references=False)
+        assert [step.uri for step in workflow] == [str(step1), str(step2)]
+
     def test_iterator_one_step(self, test_step1):
         workflow = FairWorkflow()
         workflow.add(test_step1)
@@ -226,6 +349,22 @@ class TestFairWorkflow:
         with pytest.raises(RuntimeError):
             list(workflow)
 
+    def test_contains(self, test_step1, test_step2, test_workflow):
+        """Membership is checked by step object, without sorting the steps."""
+        with mock.patch('networkx.topological_sort') as mock_sort:
+            assert test_step1 in test_workflow
+            assert FairStep(uri=test_step1.uri) not in test_workflow
+            assert 'not a step' not in test_workflow
+            assert test_step2 in FairWorkflow(first_step=test_step2)
+            assert mock_sort.call_count == 0
+
+    def test_registered_workflows_are_weakly_referenced(self, test_step1, test_workflow):
+        other_workflow = FairWorkflow(first_step=test_step1)
+        assert set(test_step1._workflows) == {test_workflow, other_workflow}
+        del other_workflow
+        gc.collect()
+        assert set(test_step1._workflows) == {test_workflow}
+
     @mock.patch.dict('sys.modules', {'graphviz': None})
     def test_draw_without_graphviz_module(self, tmp_path, test_workflow):
         """Test draw method without graphviz python module installed."""
@@ -265,7 +404,7 @@ class TestFairWorkflow:
         """
         test_workflow.display_rdf()
 
-    @mock.patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
+    @mock.patch('nanopub.NanopubClient.publish')
     def test_publish_as_nanopub(self, mock_publish, test_workflow):
         test_published_uris = ['www.example.org/published_step1#step',
                                'www.example.org/published_step2#step',
@@ -294,7 +433,50 @@ class TestFairWorkflow:
                     and (None, None, rdflib.URIRef(uri)) not in test_workflow.rdf), \
                 'The old step URIs are still in the workflow'
 
-    @mock.patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
+    @mock.patch('nanopub.NanopubClient.publish')
+    def test_publish_as_nanopub_publish_steps_rewrites_bindings(self, mock_publish):
+        """
+        Publishing the steps of a workflow concurrently replaces the temporary uris of the steps
+        and their variables in the workflow.
+        """
+        @is_fairstep(label='Addition')
+        def add(a: float, b: float) -> float:
+            return a + b
+
+        @is_fairstep(label='Multiplication')
+        def mul(a: float, b: float) -> float:
+            return a * b
+
+        @is_fairworkflow(label='My Workflow')
+        def my_workflow(in1, in2):
+            return mul(add(in1, in2), in2)
+
+        fw = FairWorkflow.from_function(my_workflow)
+        old_uris = {step.uri for step in fw}
+        published_uris = {}
+        lock = threading.Lock()
+
+        def publish(publication):
+            with lock:
+                uri = f'http://www.example.org/published{len(published_uris)}#step'
+                published_uris[uri] = publication
+            return {'nanopub_uri': uri.split('#')[0], 'concept_uri': uri}
+        mock_publish.side_effect = publish
+
+        fw.publish_as_nanopub(publish_steps=True)
+        assert mock_publish.call_count == 3  # 2 steps, 1 workflow
+        for step in fw:
+            assert step.uri in published_uris
+            assert not step.is_modified
+        subjects_and_objects = {str(term) for s, _, o in fw.rdf for term in (s, o)}
+        for old_uri in old_uris:
+            assert not any(term.startswith(old_uri) for term in subjects_and_objects)
+        bindings = list(fw.rdf.triples((None, namespaces.PPLAN.bindsTo, None)))
+        assert len(bindings) > 0
+        for var_uri, _, _ in bindings:
+            assert str(var_uri).split('#')[0] + '#step' in published_uris
+
+    @mock.patch('nanopub.NanopubClient.publish')
     def test_publish_as_nanopub_no_modifications(self, mock_publish, test_workflow):
         """
         Test case of an already published workflow that itself nor its steps are not modified.
@@ -308,7 +490,7 @@ class TestFairWorkflow:
         assert mock_publish.call_count == 0
         assert pubinfo['nanopub_uri'] is None
 
-    @mock.patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
+    @mock.patch('nanopub.NanopubClient.publish')
     def test_workflow_construction_and_execution(self, mock_publish):
         """
         Construct a workflow using the is_fairstep and is_fairworkflow decorators
@@ -377,6 +559,281 @@ class TestFairWorkflow:
         for uri in test_published_uris[:4]:
             assert (None, namespaces.PROV.hasMember, rdflib.URIRef(uri)) in prov._rdf
 
+    @pytest.mark.parametrize('backend', ['single', 'threads', 'processes'])
+    def test_workflow_execution_backends(self, backend):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        result, prov = fw.execute(1, 4, backend=backend, n_workers=2)
+        assert result == 40
+        assert len(prov) == 3
+        for step_prov in prov:
+            assert isinstance(step_prov, StepRetroProv)
+            assert step_prov.step in fw._steps.values()
+
+    def test_workflow_execution_step_overhead(self):
+        """Steps log a cheap record, without inspecting the function on every call."""
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        time_before = datetime.now()
+        with mock.patch('fairworkflows.fairstep.inspect.getfullargspec',
+                        side_effect=AssertionError('inspected during step call')):
+            result, prov = fw.execute(1, 4)
+        assert result == 40
+        for step_prov in prov:
+            time_start = step_prov.get_attribute(namespaces.PROV.startedAtTime).toPython()
+            time_end = step_prov.get_attribute(namespaces.PROV.endedAtTime).toPython()
+            assert time_before - timedelta(seconds=1) <= time_start <= time_end
+            assert time_end <= datetime.now() + timedelta(seconds=1)
+            assert step_prov.get_attribute(namespaces.PROV.used) is not None
+
+    def test_workflow_execution_builds_step_prov_lazily(self):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        with mock.patch('fairworkflows.prov.StepRetroProv.__init__',
+                        side_effect=AssertionError('built step prov')):
+            _, prov = fw.execute(1, 4)
+            assert len(prov) == 3
+        step_provs = list(prov)
+        assert [step_prov.step for step_prov in step_provs] == [step_prov.step for step_prov in prov]
+        assert all(a is b for a, b in zip(step_provs, prov))  # Built only once
+
+    def test_step_execution_records_are_compact(self):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        step = example_workflows.add._fairstep
+        with mock.patch('fairworkflows.prov.StepRetroProv.__init__',
+                        side_effect=AssertionError('built step prov')):
+            record = StepExecutionRecord(step, ['a', 'b'], (1, 2), {}, 3, 0.0, 1.0)
+            # Records only hold references to the arguments and output, in slots
+            assert 'output' in StepExecutionRecord.__slots__
+            assert not hasattr(record, '__dict__')
+            assert record.step_args == {'a': 1, 'b': 2}
+            # The provenance RDF is not built until it is accessed
+            prov = fw._generate_retrospective_prov_publication([record])
+            assert len(prov) == 1
+        step_prov, = prov
+        assert isinstance(step_prov, StepRetroProv)
+        assert step_prov.step is step
+
+    @pytest.mark.parametrize('prov_format', ['nquads', 'nt'])
+    @pytest.mark.parametrize('backend', ['single', 'processes'])
+    def test_workflow_execution_prov_sink(self, tmp_path, prov_format, backend):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        _, expected_prov = fw.execute(1, 4)
+        prov_sink = ProvFileSink(tmp_path / 'prov.nq', format=prov_format, batch_size=2,
+                                 max_file_size=1)
+        for _ in range(2):
+            result, prov = fw.execute(1, 4, backend=backend, prov_sink=prov_sink)
+            assert result == 40
+            assert len(prov) == 0  # Streamed to the sink instead
+        assert len(prov_sink.paths()) > 1  # Rotated to new files
+
+        loaded_prov = fw.load_retrospective_prov(ProvFileSink(tmp_path / 'prov.nq',
+                                                              format=prov_format))
+        assert isinstance(loaded_prov, WorkflowRetroProv)
+        assert len(loaded_prov) == 6
+
+        def bindings(step_prov):
+            return {(str(step_prov.rdf.value(var, rdflib.RDFS.label)),
+                     step_prov.rdf.value(var, rdflib.RDF.value).toPython())
+                    for var in step_prov.rdf.objects(step_prov.self_ref, namespaces.PROV.used)}
+
+        expected_bindings = sorted((str(step_prov.step_uri), sorted(bindings(step_prov)))
+                                   for step_prov in expected_prov)
+        for run in range(2):
+            step_provs = list(loaded_prov)[run * 3:(run + 1) * 3]
+            for step_prov in step_provs:
+                assert step_prov.step in fw._steps.values()
+            assert sorted((str(step_prov.step_uri), sorted(bindings(step_prov)))
+                          for step_prov in step_provs) == expected_bindings
+
+    def test_workflow_execution_prov_sink_keeps_provenance_of_crashed_run(self, tmp_path):
+        @is_fairstep(label='Addition')
+        def add(a: float, b: float) -> float:
+            return a + b
+
+        @is_fairstep(label='Failing step')
+        def fail(a: float) -> float:
+            raise RuntimeError('Failing step')
+
+        @is_fairworkflow(label='Failing workflow')
+        def failing_workflow(in1, in2):
+            return fail(add(in1, in2))
+
+        fw = FairWorkflow.from_function(failing_workflow)
+        prov_sink = ProvFileSink(tmp_path / 'prov.nq')
+        with pytest.raises(Exception):
+            fw.execute(1, 4, prov_sink=prov_sink)
+        step_provs = prov_sink.read_step_provs(steps=fw._steps)
+        assert len(step_provs) == 1
+        assert step_provs[0].step is fw.get_step(str(step_provs[0].step_uri))
+
+    @pytest.mark.parametrize('backend', ['single', 'threads', 'processes'])
+    def test_concurrent_workflow_executions_keep_their_provenance(self, backend):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        n_executions = 4
+        barrier = threading.Barrier(n_executions)
+        results = {}
+
+        def execute(in1):
+            barrier.wait()
+            results[in1] = fw.execute(in1, 4, backend=backend, n_workers=2)
+
+        threads = [threading.Thread(target=execute, args=(in1,))
+                   for in1 in range(10, 10 + n_executions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == n_executions
+        for in1, (_, prov) in results.items():
+            assert len(prov) == 3
+            used_values = {step_prov.rdf.value(var, rdflib.RDF.value).toPython()
+                           for step_prov in prov
+                           for var in step_prov.rdf.objects(step_prov.self_ref,
+                                                            namespaces.PROV.used)}
+            # The outputs of the steps are also recorded as prov:used
+            assert used_values == {in1, 4, in1 + 4, 8, (in1 + 4) * 8}
+
+    def test_workflow_execution_result_cache(self):
+        calls = []
+
+        @is_fairstep(label='Addition')
+        def add(a: float, b: float) -> float:
+            calls.append('add')
+            return a + b
+
+        @is_fairstep(label='Multiplication')
+        def mul(a: float, b: float) -> float:
+            calls.append('mul')
+            return a * b
+
+        @is_fairworkflow(label='Cached workflow')
+        def cached_workflow(in1, in2):
+            return mul(add(in1, in2), add(in2, in2))
+
+        fw = FairWorkflow.from_function(cached_workflow)
+        result_cache = MemoryResultCache()
+        result, prov = fw.execute(1, 4, result_cache=result_cache)
+        assert result == 40
+        assert sorted(calls) == ['add', 'add', 'mul']
+        assert not any(step_prov.cache_hit for step_prov in prov)
+
+        calls.clear()
+        result, prov = fw.execute(1, 4, result_cache=result_cache)
+        assert result == 40
+        assert calls == []
+        assert all(step_prov.cache_hit for step_prov in prov)
+
+        # Only the steps with changed arguments are executed again
+        result, prov = fw.execute(2, 4, result_cache=result_cache)
+        assert result == 48
+        assert sorted(calls) == ['add', 'mul']
+        assert sorted(step_prov.cache_hit for step_prov in prov) == [False, False, True]
+
+        # Without a cache all steps are executed
+        calls.clear()
+        fw.execute(1, 4)
+        assert len(calls) == 3
+
+    def test_workflow_execution_result_cache_processes(self, tmp_path):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        result_cache = DiskResultCache(tmp_path)
+        for cache_hit in [False, True]:
+            result, prov = fw.execute(1, 4, backend='processes', n_workers=2,
+                                      result_cache=result_cache)
+            assert result == 40
+            assert [step_prov.cache_hit for step_prov in prov] == [cache_hit] * 3
+        with pytest.raises(ValueError):
+            fw.execute(1, 4, backend='processes', result_cache=MemoryResultCache())
+
+    def test_workflow_execution_checkpoint(self, tmp_path):
+        calls = []
+        fail = [True]
+
+        @is_fairstep(label='Addition')
+        def add(a: float, b: float) -> float:
+            calls.append('add')
+            return a + b
+
+        @is_fairstep(label='Multiplication')
+        def mul(a: float, b: float) -> float:
+            calls.append('mul')
+            if fail:
+                raise RuntimeError('Multiplication failed')
+            return a * b
+
+        @is_fairworkflow(label='Checkpointed workflow')
+        def checkpointed_workflow(in1, in2):
+            return mul(add(in1, in2), add(in2, in2))
+
+        fw = FairWorkflow.from_function(checkpointed_workflow)
+        with pytest.raises(Exception):
+            fw.execute(1, 4, checkpoint_dir=tmp_path)
+        assert sorted(calls) == ['add', 'add', 'mul']
+        assert len(Checkpoint(tmp_path)) == 2
+
+        # Only the failed step is executed again
+        fail.clear()
+        calls.clear()
+        result, prov = fw.execute(1, 4, resume=tmp_path)
+        assert result == 40
+        assert calls == ['mul']
+        assert len(list(prov)) == 3
+        assert len(Checkpoint(tmp_path)) == 3
+
+        calls.clear()
+        result, prov = fw.execute(1, 4, resume=tmp_path)
+        assert result == 40
+        assert calls == []
+        # Steps with other arguments are not completed in the checkpoint
+        result, prov = fw.execute(2, 4, resume=tmp_path)
+        assert result == 48
+        assert sorted(calls) == ['add', 'mul']
+
+    def test_workflow_execution_checkpoint_processes(self, tmp_path):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        result, prov = fw.execute(1, 4, backend='processes', n_workers=2,
+                                  checkpoint_dir=tmp_path / 'first')
+        assert result == 40
+        assert len(Checkpoint(tmp_path / 'first')) == 3
+        result, prov = fw.execute(1, 4, backend='processes', n_workers=2,
+                                  checkpoint_dir=tmp_path / 'second', resume=tmp_path / 'first')
+        assert result == 40
+        assert len(list(prov)) == 3
+        assert len(Checkpoint(tmp_path / 'second')) == 3
+
+    def test_workflow_execution_references_large_values(self, tmp_path):
+        @is_fairstep(label='Repeat')
+        def repeat(a: str, n: int) -> str:
+            return a * n
+
+        @is_fairworkflow(label='Large value workflow')
+        def large_value_workflow(in1, in2):
+            return repeat(in1, in2)
+
+        fw = FairWorkflow.from_function(large_value_workflow)
+        blob_store = BlobStore(tmp_path)
+        result, prov = fw.execute('abc', 1000,
+                                  value_policy=ValuePolicy(inline_max_length=100,
+                                                           blob_store=blob_store))
+        assert len(result) == 3000
+        step_prov = list(prov)[0]
+        variables = {str(step_prov.rdf.value(var, rdflib.RDFS.label)): var
+                     for var in step_prov.rdf.objects(step_prov.self_ref, namespaces.PROV.used)}
+        assert step_prov.rdf.value(variables['a'], rdflib.RDF.value).toPython() == 'abc'
+        assert step_prov.rdf.value(variables['n'], rdflib.RDF.value).toPython() == 1000
+        output = variables['out1']
+        assert step_prov.rdf.value(output, rdflib.RDF.value) is None
+        assert str(step_prov.rdf.value(output, namespaces.FW.valueType)) == 'builtins.str'
+        assert step_prov.rdf.value(output, namespaces.FW.byteSize).toPython() == 3000
+        digest = str(step_prov.rdf.value(output, namespaces.FW.contentHash))[len('sha256:'):]
+        assert blob_store.get(digest) == result.encode()
+        location = step_prov.rdf.value(output, namespaces.PROV.atLocation)
+        assert location == rdflib.URIRef(blob_store.path(digest).absolute().as_uri())
+
+    def test_workflow_execution_unknown_backend(self):
+        fw = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+        with pytest.raises(ValueError):
+            fw.execute(1, 4, backend='gpu')
+
     def test_workflow_complex_serialization(self):
         class OtherType:
             def __init__(self, message):
@@ -397,6 +854,34 @@ class TestFairWorkflow:
         assert result.message == obj.message
         assert isinstance(prov, WorkflowRetroProv)
 
+    def test_decorated_workflow_is_built_on_first_use(self):
+        traced = []
+
+        @is_fairstep(label='Addition')
+        def add(a: float, b: float) -> float:
+            """Adding up numbers."""
+            return a + b
+
+        with mock.patch.object(FairWorkflow, 'from_noodles_promise',
+                               wraps=FairWorkflow.from_noodles_promise) as mock_build:
+            @is_fairworkflow(label='Lazy workflow')
+            def lazy_workflow(in1, in2):
+                """
+                A workflow that is only built when it is used.
+                """
+                traced.append(in1)
+                return add(in1, in2)
+
+            assert len(traced) == 1
+            assert mock_build.call_count == 0
+
+            workflow = FairWorkflow.from_function(lazy_workflow)
+            assert FairWorkflow.from_function(lazy_workflow) is workflow
+            assert mock_build.call_count == 1
+        assert len(traced) == 1
+        assert 'A workflow that is only built when it is used.' in workflow.description
+        assert len(list(workflow)) == 1
+
     def test_workflow_non_decorated_step(self):
         def return_value(a: float) -> float:
             """Return the input value. NB: no is_fairstep decorator!"""
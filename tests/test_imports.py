@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+# Dependencies that are slow to import, and are only needed for some of the functionality
+LAZY_MODULES = ['pyshacl', 'nanopub', 'networkx', 'graphviz', 'jinja2', 'rdflib.tools.rdf2dot']
+
+DECORATE_FUNCTIONS = """
+from fairworkflows import is_fairstep, is_fairworkflow
+
+@is_fairstep(label='Addition')
+def add(a: float, b: float) -> float:
+    return a + b
+
+@is_fairworkflow(label='Workflow')
+def workflow(in1, in2):
+    return add(in1, in2)
+"""
+
+
+def _get_imported_lazy_modules(code: str):
+    code += f'\nimport sys\nprint(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return [module for module in output.strip().split(',') if module]
+
+
+def test_import_does_not_import_heavy_dependencies():
+    assert _get_imported_lazy_modules('import fairworkflows') == []
+
+
+def test_decorating_functions_does_not_import_heavy_dependencies(tmp_path):
+    # The decorators read the source code of the functions, so they are defined in a module
+    (tmp_path / 'decorated_functions.py').write_text(DECORATE_FUNCTIONS)
+    code = f'import sys\nsys.path.insert(0, {str(tmp_path)!r})\nimport decorated_functions'
+    assert _get_imported_lazy_modules(code) == []
@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from fairworkflows import FairStep, FairVariable
+from fairworkflows import manual_assistant
+from fairworkflows.manual_assistant import ManualAssistant
+
+
+def _manual_step(label):
+    return FairStep(label=label, is_manual_task=True,
+                    inputs=[FairVariable(name='a', computational_type='int')],
+                    outputs=[FairVariable(name='out1', computational_type='int'),
+                             FairVariable(name='out2', computational_type='str')])
+
+
+def _confirm(url, output_names):
+    data = urllib.parse.urlencode({base64.b64encode(name.encode()).decode(): 'True'
+                                   for name in output_names}).encode()
+    with urllib.request.urlopen(url, data=data) as response:
+        return response.read().decode()
+
+
+@pytest.fixture()
+def assistant():
+    assistant = ManualAssistant(port=0)
+    with mock.patch.object(manual_assistant, '_manual_assistant', assistant):
+        yield assistant
+    assistant.stop()
+
+
+def test_serve_multiple_pending_manual_steps(assistant):
+    futures = [assistant.submit(_manual_step(f'Step {i}')) for i in range(2)]
+    with urllib.request.urlopen(assistant.url) as response:
+        index = response.read().decode()
+    tasks = assistant.pending_tasks()
+    assert len(tasks) == 2
+    for task in tasks:
+        assert task.path in index
+        with urllib.request.urlopen(assistant.url + task.path) as response:
+            assert task.step.label in response.read().decode()
+
+    # Not all outputs are confirmed, the page is displayed again
+    _confirm(assistant.url + tasks[1].path, ['out1'])
+    assert not futures[1].done()
+
+    # Redirects to the list of pending steps
+    assert 'Step 0' in _confirm(assistant.url + tasks[1].path, ['out1', 'out2'])
+    assert futures[1].result(timeout=5) == {'out1': True, 'out2': True}
+    assert not futures[0].done()
+    assert assistant.pending_tasks() == tasks[:1]
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(assistant.url + tasks[1].path)
+
+
+def test_execute_manual_step_only_blocks_calling_thread(assistant):
+    steps = [_manual_step(f'Step {i}') for i in range(3)]
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = [executor.submit(manual_assistant.execute_manual_step, step)
+                   for step in steps]
+        while len(assistant.pending_tasks()) < len(steps):
+            time.sleep(0.01)
+        for task in assistant.pending_tasks():
+            _confirm(assistant.url + task.path, ['out1', 'out2'])
+        assert [future.result(timeout=5) for future in futures] == \
+               [{'out1': True, 'out2': True}] * len(steps)
+
+
+def test_execute_manual_step_async(assistant):
+    async def execute():
+        return await manual_assistant.execute_manual_step_async(_manual_step('Step'))
+
+    async def confirm():
+        while not assistant.pending_tasks():
+            await asyncio.sleep(0.01)
+        task = assistant.pending_tasks()[0]
+        await asyncio.get_event_loop().run_in_executor(
+            None, _confirm, assistant.url + task.path, ['out1', 'out2'])
+
+    async def main():
+        return (await asyncio.gather(execute(), confirm()))[0]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(main()) == {'out1': True, 'out2': True}
+    finally:
+        loop.close()
+
+
+def test_stop_fails_pending_manual_steps(assistant):
+    future = assistant.submit(_manual_step('Step'))
+    assistant.stop()
+    with pytest.raises(RuntimeError):
+        future.result(timeout=5)
+
+
+def test_manual_step_page_is_rendered_once(assistant):
+    assistant.submit(_manual_step('Step'))
+    task = assistant.pending_tasks()[0]
+    with mock.patch('fairworkflows.manual_assistant._render_manual_step',
+                    wraps=manual_assistant._render_manual_step) as render:
+        for _ in range(3):
+            with urllib.request.urlopen(assistant.url + task.path) as response:
+                assert 'Step' in response.read().decode()
+    assert render.call_count == 1
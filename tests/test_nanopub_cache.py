@@ -0,0 +1,70 @@
+import os
+from unittest import mock
+
+import rdflib
+from nanopub import Publication
+
+from conftest import read_rdf_test_resource
+from fairworkflows import FairStep, rdf_wrapper
+from fairworkflows.nanopub_cache import NanopubCache
+
+TEST_NANOPUB_URI = 'http://purl.org/np/RACLlhNijmCk4AX_2PuoBPHKfY1T6jieGaUPVFv-fWCAg'
+
+
+def _test_assertion():
+    assertion = rdflib.Graph()
+    assertion.bind('ex', 'http://www.example.org/')
+    assertion.add((rdflib.URIRef('http://www.example.org/step'), rdflib.RDFS.label,
+                   rdflib.Literal('A step')))
+    return assertion
+
+
+def test_put_and_get(tmp_path):
+    cache = NanopubCache(directory=tmp_path)
+    concept = rdflib.URIRef(TEST_NANOPUB_URI + '#step')
+    assert cache.get(TEST_NANOPUB_URI) is None
+
+    cache.put(TEST_NANOPUB_URI, _test_assertion(), concept)
+    assertion, introduces_concept = cache.get(TEST_NANOPUB_URI)
+    assert set(assertion) == set(_test_assertion())
+    assert ('ex', rdflib.URIRef('http://www.example.org/')) in set(assertion.namespaces())
+    assert introduces_concept == concept
+
+
+def test_tests_use_an_empty_cache(tmp_path):
+    """The nanopub cache in the home directory is not used by tests, see conftest.py."""
+    assert rdf_wrapper.nanopub_cache.directory == tmp_path / 'nanopub_cache'
+    assert rdf_wrapper.nanopub_cache.get(TEST_NANOPUB_URI) is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = NanopubCache(directory=tmp_path)
+    uris = [f'http://purl.org/np/test{i}' for i in range(3)]
+    for i, uri in enumerate(uris):
+        cache.put(uri, _test_assertion())
+        # Make sure the modification times are ordered
+        os.utime(cache._path(uri), (i, i))
+    entry_size = cache._path(uris[0]).stat().st_size
+
+    # Using the first entry makes the second one the least recently used
+    assert cache.get(uris[0]) is not None
+    cache.max_size = 3 * entry_size
+    cache.put('http://purl.org/np/test3', _test_assertion())
+
+    assert cache.get(uris[1]) is None
+    for uri in [uris[0], uris[2], 'http://purl.org/np/test3']:
+        assert cache.get(uri) is not None
+
+
+@mock.patch('nanopub.NanopubClient.fetch')
+def test_from_nanopub_uses_cache(mock_fetch):
+    nanopub_rdf = read_rdf_test_resource('sample_fairstep_nanopub.trig')
+    mock_fetch.return_value = Publication(rdf=nanopub_rdf, source_uri=TEST_NANOPUB_URI)
+
+    steps = [FairStep.from_nanopub(uri=TEST_NANOPUB_URI + '#step') for _ in range(2)]
+    assert mock_fetch.call_count == 1
+    assert set(steps[0].rdf) == set(steps[1].rdf)
+    assert str(steps[1].label) == 'Preheat oven'
+
+    FairStep.from_nanopub(uri=TEST_NANOPUB_URI + '#step', use_cache=False)
+    assert mock_fetch.call_count == 2
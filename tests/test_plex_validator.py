@@ -0,0 +1,82 @@
+import pytest
+import rdflib
+from rdflib import RDF, RDFS, DCTERMS
+
+from fairworkflows import FairWorkflow, namespaces
+from fairworkflows.namespaces import SHACL as SH
+from fairworkflows.plex_validator import PlexValidator
+from fairworkflows.rdf_wrapper import get_plex_shapes_graph, plex_shacl_validate
+from tests import example_workflows
+
+EX = rdflib.Namespace('http://www.example.org/')
+PWO_HAS_FIRST_STEP = rdflib.URIRef('http://purl.org/spar/pwo#hasFirstStep')
+
+
+def _results(results_graph):
+    """The validation results in a report graph, as comparable tuples."""
+    return {(results_graph.value(result, SH.focusNode),
+             results_graph.value(result, SH.sourceShape),
+             results_graph.value(result, SH.sourceConstraintComponent),
+             results_graph.value(result, SH.value),
+             results_graph.value(result, SH.resultPath))
+            for result in results_graph.subjects(RDF.type, SH.ValidationResult)}
+
+
+def _invalid_plan():
+    rdf = rdflib.Graph()
+    rdf.add((EX.plan, RDF.type, namespaces.PPLAN.Plan))
+    rdf.add((EX.plan, PWO_HAS_FIRST_STEP, EX.not_a_step))
+    rdf.add((EX.step, RDF.type, namespaces.PPLAN.Step))
+    rdf.add((EX.step, namespaces.PPLAN.isStepOfPlan, EX.plan))
+    rdf.add((EX.step, namespaces.PPLAN.hasInputVar, rdflib.Literal('not a variable')))
+    rdf.add((EX.step, namespaces.PPLAN.hasOutputVar, EX.out))
+    rdf.add((EX.step, DCTERMS.description, rdflib.Literal('A step')))
+    return rdf
+
+
+def _subclass_instances():
+    """Instances of subclasses declared in the data graph are validated as well."""
+    rdf = rdflib.Graph()
+    rdf.add((EX.SpecialStep, RDFS.subClassOf, namespaces.PPLAN.Step))
+    rdf.add((EX.SpecialVariable, RDFS.subClassOf, namespaces.PPLAN.Variable))
+    rdf.add((EX.step, RDF.type, EX.SpecialStep))
+    rdf.add((EX.step, namespaces.PPLAN.hasInputVar, EX.var))
+    rdf.add((EX.var, RDF.type, EX.SpecialVariable))
+    rdf.add((EX.step, namespaces.PPLAN.hasOutputVar, rdflib.BNode('out')))
+    rdf.add((rdflib.BNode('out'), RDF.type, EX.SpecialVariable))
+    return rdf
+
+
+@pytest.mark.parametrize('rdf', [
+    pytest.param(FairWorkflow.from_function(example_workflows.fan_out_workflow).rdf, id='workflow'),
+    pytest.param(example_workflows.add._fairstep.rdf, id='step'),
+    pytest.param(_invalid_plan(), id='invalid_plan'),
+    pytest.param(_subclass_instances(), id='subclass_instances'),
+])
+def test_native_engine_gives_same_results_as_pyshacl(rdf):
+    pyshacl_conforms, pyshacl_results, _ = plex_shacl_validate(rdf, engine='pyshacl')
+    native_conforms, native_results, _ = plex_shacl_validate(rdf, engine='native')
+    assert native_conforms == pyshacl_conforms
+    assert _results(native_results) == _results(pyshacl_results)
+
+
+def test_native_engine_results_text():
+    conforms, _, results_text = plex_shacl_validate(_invalid_plan(), engine='native')
+    assert not conforms
+    assert 'Results (4):' in results_text
+    assert 'Value does not have class p-plan:Step' in results_text
+    assert 'Value is not of Node Kind sh:BlankNodeOrIRI' in results_text
+
+
+def test_unknown_shacl_engine():
+    with pytest.raises(ValueError):
+        plex_shacl_validate(_invalid_plan(), engine='unknown')
+
+
+def test_unsupported_constraint():
+    shapes = rdflib.Graph()
+    shapes.parse(data=get_plex_shapes_graph().serialize(format='nt'), format='nt')
+    shape = rdflib.URIRef('https://astrea.linkeddata.es/shapes#21feca0aa2ac782b9be4ee7f6439de32')
+    shapes.add((shape, SH.minCount, rdflib.Literal(1)))
+    with pytest.raises(ValueError):
+        PlexValidator(shapes)
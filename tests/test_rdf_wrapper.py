@@ -4,7 +4,11 @@ from unittest import mock
 import pytest
 import rdflib
 
-from fairworkflows.rdf_wrapper import RdfWrapper
+from fairworkflows import FairWorkflow, LINGSYS_ENGLISH, LINGSYS_PYTHON
+from fairworkflows.rdf_wrapper import (NAMESPACE_BINDINGS, RdfWrapper, copy_triples,
+                                         get_plex_shapes_graph, get_reachable_triples, replace_all_in_rdf,
+                                         shacl_validate_all)
+from tests import example_workflows
 
 
 class TestRdfWrapper:
@@ -40,9 +44,142 @@ class TestRdfWrapper:
         with pytest.raises(ValueError):
             wrapper._publish_as_nanopub(derived_from=['http:example.nl/workflow2'])
 
-    @mock.patch('fairworkflows.rdf_wrapper.NanopubClient.publish')
+    @mock.patch('nanopub.NanopubClient.publish')
     def test_publish_as_nanopub_with_kwargs(self, nanopub_wrapper_publish_mock):
         wrapper = RdfWrapper(uri='test', derived_from=['http:example.nl/workflow1'])
         wrapper.rdf.add((rdflib.Literal('test'), rdflib.Literal('test'), rdflib.Literal('test')))
         # attribute_asseriton_to_profile is kwarg for nanopub.Publication.from_assertion()
         wrapper._publish_as_nanopub(attribute_assertion_to_profile=True)
+
+    def test_namespaces_bound(self):
+        wrapper = RdfWrapper(uri='test')
+        other_wrapper = RdfWrapper(uri='test')
+        wrapper.rdf.bind('pplan', 'http://www.example.org/pplan#')
+        for rdf in [wrapper.rdf, other_wrapper.rdf]:
+            namespaces = dict(rdf.namespaces())
+            for prefix, namespace in NAMESPACE_BINDINGS:
+                assert namespaces[prefix] == namespace
+            # The default rdflib bindings are still there
+            assert namespaces['rdf'] == rdflib.RDF.uri
+        # Bindings are not shared between wrappers
+        assert dict(wrapper.rdf.namespaces())['pplan1'] == rdflib.URIRef(
+            'http://www.example.org/pplan#')
+        assert 'pplan1' not in dict(other_wrapper.rdf.namespaces())
+
+    def test_set_language(self):
+        wrapper = RdfWrapper(uri='test', language=LINGSYS_ENGLISH)
+        assert wrapper.language.label == LINGSYS_ENGLISH.label
+        wrapper.language = LINGSYS_PYTHON
+        assert wrapper.language.label == LINGSYS_PYTHON.label
+        assert wrapper.language.version_info == LINGSYS_PYTHON.version_info
+        assert len(list(wrapper.rdf.triples((wrapper.lingsys_ref, None, None)))) == len(
+            list(LINGSYS_PYTHON.triples(wrapper.lingsys_ref)))
+
+
+def _generate_test_graph(n_nodes=300):
+    """Generate a graph with a tree of nodes reachable from the root, and unreachable noise."""
+    ex = rdflib.Namespace('http://www.example.org/')
+    rdf = rdflib.Graph()
+    for i in range(1, n_nodes):
+        rdf.add((ex[f'node{i // 3}'], ex.hasChild, ex[f'node{i}']))
+        rdf.add((ex[f'node{i}'], rdflib.RDFS.label, rdflib.Literal(f'Node {i}')))
+        rdf.add((ex[f'noise{i}'], ex.points, ex[f'node{i}']))
+    # A cycle, and a triple that should not be followed
+    rdf.add((ex[f'node{n_nodes - 1}'], ex.hasChild, ex.node0))
+    rdf.add((ex.node1, ex.excluded, ex.noise1))
+    return rdf, ex
+
+
+@pytest.mark.parametrize('excluded', [False, True])
+def test_get_reachable_triples_matches_sparql(excluded):
+    rdf, ex = _generate_test_graph()
+    root = ex.node0
+    excluded_predicates = [ex.excluded] if excluded else []
+
+    # The SPARQL property path query that get_reachable_triples replaces
+    sparql_rdf = rdflib.Graph()
+    for triple in rdf:
+        if triple[1] not in excluded_predicates:
+            sparql_rdf.add(triple)
+    q = """
+    CONSTRUCT { ?s ?p ?o }
+    WHERE {
+        ?s ?p ?o .
+        ?root (<>|!<>)* ?s .
+    }
+    """
+    expected = set(sparql_rdf.query(q, initBindings={'root': root}))
+
+    result = get_reachable_triples(rdf, root, excluded_predicates=excluded_predicates)
+    assert set(result) == expected
+    assert ((ex.noise1, ex.points, ex.node1) in result) == (not excluded)
+
+
+def test_get_reachable_triples_does_not_share_namespaces():
+    rdf, ex = _generate_test_graph()
+    rdf.bind('ex', ex)
+    result = get_reachable_triples(rdf, ex.node0)
+    assert dict(result.namespaces())['ex'] == rdflib.URIRef(ex)
+    result.bind('other', rdflib.Namespace('http://www.example.org/other/'))
+    result.serialize(format='turtle')
+    assert 'other' not in dict(rdf.namespaces())
+
+
+def test_copy_triples_does_not_share_namespaces():
+    rdf, ex = _generate_test_graph()
+    rdf.bind('ex', ex)
+    copy = copy_triples(rdf)
+    assert set(copy) == set(rdf)
+    assert dict(copy.namespaces())['ex'] == rdflib.URIRef(ex)
+    copy.bind('other', rdflib.Namespace('http://www.example.org/other/'))
+    copy.serialize(format='turtle')
+    assert 'other' not in dict(rdf.namespaces())
+
+
+def test_replace_all_in_rdf():
+    ex = rdflib.Namespace('http://www.example.org/')
+    rdf = rdflib.Graph()
+    rdf.add((ex.old1, ex.predicate, ex.other))
+    rdf.add((ex.other, ex.old2, ex.old1))
+    rdf.add((ex.old1, ex.predicate, ex.old1))
+    rdf.add((ex.other, ex.predicate, rdflib.Literal('untouched')))
+
+    replace_all_in_rdf(rdf, {ex.old1: ex.new1, ex.old2: ex.new2})
+
+    assert set(rdf) == {
+        (ex.new1, ex.predicate, ex.other),
+        (ex.other, ex.new2, ex.new1),
+        (ex.new1, ex.predicate, ex.new1),
+        (ex.other, ex.predicate, rdflib.Literal('untouched')),
+    }
+
+
+def test_replace_all_in_rdf_keeps_named_graphs():
+    ex = rdflib.Namespace('http://www.example.org/')
+    rdf = rdflib.ConjunctiveGraph()
+    rdf.get_context(ex.graph1).add((ex.old, ex.predicate, ex.other))
+    rdf.get_context(ex.graph2).add((ex.other, ex.predicate, ex.old))
+
+    replace_all_in_rdf(rdf, {ex.old: ex.new})
+
+    assert set(rdf.get_context(ex.graph1)) == {(ex.new, ex.predicate, ex.other)}
+    assert set(rdf.get_context(ex.graph2)) == {(ex.other, ex.predicate, ex.new)}
+
+
+def test_plex_shapes_graph_is_parsed_once():
+    assert get_plex_shapes_graph() is get_plex_shapes_graph()
+    assert len(get_plex_shapes_graph()) > 0
+
+
+def test_shacl_validate_all():
+    """Violations are attributed to the object they occur in, despite the shared self_ref."""
+    workflow = FairWorkflow.from_function(example_workflows.fan_out_workflow)
+    step = example_workflows.add._fairstep  # Has blank node variables, which violates the shapes
+    workflow_rdf_length = len(workflow.rdf)
+
+    results = shacl_validate_all([workflow, step, workflow])
+
+    assert [conforms for conforms, _ in results] == [True, False, True]
+    assert 'Results (3)' in results[1][1]
+    assert 'NodeKindConstraintComponent' in results[1][1]
+    assert len(workflow.rdf) == workflow_rdf_length
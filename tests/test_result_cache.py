@@ -0,0 +1,90 @@
+import os
+import pickle
+from unittest import mock
+
+import pytest
+
+from fairworkflows.result_cache import MemoryResultCache, DiskResultCache, result_cache_key, \
+    step_fingerprint
+
+
+def test_result_cache_key():
+    fingerprint = step_fingerprint('def add(a, b):\n    return a + b', 'python')
+    key = result_cache_key(fingerprint, ['a', 'b'], (1, 2), {})
+    assert key == result_cache_key(fingerprint, ['a'], (1,), {'b': 2})
+    assert key != result_cache_key(fingerprint, ['a', 'b'], (1, 3), {})
+    other_fingerprint = step_fingerprint('def add(a, b):\n    return b + a', 'python')
+    assert key != result_cache_key(other_fingerprint, ['a', 'b'], (1, 2), {})
+    # Arguments that can not be pickled can not be cached
+    assert result_cache_key(fingerprint, ['a', 'b'], (1, lambda: 2), {}) is None
+
+
+@pytest.mark.parametrize('cache_type', ['memory', 'disk'])
+def test_put_and_get(tmp_path, cache_type):
+    cache = MemoryResultCache() if cache_type == 'memory' else DiskResultCache(tmp_path)
+    with pytest.raises(KeyError):
+        cache.get('key')
+    result = {'value': [1, 2, 3]}
+    cache.put('key', result)
+    assert cache.get('key') == result
+    cache.get('key')['value'].append(4)
+    assert cache.get('key') == result  # Cached results are not changed by their users
+    cache.put('none', None)
+    assert cache.get('none') is None
+    cache.clear()
+    with pytest.raises(KeyError):
+        cache.get('key')
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryResultCache()
+    for i in range(3):
+        cache.put(f'key{i}', i)
+    entry_size = len(cache._entries['key0'])
+    cache.get('key0')  # Using the first entry makes the second one the least recently used
+    cache.max_size = 3 * entry_size
+    cache.put('key3', 3)
+    assert len(cache) == 3
+    with pytest.raises(KeyError):
+        cache.get('key1')
+    assert [cache.get(key) for key in ['key0', 'key2', 'key3']] == [0, 2, 3]
+
+
+@pytest.mark.parametrize('data', [b'', b'not a pickle', pickle.dumps([1, 2, 3])[:-2]],
+                         ids=['empty', 'garbage', 'truncated'])
+def test_disk_cache_treats_corrupt_entry_as_miss(tmp_path, data):
+    cache = DiskResultCache(tmp_path)
+    cache.put('key', [1, 2, 3])
+    cache._path('key').write_bytes(data)
+    with pytest.raises(KeyError):
+        cache.get('key')
+    assert not cache._path('key').exists()  # The corrupt entry is removed
+    cache.put('key', [1, 2, 3])
+    assert cache.get('key') == [1, 2, 3]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskResultCache(tmp_path)
+    for i in range(3):
+        cache.put(f'key{i}', i)
+        # Make sure the modification times are ordered
+        os.utime(cache._path(f'key{i}'), (i, i))
+    entry_size = cache._path('key0').stat().st_size
+    cache.get('key0')  # Using the first entry makes the second one the least recently used
+    cache.max_size = 3 * entry_size
+    cache.put('key3', 3)
+    with pytest.raises(KeyError):
+        cache.get('key1')
+    assert [cache.get(key) for key in ['key0', 'key2', 'key3']] == [0, 2, 3]
+
+
+def test_disk_cache_does_not_scan_directory_on_every_put(tmp_path):
+    cache = DiskResultCache(tmp_path)
+    with mock.patch.object(cache._files, '_evict', wraps=cache._files._evict) as mock_evict:
+        for i in range(10):
+            cache.put(f'key{i}', i)
+        assert mock_evict.call_count == 1  # Only on the first put, to get the total size
+        cache.max_size = cache._path('key0').stat().st_size
+        cache.put('key10', 10)
+        assert mock_evict.call_count == 2
+    assert [path.name for path in tmp_path.glob('*.pickle')] == ['key10.pickle']
@@ -0,0 +1,52 @@
+import hashlib
+import pickle
+from datetime import datetime
+
+import pytest
+
+from fairworkflows.value_policy import ValuePolicy, BlobStore
+
+
+@pytest.mark.parametrize('value', [None, True, 1, 1.5, 'short', datetime(2021, 1, 1), 10 ** 100])
+def test_inline_small_scalars(value):
+    assert ValuePolicy().should_inline(value)
+
+
+@pytest.mark.parametrize('value', ['x' * 2000, 10 ** 5000, [1, 2, 3], {'a': 1}, b'bytes'],
+                         ids=['long_str', 'large_int', 'list', 'dict', 'bytes'])
+def test_reference_large_and_non_scalar_values(value):
+    assert not ValuePolicy().should_inline(value)
+
+
+def test_reference():
+    value = list(range(1000))
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    reference = ValuePolicy().reference(value)
+    assert reference.value_type == 'builtins.list'
+    assert reference.digest == hashlib.sha256(data).hexdigest()
+    assert reference.size == len(data)
+    assert reference.path is None
+
+    reference = ValuePolicy().reference('x' * 2000)
+    assert reference.digest == hashlib.sha256(b'x' * 2000).hexdigest()
+
+
+def test_reference_value_that_can_not_be_pickled():
+    reference = ValuePolicy().reference(lambda: 1)
+    assert reference.value_type == 'builtins.function'
+    assert reference.digest is None
+    assert reference.size is None
+
+
+def test_blob_store(tmp_path):
+    blob_store = BlobStore(tmp_path)
+    policy = ValuePolicy(blob_store=blob_store)
+    value = b'\x00' * 10000
+    reference = policy.reference(value)
+    assert reference.path == blob_store.path(reference.digest)
+    assert blob_store.get(reference.digest) == value
+    # The same value is stored once
+    assert policy.reference(bytearray(value)).path == reference.path
+    assert len(list(tmp_path.rglob('*'))) == 2  # The value and its directory
+    with pytest.raises(KeyError):
+        blob_store.get('0' * 64)